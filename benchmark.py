@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+期权链处理性能基准
+对比原逐行实现与当前向量化实现在不同期权链规模下的耗时和期权链内存占用，
+并基于OpenD回放替身测量各API接口在不同期权链规模和并发下的p50/p99延迟与吞吐
+用法: python3 benchmark.py [--sizes 100 1000 10000] [--suite processing|routes|all]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from option_pricing import IV_MIN, bs_price, implied_volatility
+
+from option_chain_api import (QUOTE_FIELD_DEFAULTS, OptionChainFrame, compute_option_ev, format_csv_content,
+                              generate_csv_data, merge_quote_data)
+
+# 测试数据
+def make_chain(n_contracts: int, n_expiries: int = 1, seed: int = 0,
+               quote_ratio: float = 0.95) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """生成与get_option_chain/get_stock_quote结构一致的模拟期权链和报价"""
+    rng = np.random.default_rng(seed)
+    per_expiry = max(2, n_contracts // n_expiries)
+    strikes_per_expiry = max(1, per_expiry // 2)
+
+    rows = []
+    for e in range(n_expiries):
+        expiry = (pd.Timestamp('2025-01-17') + pd.Timedelta(weeks=e)).strftime('%Y-%m-%d')
+        tag = expiry[2:].replace('-', '')
+        for k in range(strikes_per_expiry):
+            strike = 100.0 + k * 0.5
+            for option_type, letter in (('CALL', 'C'), ('PUT', 'P')):
+                code = f"US.SPY{tag}{letter}{int(strike * 1000)}"
+                rows.append({
+                    'code': code,
+                    'name': f"SPY {tag} {strike:g} {'购' if letter == 'C' else '沽'}",
+                    'lot_size': 100,
+                    'stock_type': 'DRVT',
+                    'option_type': option_type,
+                    'stock_owner': 'US.SPY',
+                    'strike_time': expiry,
+                    'strike_price': strike,
+                    'suspension': False,
+                    'stock_id': 80000000 + len(rows),
+                })
+    chain = pd.DataFrame(rows[:n_contracts])
+
+    quoted = chain['code'].sample(frac=quote_ratio, random_state=seed).tolist()
+    n = len(quoted)
+    last = rng.uniform(0.01, 20.0, n).round(2)
+    quotes = pd.DataFrame({
+        'code': quoted,
+        'last_price': last,
+        'open_price': (last * rng.uniform(0.9, 1.1, n)).round(2),
+        'high_price': (last * rng.uniform(1.0, 1.2, n)).round(2),
+        'low_price': (last * rng.uniform(0.8, 1.0, n)).round(2),
+        'prev_close_price': (last * rng.uniform(0.8, 1.2, n)).round(2),
+        'volume': rng.integers(0, 50000, n),
+        'turnover': rng.uniform(0, 1e6, n).round(2),
+        'turnover_rate': rng.uniform(0, 5, n).round(3),
+        'amplitude': rng.uniform(0, 30, n).round(3),
+        'open_interest': rng.integers(0, 100000, n),
+        'implied_volatility': rng.uniform(5, 150, n).round(3),
+        'delta': rng.uniform(-1, 1, n).round(4),
+        'gamma': rng.uniform(0, 0.2, n).round(4),
+        'vega': rng.uniform(0, 0.5, n).round(4),
+        'theta': rng.uniform(-0.5, 0, n).round(4),
+        'rho': rng.uniform(-0.2, 0.2, n).round(4),
+        'premium': rng.uniform(-5, 30, n).round(3),
+    })
+    return chain, quotes
+
+# 原实现（用于对比）
+def legacy_merge_quote_data(df: pd.DataFrame, quote_data: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """原enrich_option_data中的逐行合并逻辑"""
+    enriched_df = df.copy()
+    for field, default in QUOTE_FIELD_DEFAULTS.items():
+        enriched_df[field] = default
+
+    if quote_data is not None and not quote_data.empty:
+        quote_dict = {}
+        for _, row in quote_data.iterrows():
+            quote_dict[row['code']] = row
+
+        for idx, row in df.iterrows():
+            code = row['code']
+            if code in quote_dict:
+                quote_row = quote_dict[code]
+                for field, default in QUOTE_FIELD_DEFAULTS.items():
+                    enriched_df.at[idx, field] = quote_row.get(field, default)
+    return enriched_df
+
+def legacy_generate_csv_content(df: pd.DataFrame, target_date: str) -> str:
+    """原generate_csv_data的逐行权价分组格式化及路由中的 += 字符串拼接"""
+    target_date_obj = datetime.strptime(target_date, '%Y-%m-%d').date()
+    days_to_expiry = (target_date_obj - datetime.now().date()).days
+    expiry_info = f"到期日：{target_date}(W) {days_to_expiry}天到期"
+
+    csv_data = [[
+        "时间价值", "盈利概率", "Vega", "Theta", "Gamma", "Delta",
+        "未平仓数", "成交量", "涨跌幅", "最新价", "中间价", "隐含波动率",
+        "卖出价", "买入价", "行权价",
+        "买入价", "卖出价", "隐含波动率", "中间价", "最新价", "涨跌幅",
+        "成交量", "未平仓数", "Delta", "Gamma", "Theta", "Vega", "盈利概率", "时间价值"
+    ], [""] * 14 + [expiry_info] + [""] * 14]
+
+    for strike_price, group in df.groupby('strike_price'):
+        call_options = group[group['option_type'] == 'CALL']
+        put_options = group[group['option_type'] == 'PUT']
+        if call_options.empty or put_options.empty:
+            continue
+        call_option = call_options.iloc[0]
+        put_option = put_options.iloc[0]
+
+        call_change_pct = f"{((call_option['last_price'] - call_option['prev_close_price']) / call_option['prev_close_price'] * 100):.2f}%" if call_option['prev_close_price'] != 0 else "0.00%"
+        put_change_pct = f"{((put_option['last_price'] - put_option['prev_close_price']) / put_option['prev_close_price'] * 100):.2f}%" if put_option['prev_close_price'] != 0 else "0.00%"
+        call_mid_price = (call_option['high_price'] + call_option['low_price']) / 2
+        put_mid_price = (put_option['high_price'] + put_option['low_price']) / 2
+
+        csv_data.append([
+            f"{call_option['premium']:.2f}", f"{call_change_pct}", f"{call_option['vega']:.4f}", f"{call_option['theta']:.4f}", f"{call_option['gamma']:.4f}", f"{call_option['delta']:.4f}",
+            f"{call_option['open_interest']}张", f"{call_option['volume']}张", f"{call_change_pct}", f"{call_option['last_price']:.2f}", f"{call_mid_price:.3f}", f"{call_option['implied_volatility']:.2f}%",
+            f"{call_option['high_price']:.2f}", f"{call_option['low_price']:.2f}", str(strike_price),
+            f"{put_option['low_price']:.2f}", f"{put_option['high_price']:.2f}", f"{put_option['implied_volatility']:.2f}%", f"{put_mid_price:.3f}", f"{put_option['last_price']:.2f}", f"{put_change_pct}",
+            f"{put_option['volume']}张", f"{put_option['open_interest']}张", f"{put_option['delta']:.4f}", f"{put_option['gamma']:.4f}", f"{put_option['theta']:.4f}", f"{put_option['vega']:.4f}", f"{put_change_pct}", f"{put_option['premium']:.2f}"
+        ])
+
+    csv_content = ""
+    for row in csv_data:
+        csv_content += ','.join(f'"{cell}"' for cell in row) + '\n'
+    return csv_content
+
+def js_expected_value(df: pd.DataFrame, underlying_price: float, days_to_expiry: float) -> np.ndarray:
+    """script.js中calculateExpectedValue + calculatePotentialPayoutIntegral的逐合约1000步积分（Python移植）"""
+    results = []
+    for _, option in df.iterrows():
+        is_call = option['option_type'] == 'CALL'
+        strike = option['strike_price']
+        mid_price = (option['high_price'] + option['low_price']) / 2
+        prev = option['prev_close_price']
+        change = (option['last_price'] - prev) / prev * 100 if prev != 0 else 0.0
+        profit_prob = round(abs(change), 1) / 100
+        exercise_prob = max(0.01, min(0.99, abs(option['delta']) * 0.8 + profit_prob * 0.2))
+
+        iv = option['implied_volatility']
+        iv = iv / 100 if iv > 1 else iv
+        sigma = underlying_price * iv * math.sqrt(days_to_expiry / 252)
+        steps = 1000
+        price_range = 6 * sigma
+        total_loss = 0.0
+        for i in range(steps):
+            price = underlying_price - price_range / 2 + price_range * i / steps
+            probability = math.exp(-0.5 * ((price - underlying_price) / sigma) ** 2) / (sigma * math.sqrt(2 * math.pi))
+            loss = (price - strike) - mid_price if is_call else (strike - price) - mid_price
+            if (price > strike if is_call else price < strike) and loss > 0:
+                total_loss += loss * probability
+        payout = total_loss * (price_range / steps)
+
+        intrinsic = max(0.0, underlying_price - strike) if is_call else max(0.0, strike - underlying_price)
+        if (underlying_price > strike) if is_call else (underlying_price < strike):
+            payout += intrinsic
+        results.append(mid_price * (1 - exercise_prob) - payout * exercise_prob)
+    return np.array(results)
+
+# 计时工具
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(title: str, results: List[Dict[str, float]]):
+    """打印对比结果"""
+    print(f"\n{title}")
+    print(f"{'合约数':>8} {'原实现(ms)':>12} {'新实现(ms)':>12} {'加速比':>8}")
+    for r in results:
+        print(f"{r['size']:>8} {r['legacy'] * 1000:>12.2f} {r['current'] * 1000:>12.2f} "
+              f"{r['legacy'] / r['current']:>7.1f}x")
+
+# 基准项目
+def bench_enrich(sizes: List[int]) -> List[Dict[str, float]]:
+    """报价合并：iterrows/.at 逐行写入 vs 按code一次性对齐"""
+    results = []
+    for size in sizes:
+        chain, quotes = make_chain(size)
+        expected = legacy_merge_quote_data(chain, quotes)
+        actual = merge_quote_data(chain, quotes)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+        repeat = 1 if size >= 10000 else 3
+        results.append({
+            'size': size,
+            'legacy': best_of(lambda: legacy_merge_quote_data(chain, quotes), repeat),
+            'current': best_of(lambda: merge_quote_data(chain, quotes), repeat * 5),
+        })
+    report("报价合并 (enrich_option_data)", results)
+    return results
+
+def bench_csv(sizes: List[int], n_expiries: int = 8) -> List[Dict[str, float]]:
+    """CSV生成：按行权价分组逐格f-string + 字符串累加 vs 一次配对后整列格式化"""
+    target_date = '2025-01-17'
+    results = []
+    for size in sizes:
+        chain, quotes = make_chain(size, n_expiries=n_expiries)
+        # 多到期日时行权价错开，模拟真实期权链
+        chain['strike_price'] = chain['strike_price'] + chain.groupby('strike_time').ngroup() * 0.25
+        df = merge_quote_data(chain, quotes)
+        # 接口输出的是缓存中的紧凑期权链，按该格式核对与原实现逐字节一致
+        compact = OptionChainFrame.from_pandas(df).to_pandas()
+
+        current = lambda: format_csv_content(generate_csv_data(compact, target_date))
+        if current() != legacy_generate_csv_content(df, target_date):
+            raise AssertionError(f"{size} 个合约时CSV输出与原实现不一致")
+
+        repeat = 1 if size >= 10000 else 3
+        results.append({
+            'size': size,
+            'legacy': best_of(lambda: legacy_generate_csv_content(df, target_date), repeat),
+            'current': best_of(current, repeat * 5),
+        })
+    report(f"CSV生成 (generate_csv_data, {n_expiries}个到期日)", results)
+    return results
+
+def bench_ev(sizes: List[int], underlying_price: float = 110.0, days_to_expiry: float = 14) -> List[Dict[str, float]]:
+    """EV计算：前端逐合约1000步数值积分 vs 整链闭式解"""
+    results = []
+    for size in sizes:
+        chain, quotes = make_chain(size)
+        df = merge_quote_data(chain, quotes)
+        df = df[df['implied_volatility'] > 0]
+
+        expected = js_expected_value(df, underlying_price, days_to_expiry)
+        actual = compute_option_ev(df, underlying_price, days_to_expiry)['expected_value'].to_numpy()
+        max_diff = float(np.max(np.abs(actual - expected)))
+        if not np.allclose(actual, expected, rtol=1e-3, atol=1e-2):  # 前端左矩形积分本身有约0.1%离散误差
+            raise AssertionError(f"{size} 个合约时EV与前端算法偏差过大: {max_diff:.6f}")
+
+        repeat = 1 if size >= 10000 else 3
+        results.append({
+            'size': size,
+            'legacy': best_of(lambda: js_expected_value(df, underlying_price, days_to_expiry), repeat),
+            'current': best_of(lambda: compute_option_ev(df, underlying_price, days_to_expiry), repeat * 5),
+        })
+        print(f"  {size} 个合约 EV 最大偏差: {max_diff:.2e}")
+    report("EV计算 (compute_option_ev)", results)
+    return results
+
+# 接口端到端基准
+ROUTE_EXPIRIES = 4  # 每个合成标的的到期日数
+
+def bench_memory(sizes: List[int], n_expiries: int = 8) -> List[Dict[str, float]]:
+    """期权链内存占用和按到期日切片：object列 vs 字符串列分类编码的紧凑期权链"""
+    results = []
+    print(f"\n期权链内存占用 ({n_expiries}个到期日，deep=True)")
+    print(f"{'合约数':>8} {'原实现(MB)':>12} {'紧凑(MB)':>12} {'原实现/万合约':>14} {'紧凑/万合约':>12} {'压缩比':>8}")
+    for size in sizes:
+        chain, quotes = make_chain(size, n_expiries=n_expiries)
+        legacy = legacy_merge_quote_data(chain, quotes)
+        compact = OptionChainFrame.from_pandas(merge_quote_data(chain, quotes))
+        legacy_bytes = int(legacy.memory_usage(index=True, deep=True).sum())
+        per_10k = 10000 / max(1, len(legacy)) / 2 ** 20
+        print(f"{size:>8} {legacy_bytes / 2 ** 20:>12.2f} {compact.nbytes / 2 ** 20:>12.2f} "
+              f"{legacy_bytes * per_10k:>14.2f} {compact.nbytes * per_10k:>12.2f} {legacy_bytes / compact.nbytes:>7.1f}x")
+
+        expiries = compact.expiries()
+        for expiry in expiries:
+            expected = legacy[legacy['strike_time'] == expiry].sort_values(['option_type', 'strike_price'], kind='stable')
+            actual = compact.slice(expiry=expiry)
+            if actual['code'].tolist() != expected['code'].tolist():
+                raise AssertionError(f"{size} 个合约时 {expiry} 切片与原数据不一致")
+
+        repeat = 1 if size >= 10000 else 3
+        results.append({
+            'size': size,
+            'legacy': best_of(lambda: [legacy[legacy['strike_time'] == expiry] for expiry in expiries], repeat),
+            'current': best_of(lambda: [compact.slice(expiry=expiry) for expiry in expiries], repeat * 5),
+        })
+    report(f"按到期日切片 ({n_expiries}个到期日，布尔筛选 vs 连续视图)", results)
+    return results
+
+def scalar_implied_volatility(price: float, is_call: bool, spot: float, strike: float, t: float,
+                              rate: float) -> float:
+    """逐合约标量牛顿迭代+二分（math.erf）求解隐含波动率，作为向量化求解的对照"""
+    cdf = lambda x: 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+    low, high, sigma = 1e-4, 5.0, 0.3
+    for _ in range(100):
+        d1 = (math.log(spot / strike) + (rate + sigma * sigma / 2) * t) / (sigma * math.sqrt(t))
+        d2 = d1 - sigma * math.sqrt(t)
+        call = spot * cdf(d1) - strike * math.exp(-rate * t) * cdf(d2)
+        model = call if is_call else call - spot + strike * math.exp(-rate * t)
+        diff = model - price
+        if abs(diff) < 1e-7 * spot:
+            return sigma
+        if diff > 0:
+            high = sigma
+        else:
+            low = sigma
+        vega = spot * math.exp(-d1 * d1 / 2) / math.sqrt(2 * math.pi) * math.sqrt(t)
+        step = sigma - diff / vega if vega > 1e-12 else -1.0
+        sigma = step if low < step < high else (low + high) / 2
+    return float('nan')
+
+def bench_iv(sizes: List[int], spot: float = 100.0, rate: float = 0.04) -> List[Dict[str, float]]:
+    """隐含波动率求解：逐合约标量迭代 vs 整链向量化牛顿/二分"""
+    results = []
+    for size in sizes:
+        rng = np.random.default_rng(size)
+        is_call = rng.random(size) < 0.5
+        strike = spot * rng.uniform(0.6, 1.4, size)
+        t = rng.uniform(1 / 365, 1.0, size)
+        sigma = rng.uniform(0.08, 1.2, size)
+        price = bs_price(is_call, spot, strike, t, rate, sigma)
+        # 深度虚值合约的理论价接近0，反推波动率没有意义，与真实报价一样只保留最小价位以上的合约
+        keep = price > 0.01
+        is_call, strike, t, sigma, price = is_call[keep], strike[keep], t[keep], sigma[keep], price[keep]
+
+        solved = implied_volatility(price, is_call, spot, strike, t, rate)
+        if np.isnan(solved).any():
+            raise AssertionError(f"{size} 个合约时有 {int(np.isnan(solved).sum())} 个隐含波动率未收敛")
+        # Vega很小的合约波动率本身不敏感，按重新定价的误差校验
+        price_error = float(np.max(np.abs(bs_price(is_call, spot, strike, t, rate, solved) - price)))
+        if price_error > 1e-6 * spot:
+            raise AssertionError(f"{size} 个合约时隐含波动率重新定价偏差过大: {price_error:.2e}")
+        # 没有可分辨时间价值的深度价内合约波动率无法确定，返回IV_MIN，不计入波动率偏差
+        informative = solved > IV_MIN
+        max_diff = float(np.max(np.abs(solved - sigma)[informative]))
+
+        legacy = lambda: [scalar_implied_volatility(*args, rate) for args in
+                          zip(price.tolist(), is_call.tolist(), [spot] * len(price), strike.tolist(), t.tolist())]
+        repeat = 1 if size >= 10000 else 3
+        results.append({
+            'size': size,
+            'legacy': best_of(legacy, repeat),
+            'current': best_of(lambda: implied_volatility(price, is_call, spot, strike, t, rate), repeat * 5),
+        })
+        print(f"  {size} 个合约 隐含波动率最大偏差: {max_diff:.2e}（{int((~informative).sum())} 个合约无时间价值）")
+    report("隐含波动率求解 (implied_volatility)", results)
+    return results
+
+def route_cases(code: str, expiry: str) -> List[Tuple[str, str, str, Optional[dict]]]:
+    """(名称, 方法, 路径, 请求体)"""
+    chain = {"stock_code": code, "target_date": expiry}
+    return [
+        ("expiration-dates", "GET", f"/api/expiration-dates/{code}", None),
+        ("option-chain", "POST", "/api/option-chain", chain),
+        ("option-chain columnar", "POST", "/api/option-chain?format=columnar", chain),
+        ("option-chain arrow", "POST", "/api/option-chain?format=arrow", chain),
+        ("generate-csv", "POST", "/api/generate-csv", chain),
+        ("download-csv", "POST", "/api/download-csv", chain),
+        ("term-structure", "POST", "/api/term-structure", {"stock_code": code, "max_expiries": ROUTE_EXPIRIES}),
+        ("ev", "POST", "/api/ev", chain),
+        ("scan", "POST", "/api/scan", {"symbols": [code], "max_expiries": 2}),
+    ]
+
+def replay_dataset(sizes: List[int]):
+    """每个规模一个合成标的 US.B<size>，每个到期日 size 个合约"""
+    from opend_replay import ReplayData, synthetic_data
+
+    parts = [synthetic_data({f"US.B{size}": 100.0}, n_expiries=ROUTE_EXPIRIES,
+                            strikes_per_expiry=max(1, size // 2), seed=i)
+             for i, size in enumerate(sizes)]
+    return ReplayData(pd.concat([part.chains for part in parts], ignore_index=True),
+                      pd.concat([part.quotes.reset_index(drop=True) for part in parts], ignore_index=True),
+                      {code: price for part in parts for code, price in part.underlying.items()})
+
+def check_route_response(method: str, path: str, response) -> None:
+    """除状态码外还要校验响应内容：JSON须success为真，NDJSON的每个标的须成功，CSV/二进制格式须非空"""
+    where = f"{method} {path}"
+    if response.status_code != 200:
+        raise AssertionError(f"{where} 返回 {response.status_code}: {response.text[:200]}")
+    content_type = response.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        payload = response.json()
+        if not payload.get('success'):
+            raise AssertionError(f"{where} 返回失败: {str(payload)[:200]}")
+    elif content_type.startswith('application/x-ndjson'):
+        lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        failed = [line for line in lines if line.get('type') == 'symbol' and not line.get('success')]
+        if not lines or failed:
+            raise AssertionError(f"{where} 有标的扫描失败: {str(failed)[:200]}")
+    elif content_type.startswith(('text/csv', 'application/vnd.apache.arrow', 'application/vnd.apache.parquet')):
+        if not response.content:
+            raise AssertionError(f"{where} 返回空内容")
+    else:
+        raise AssertionError(f"{where} 返回了意外的内容类型: {content_type}")
+
+async def measure_route(client, method: str, path: str, body: Optional[dict],
+                        concurrency: int, total: int) -> Dict[str, float]:
+    """以固定并发发出total个请求，返回延迟分位数和吞吐"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            check_route_response(method, path, response)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(total)])
+    wall = time.perf_counter() - start
+    return {
+        'p50': float(np.percentile(latencies, 50)),
+        'p99': float(np.percentile(latencies, 99)),
+        'rps': total / wall,
+    }
+
+def bench_routes(sizes: List[int], concurrency_levels: List[int], total: int, latency_ms: float,
+                 push_delay_ms: float, cached: bool, verbose: bool) -> List[Dict[str, Any]]:
+    """通过ASGI直接调用各接口，OpenD由回放替身代替，可注入调用延迟和推送延迟"""
+    try:
+        import httpx
+    except ImportError:
+        print("\n⚠️ 未安装httpx，跳过接口基准")
+        return []
+    import option_chain_api as api
+    from opend_replay import ReplayFaults, replay_context_factory
+
+    data = replay_dataset(sizes)
+    faults = ReplayFaults(latency=latency_ms / 1000, push_delay=push_delay_ms / 1000, seed=0)
+    api.opend_pool.context_factory = replay_context_factory(data, faults, quota=len(data.quotes) + 1000)
+    api.opend_scheduler.configure({})  # 回放替身没有频率限制，只测量代码本身
+    if not cached:
+        api.chain_cache.ttl = -1  # 每个请求都回源，只保留并发请求合并
+
+    async def run() -> List[Dict[str, Any]]:
+        results = []
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+            for size in sizes:
+                code = f"US.B{size}"
+                expiry = data.expirations(code)['strike_time'].iloc[0]
+                for name, method, path, body in route_cases(code, expiry):
+                    await measure_route(client, method, path, body, 1, 1)  # 预热：建连和首次订阅
+                    for concurrency in concurrency_levels:
+                        result = await measure_route(client, method, path, body, concurrency, total)
+                        result.update({'route': name, 'size': size, 'concurrency': concurrency})
+                        results.append(result)
+                        print(f"{name:>22} {size:>8} {concurrency:>6} {result['p50'] * 1000:>10.1f} "
+                              f"{result['p99'] * 1000:>10.1f} {result['rps']:>10.1f}", file=sys.__stdout__)
+        return results
+
+    print(f"\n接口端到端延迟（回放替身，调用延迟 {latency_ms}ms，推送延迟 {push_delay_ms}ms，"
+          f"{'启用' if cached else '关闭'}快照缓存，每档 {total} 个请求）")
+    print(f"{'接口':>22} {'合约数':>8} {'并发':>6} {'p50(ms)':>10} {'p99(ms)':>10} {'吞吐(次/秒)':>10}")
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with quiet:
+            return asyncio.run(run())
+    finally:
+        api.subscription_manager.close()
+        api.opend_pool.close_all()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="期权链处理性能基准")
+    parser.add_argument('--suite', choices=['processing', 'routes', 'all'], default='all',
+                        help="processing: 数据处理对比；routes: 接口端到端延迟")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help="期权链合约数")
+    parser.add_argument('--route-sizes', type=int, nargs='+', default=[100, 1000],
+                        help="接口基准中每个到期日的合约数")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help="接口基准的并发数")
+    parser.add_argument('--requests', type=int, default=50, help="每个接口每档并发的请求数")
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="回放替身每次调用的延迟")
+    parser.add_argument('--push-delay-ms', type=float, default=10.0, help="回放替身订阅后首次推送的延迟")
+    parser.add_argument('--cached', action='store_true', help="启用期权链快照缓存")
+    parser.add_argument('--verbose', action='store_true', help="显示服务日志")
+    args = parser.parse_args()
+
+    if args.suite in ('processing', 'all'):
+        bench_enrich(args.sizes)
+        bench_csv(args.sizes)
+        bench_ev(args.sizes)
+        bench_memory(args.sizes)
+        bench_iv(args.sizes)
+    if args.suite in ('routes', 'all'):
+        bench_routes(args.route_sizes, args.concurrency, args.requests, args.latency_ms,
+                     args.push_delay_ms, args.cached, args.verbose)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenD行情broker
+生产模式下由一个broker进程独占OpenD连接和订阅，多个API worker进程通过Unix socket向其请求期权链；
+broker把补全后的期权链快照写成Arrow IPC文件放在共享内存目录（/dev/shm）中，worker按路径内存映射读取，
+数值列不经复制直接转为DataFrame。OpenD始终只看到一个客户端，API吞吐随worker数扩展。
+用法: python3 option_chain_api.py --workers 4
+      python3 opend_broker.py serve --socket /tmp/opend-broker.sock
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # 多worker模式必需
+    pa = None
+
+# broker配置
+BROKER_SOCKET = os.environ.get('OPEND_BROKER_SOCKET', '')  # 留空时按进程号生成
+BROKER_SHM_DIR = os.environ.get('OPEND_BROKER_SHM_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+BROKER_SNAPSHOT_KEEP = 4  # 每条期权链保留的最近快照文件数
+BROKER_SNAPSHOT_GRACE = 30.0  # 快照文件被替换后至少保留的秒数，给正在读取的worker留出时间
+BROKER_TIMEOUT = float(os.environ.get('OPEND_BROKER_TIMEOUT', '60'))  # worker等待broker应答的秒数
+BROKER_START_TIMEOUT = 30.0  # 启动时等待broker就绪的秒数
+
+_HEADER = struct.Struct('>I')  # 消息格式：4字节长度 + UTF-8 JSON
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message, ensure_ascii=False, default=str).encode('utf-8')
+    return _HEADER.pack(len(body)) + body
+
+# 共享内存快照
+class SnapshotPublisher:
+    """把期权链快照写成Arrow IPC文件，内容不变时复用已有文件，旧文件过了宽限期后删除"""
+
+    def __init__(self, directory: str = BROKER_SHM_DIR, keep: int = BROKER_SNAPSHOT_KEEP,
+                 grace: float = BROKER_SNAPSHOT_GRACE):
+        self.directory = os.path.join(directory, f"option-chain-{os.getpid()}")
+        self.keep = keep
+        self.grace = grace
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple, deque] = {}  # 期权链 -> 最近的快照文件
+        self._files: "OrderedDict[str, float]" = OrderedDict()  # 文件 -> 最近使用时间
+
+        # 统计信息
+        self._published = 0
+        self._reused = 0
+        self._removed = 0
+        self._bytes = 0
+
+    def publish(self, key: Tuple, df: pd.DataFrame) -> str:
+        """写入快照并返回文件路径"""
+        digest = hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes(), digest_size=12)
+        path = os.path.join(self.directory, f"{digest.hexdigest()}.arrow")
+        with self._lock:
+            reused = path in self._files
+            if reused:
+                self._files[path] = time.time()
+                self._files.move_to_end(path)
+                self._reused += 1
+        if not reused:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            with pa.OSFile(path + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(path + '.tmp', path)
+            with self._lock:
+                self._files[path] = time.time()
+                self._published += 1
+                self._bytes += os.path.getsize(path)
+
+        with self._lock:
+            series = self._series.setdefault(key, deque())
+            if not series or series[-1] != path:
+                series.append(path)
+            while len(series) > self.keep:
+                series.popleft()
+            self._collect()
+        return path
+
+    def _collect(self):
+        """删除已不是任何期权链最近快照、且超过宽限期的文件（调用方持有锁）"""
+        current = {path for series in self._series.values() for path in series}
+        deadline = time.time() - self.grace
+        for path, used in list(self._files.items()):
+            if used > deadline:
+                break
+            if path in current:
+                continue
+            del self._files[path]
+            try:
+                self._bytes -= os.path.getsize(path)
+                os.unlink(path)  # 已映射该文件的worker不受影响
+                self._removed += 1
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            for path in self._files:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self._files.clear()
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "files": len(self._files),
+                "bytes": self._bytes,
+                "published": self._published,
+                "reused": self._reused,
+                "removed": self._removed,
+            }
+
+# broker服务端
+class OpenDBroker:
+    """在broker进程中运行：复用option_chain_api的缓存、连接池和订阅管理，按worker的请求返回快照文件"""
+
+    def __init__(self, socket_path: str):
+        import option_chain_api as api
+        self.api = api
+        self.socket_path = socket_path
+        self.publisher = SnapshotPublisher()
+        self._requests = 0
+        self._errors = 0
+
+    async def _snapshot(self, key: Tuple, df: Optional[pd.DataFrame]) -> Dict[str, Any]:
+        if df is None:
+            return {"ok": True, "path": None}
+        # 编码在线程池中进行，不阻塞其他worker的请求
+        path = await asyncio.get_running_loop().run_in_executor(None, self.publisher.publish, key, df)
+        return {"ok": True, "path": path, "attrs": df.attrs}
+
+    async def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        api = self.api
+        op = request.get('op')
+        params = request.get('params') or {}
+        if op == 'chain':
+            chain_filter = api.ChainFilter(*params.get('chain_filter') or ())
+            df = await api.fetch_option_chain_snapshot(params['code'], params['target_date'], chain_filter)
+            return await self._snapshot(('chain', params['code'], params['target_date'], chain_filter), df)
+        if op == 'term':
+            df = await api.fetch_term_structure_snapshot(params['code'], params.get('start_date'),
+                                                         params.get('end_date'), params.get('max_expiries'))
+            return await self._snapshot(('term', params['code'], params.get('start_date'), params.get('end_date'),
+                                         params.get('max_expiries')), df)
+        if op == 'expirations':
+            return {"ok": True, "expirations": await api.expiration_index.aget(params['code'])}
+        if op == 'subscription_status':
+            data = api.subscription_manager.stats()
+            data["opend"] = await api.opend_executor.run(api.subscription_manager.opend_usage)
+            return {"ok": True, "data": data}
+        if op == 'stats':
+            return {"ok": True, "data": await self.stats()}
+        return {"ok": False, "error": f"未知操作 {op}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """一个worker线程一条连接，按顺序处理请求"""
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(_HEADER.size)
+                    request = json.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+                except asyncio.IncompleteReadError:
+                    break
+                self._requests += 1
+                try:
+                    # 按worker请求的优先级排队，扫描请求不会挤占界面请求的OpenD限额
+                    with self.api.opend_priority(request.get('priority') or 'interactive'):
+                        reply = await self.dispatch(request)
+                except Exception as e:
+                    self._errors += 1
+                    reply = {"ok": False, "error": str(e)}
+                writer.write(_encode(reply))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def stats(self) -> Dict[str, Any]:
+        api = self.api
+        return {
+            "pid": os.getpid(),
+            "requests": self._requests,
+            "errors": self._errors,
+            "snapshots": self.publisher.stats(),
+            "pool": api.opend_pool.stats(),
+            "subscriptions": api.subscription_manager.stats(),
+            "cache": api.chain_cache.stats(),
+            "executor": api.opend_executor.stats(),
+            "stages": api.opend_stages.stats(),
+            "scheduler": api.opend_scheduler.stats(),
+            "quotes": api.quote_fetcher.stats(),
+            "history": await asyncio.get_running_loop().run_in_executor(None, api.chain_history.stats),
+        }
+
+    async def serve(self):
+        """启动后台服务并监听socket，收到SIGTERM/SIGINT后退订并关闭连接"""
+        api = self.api
+        api.start_background_services()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        print(f"🛰️ OpenD broker已启动: {self.socket_path}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            api.shutdown_opend_pool()
+            self.publisher.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+            print("🛰️ OpenD broker已停止")
+
+# worker客户端
+class BrokerClient:
+    """worker进程访问broker的客户端：每个线程一条长连接，连接断开时重连一次"""
+
+    def __init__(self, socket_path: str, timeout: float = BROKER_TIMEOUT,
+                 priority: Optional[Callable[[], str]] = None):
+        if pa is None:
+            raise RuntimeError("多worker模式需要安装pyarrow")
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.priority = priority  # 返回当前调用的OpenD优先级，随请求发给broker
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sockets: List[socket.socket] = []
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+            with self._lock:
+                self._sockets.append(sock)
+        return sock
+
+    def _discard(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            with self._lock:
+                if sock in self._sockets:
+                    self._sockets.remove(sock)
+            sock.close()
+
+    @staticmethod
+    def _receive(sock: socket.socket, size: int) -> bytes:
+        chunks = []
+        while size:
+            chunk = sock.recv(min(size, 1 << 20))
+            if not chunk:
+                raise ConnectionError("broker连接已关闭")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def call(self, op: str, **params) -> Dict[str, Any]:
+        """发送请求并等待应答，broker返回错误时抛出RuntimeError"""
+        message = _encode({"op": op, "params": params, "priority": self.priority() if self.priority else None})
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(message)
+                size = _HEADER.unpack(self._receive(sock, _HEADER.size))[0]
+                reply = json.loads(self._receive(sock, size))
+                break
+            except OSError:
+                # 超时后连接上可能还有迟到的应答，不能复用
+                self._discard()
+                if attempt:
+                    raise
+        if not reply.get('ok'):
+            raise RuntimeError(reply.get('error') or "broker请求失败")
+        return reply
+
+    def snapshot(self, op: str, **params) -> Optional[pd.DataFrame]:
+        """请求期权链快照，内存映射读取broker写入的Arrow文件"""
+        reply = self.call(op, **params)
+        if reply.get('path') is None:
+            return None
+        # 数值列直接引用映射的内存，文件被broker删除后映射仍然有效
+        table = pa.ipc.open_file(pa.memory_map(reply['path'])).read_all()
+        df = table.to_pandas(split_blocks=True)
+        df.attrs = reply.get('attrs') or {}
+        return df
+
+    def close(self):
+        with self._lock:
+            sockets, self._sockets = self._sockets, []
+        for sock in sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+# 生产模式启动
+def run_production(workers: int, host: str = '0.0.0.0', port: int = 8000):
+    """启动broker进程和N个uvicorn worker，退出时一并停止broker"""
+    import uvicorn
+    if pa is None:
+        raise RuntimeError("多worker模式需要安装pyarrow")
+    socket_path = BROKER_SOCKET or os.path.join(tempfile.gettempdir(), f"opend-broker-{os.getpid()}.sock")
+    env = dict(os.environ)
+    env.pop('OPEND_BROKER', None)
+    broker = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', '--socket', socket_path], env=env)
+
+    deadline = time.monotonic() + BROKER_START_TIMEOUT
+    while not os.path.exists(socket_path):
+        if broker.poll() is not None:
+            raise RuntimeError(f"broker启动失败，退出码 {broker.returncode}")
+        if time.monotonic() > deadline:
+            broker.terminate()
+            raise RuntimeError("等待broker启动超时")
+        time.sleep(0.1)
+
+    # worker进程继承环境变量，据此把OpenD调用交给broker
+    os.environ['OPEND_BROKER'] = socket_path
+    try:
+        uvicorn.run(
+            "option_chain_api:app",
+            host=host,
+            port=port,
+            workers=workers,
+            log_level="info",
+            access_log=False,
+        )
+    finally:
+        broker.terminate()
+        try:
+            broker.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            broker.kill()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenD行情broker")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="运行broker进程")
+    serve.add_argument('--socket', required=True, help="Unix socket路径")
+    args = parser.parse_args()
+
+    # 以脚本运行时把所在目录加入路径，保证能导入option_chain_api
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(OpenDBroker(args.socket).serve())
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+富途OpenD回放替身
+按OpenQuoteContext的接口回放录制（或合成）的期权链和报价快照，可注入调用延迟、推送延迟和订阅失败，
+用于在没有FutuOpenD的环境中做基准测试和回归测试。
+用法: OPEND_REPLAY=synthetic python3 option_chain_api.py
+      OPEND_REPLAY=recordings/demo python3 option_chain_api.py
+      python3 opend_replay.py record --codes US.AAPL US.TSLA --out recordings/demo
+      python3 opend_replay.py synth --out recordings/synthetic
+"""
+
+import argparse
+import math
+import os
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from futu import RET_ERROR, RET_OK, OpenQuoteContext, OptionCondType, OptionType, SubType
+
+# 故障注入
+class ReplayFaults:
+    """回放时注入的延迟和故障，时间单位为秒，失败率为0~1"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, push_delay: float = 0.0,
+                 push_interval: float = 0.0, subscribe_fail_rate: float = 0.0,
+                 quote_fail_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency  # 每次接口调用的固定延迟
+        self.jitter = jitter  # 在固定延迟上叠加的随机延迟上限
+        self.push_delay = push_delay  # 订阅成功到首次推送的延迟
+        self.push_interval = push_interval  # 大于0时按该间隔对已订阅合约持续推送随机变动的报价
+        self.subscribe_fail_rate = subscribe_fail_rate
+        self.quote_fail_rate = quote_fail_rate
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls) -> "ReplayFaults":
+        """从环境变量读取，毫秒配置项以 _MS 结尾"""
+        def ms(name: str) -> float:
+            return float(os.environ.get(name, '0')) / 1000
+        seed = os.environ.get('OPEND_REPLAY_SEED')
+        return cls(
+            latency=ms('OPEND_REPLAY_LATENCY_MS'),
+            jitter=ms('OPEND_REPLAY_JITTER_MS'),
+            push_delay=ms('OPEND_REPLAY_PUSH_DELAY_MS'),
+            push_interval=ms('OPEND_REPLAY_PUSH_INTERVAL_MS'),
+            subscribe_fail_rate=float(os.environ.get('OPEND_REPLAY_SUBSCRIBE_FAIL_RATE', '0')),
+            quote_fail_rate=float(os.environ.get('OPEND_REPLAY_QUOTE_FAIL_RATE', '0')),
+            seed=int(seed) if seed else None,
+        )
+
+# 回放数据
+class ReplayData:
+    """回放用的期权链、报价和标的价格快照"""
+
+    def __init__(self, chains: pd.DataFrame, quotes: pd.DataFrame, underlying: Optional[Dict[str, float]] = None):
+        self.chains = chains.reset_index(drop=True)
+        self.quotes = quotes.drop_duplicates('code', keep='last').set_index('code', drop=False)
+        self.underlying = dict(underlying or {})
+        self._lock = threading.Lock()  # 持续推送时会改写报价
+
+    @classmethod
+    def load(cls, directory: str) -> "ReplayData":
+        """读取录制目录：chains.pkl、quotes.pkl，以及可选的underlying.pkl"""
+        chains = pd.read_pickle(os.path.join(directory, 'chains.pkl'))
+        quotes = pd.read_pickle(os.path.join(directory, 'quotes.pkl'))
+        underlying_path = os.path.join(directory, 'underlying.pkl')
+        underlying = pd.read_pickle(underlying_path) if os.path.exists(underlying_path) else None
+        return cls(chains, quotes, underlying)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.chains.to_pickle(os.path.join(directory, 'chains.pkl'))
+        self.quotes.reset_index(drop=True).to_pickle(os.path.join(directory, 'quotes.pkl'))
+        pd.to_pickle(self.underlying, os.path.join(directory, 'underlying.pkl'))
+
+    def expirations(self, code: str) -> pd.DataFrame:
+        """与get_option_expiration_date结构一致的到期日列表"""
+        expiries = sorted(self.chains.loc[self.chains['stock_owner'] == code, 'strike_time'].unique())
+        today = date.today()
+        return pd.DataFrame({
+            'strike_time': expiries,
+            'option_expiry_date_distance': [(date.fromisoformat(e) - today).days for e in expiries],
+            'expiration_cycle': 'WEEK',
+        })
+
+    def quote_rows(self, codes: List[str]) -> pd.DataFrame:
+        with self._lock:
+            return self.quotes.loc[[code for code in codes if code in self.quotes.index]].reset_index(drop=True)
+
+    def tick(self, codes: List[str], rng: np.random.Generator) -> pd.DataFrame:
+        """对部分合约的最新价做随机游走并更新高低价和成交量，返回变动的报价"""
+        with self._lock:
+            codes = [code for code in codes if code in self.quotes.index]
+            if not codes:
+                return self.quotes.iloc[:0].reset_index(drop=True)
+            moved = rng.choice(codes, size=max(1, len(codes) // 10), replace=False)
+            rows = self.quotes.loc[moved]
+            last = (rows['last_price'] * np.exp(rng.normal(0, 0.02, len(rows)))).round(2).clip(lower=0.01)
+            self.quotes.loc[moved, 'last_price'] = last.to_numpy()
+            self.quotes.loc[moved, 'high_price'] = np.maximum(rows['high_price'], last).to_numpy()
+            self.quotes.loc[moved, 'low_price'] = np.minimum(rows['low_price'], last).to_numpy()
+            self.quotes.loc[moved, 'volume'] = (rows['volume'] + rng.integers(1, 50, len(rows))).to_numpy()
+            self.quotes.loc[moved, 'data_time'] = datetime.now().strftime('%H:%M:%S')
+            return self.quotes.loc[moved].reset_index(drop=True)
+
+def _norm_cdf(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (1.0 + np.vectorize(math.erf)(x / math.sqrt(2.0)))
+
+def _norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / math.sqrt(2.0 * math.pi)
+
+def _next_fridays(count: int) -> List[str]:
+    day = date.today() + timedelta(days=1)
+    day += timedelta(days=(4 - day.weekday()) % 7)
+    return [(day + timedelta(weeks=i)).isoformat() for i in range(count)]
+
+SYNTHETIC_UNDERLYING = {
+    'US.AAPL': 190.0,
+    'US.TSLA': 250.0,
+    'US.NVDA': 120.0,
+    'US.SPY': 500.0,
+    'HK.00700': 380.0,
+}
+
+def synthetic_data(underlying: Optional[Dict[str, float]] = None, n_expiries: int = 6,
+                   strikes_per_expiry: int = 40, seed: int = 0, rate: float = 0.04) -> ReplayData:
+    """按Black-Scholes生成结构与get_option_chain/get_stock_quote一致的期权链和报价，IV带微笑"""
+    rng = np.random.default_rng(seed)
+    underlying = dict(underlying or SYNTHETIC_UNDERLYING)
+    now = datetime.now()
+    chains, quotes = [], []
+
+    for owner, spot in underlying.items():
+        ticker = owner.split('.', 1)[1]
+        step = max(0.5, round(spot * 0.02) / 2)
+        step = min(step, max(0.01, round(spot * 1.6 / max(strikes_per_expiry, 1), 2)))  # 行权价较多时收窄间距，避免出现负行权价
+        offsets = np.arange(strikes_per_expiry) - strikes_per_expiry // 2
+        strikes = np.round(spot + offsets * step, 2)
+        strikes = strikes[strikes > 0]
+
+        for expiry in _next_fridays(n_expiries):
+            tag = expiry[2:].replace('-', '')
+            t = max((datetime.fromisoformat(expiry) + timedelta(hours=16) - now).total_seconds(), 3600) / (365 * 86400)
+            moneyness = np.log(strikes / spot)
+            sigma = 0.25 + 0.8 * moneyness ** 2 + rng.uniform(-0.01, 0.01, len(strikes))
+            d1 = (np.log(spot / strikes) + (rate + sigma ** 2 / 2) * t) / (sigma * math.sqrt(t))
+            d2 = d1 - sigma * math.sqrt(t)
+            discount = math.exp(-rate * t)
+            gamma = _norm_pdf(d1) / (spot * sigma * math.sqrt(t))
+            vega = spot * _norm_pdf(d1) * math.sqrt(t) / 100
+
+            for option_type, letter in (('CALL', 'C'), ('PUT', 'P')):
+                if option_type == 'CALL':
+                    price = spot * _norm_cdf(d1) - strikes * discount * _norm_cdf(d2)
+                    delta = _norm_cdf(d1)
+                    rho = strikes * t * discount * _norm_cdf(d2) / 100
+                    carry = -rate * strikes * discount * _norm_cdf(d2)
+                    premium = (strikes + price - spot) / spot * 100
+                else:
+                    price = strikes * discount * _norm_cdf(-d2) - spot * _norm_cdf(-d1)
+                    delta = _norm_cdf(d1) - 1
+                    rho = -strikes * t * discount * _norm_cdf(-d2) / 100
+                    carry = rate * strikes * discount * _norm_cdf(-d2)
+                    premium = (spot - strikes + price) / spot * 100
+                theta = (-spot * _norm_pdf(d1) * sigma / (2 * math.sqrt(t)) + carry) / 365
+                last = np.maximum(np.round(price, 2), 0.01)
+                n = len(strikes)
+                codes = [f"{owner}{tag}{letter}{int(round(k * 1000))}" for k in strikes]
+
+                chains.append(pd.DataFrame({
+                    'code': codes,
+                    'name': [f"{ticker} {tag} {k:g} {'购' if letter == 'C' else '沽'}" for k in strikes],
+                    'lot_size': 100,
+                    'stock_type': 'DRVT',
+                    'option_type': option_type,
+                    'stock_owner': owner,
+                    'strike_time': expiry,
+                    'strike_price': strikes,
+                    'suspension': False,
+                    'stock_id': rng.integers(10 ** 8, 10 ** 9, n),
+                    'index_option_type': 'N/A',
+                }))
+                quotes.append(pd.DataFrame({
+                    'code': codes,
+                    'data_date': now.strftime('%Y-%m-%d'),
+                    'data_time': now.strftime('%H:%M:%S'),
+                    'last_price': last,
+                    'open_price': np.maximum((last * rng.uniform(0.9, 1.1, n)).round(2), 0.01),
+                    'high_price': (last * rng.uniform(1.0, 1.15, n)).round(2),
+                    'low_price': np.maximum((last * rng.uniform(0.85, 1.0, n)).round(2), 0.01),
+                    'prev_close_price': np.maximum((last * rng.uniform(0.85, 1.15, n)).round(2), 0.01),
+                    'volume': rng.integers(0, 20000, n),
+                    'turnover': (last * 100 * rng.integers(0, 20000, n)).round(2),
+                    'turnover_rate': rng.uniform(0, 5, n).round(3),
+                    'amplitude': rng.uniform(0, 30, n).round(3),
+                    'suspension': False,
+                    'strike_price': strikes,
+                    'contract_size': 100,
+                    'open_interest': rng.integers(0, 50000, n),
+                    'implied_volatility': (sigma * 100).round(3),
+                    'premium': premium.round(3),
+                    'delta': delta.round(4),
+                    'gamma': gamma.round(4),
+                    'vega': vega.round(4),
+                    'theta': theta.round(4),
+                    'rho': rho.round(4),
+                }))
+
+    return ReplayData(pd.concat(chains, ignore_index=True), pd.concat(quotes, ignore_index=True), underlying)
+
+# 行情连接替身
+class ReplayQuoteContext:
+    """按OpenQuoteContext接口回放数据的行情连接，订阅、额度和推送语义与OpenD一致"""
+
+    def __init__(self, data: ReplayData, faults: Optional[ReplayFaults] = None, quota: int = 1000):
+        self.data = data
+        self.faults = faults or ReplayFaults()
+        self.quota = quota
+        self._lock = threading.Lock()
+        self._random = random.Random(self.faults.seed)
+        self._rng = np.random.default_rng(self.faults.seed)
+        self._handler = None
+        self._subscribed: Dict[str, float] = {}
+        self._closed = False
+        self._ticker: Optional[threading.Thread] = None
+        self.calls: Dict[str, int] = {}
+
+    def _call(self, name: str) -> bool:
+        """记录调用并按配置延迟，连接已关闭时返回False"""
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            delay = self.faults.latency + self._random.uniform(0, self.faults.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        return not self._closed
+
+    def _chance(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def set_handler(self, handler):
+        self._handler = handler
+        return RET_OK
+
+    def close(self):
+        self._closed = True
+
+    def get_global_state(self) -> Tuple[int, Any]:
+        if not self._call('get_global_state'):
+            return RET_ERROR, "连接已关闭"
+        return RET_OK, {'market_us': 'AFTERNOON', 'qot_logined': True, 'trd_logined': False,
+                        'server_ver': 'replay', 'local_timestamp': time.time()}
+
+    def get_option_expiration_date(self, code, index_option_type=None) -> Tuple[int, Any]:
+        if not self._call('get_option_expiration_date'):
+            return RET_ERROR, "连接已关闭"
+        data = self.data.expirations(code)
+        if data.empty:
+            return RET_ERROR, f"未知股票 {code}"
+        return RET_OK, data
+
+    def get_option_chain(self, code, index_option_type=None, start=None, end=None,
+                         option_type=OptionType.ALL, option_cond_type=OptionCondType.ALL,
+                         data_filter=None) -> Tuple[int, Any]:
+        if not self._call('get_option_chain'):
+            return RET_ERROR, "连接已关闭"
+        if start and end and (date.fromisoformat(end) - date.fromisoformat(start)).days > 30:
+            return RET_ERROR, "时间跨度不能超过30天"
+
+        chains = self.data.chains
+        mask = chains['stock_owner'] == code
+        if start:
+            mask &= chains['strike_time'] >= start
+        if end:
+            mask &= chains['strike_time'] <= end
+        if option_type in (OptionType.CALL, OptionType.PUT):
+            mask &= chains['option_type'] == option_type
+        spot = self.data.underlying.get(code)
+        if option_cond_type in (OptionCondType.WITHIN, OptionCondType.OUTSIDE) and spot is not None:
+            itm = np.where(chains['option_type'] == 'CALL', chains['strike_price'] < spot,
+                           chains['strike_price'] > spot)
+            mask &= itm if option_cond_type == OptionCondType.WITHIN else ~itm
+        data = chains[mask]
+
+        # 按报价中的希腊值过滤（与OptionDataFilter的同名区间字段对应）
+        if data_filter is not None and not data.empty:
+            quotes = self.data.quote_rows(data['code'].tolist()).set_index('code')
+            keep = pd.Series(True, index=data.index)
+            for field in ('delta', 'gamma', 'vega', 'theta', 'rho', 'implied_volatility', 'open_interest', 'volume'):
+                values = data['code'].map(quotes[field]) if field in quotes.columns else None
+                low = getattr(data_filter, f"{field}_min", None)
+                high = getattr(data_filter, f"{field}_max", None)
+                if values is None:
+                    continue
+                if low is not None:
+                    keep &= values >= low
+                if high is not None:
+                    keep &= values <= high
+            data = data[keep]
+        return RET_OK, data.reset_index(drop=True)
+
+    def get_market_snapshot(self, code_list) -> Tuple[int, Any]:
+        if not self._call('get_market_snapshot'):
+            return RET_ERROR, "连接已关闭"
+        codes = [code_list] if isinstance(code_list, str) else list(code_list)
+        rows = []
+        for code in codes:
+            if code in self.data.underlying:
+                rows.append({'code': code, 'last_price': self.data.underlying[code]})
+            elif code in self.data.quotes.index:
+                rows.append({'code': code, 'last_price': float(self.data.quotes.at[code, 'last_price'])})
+            else:
+                return RET_ERROR, f"未知股票 {code}"
+        return RET_OK, pd.DataFrame(rows)
+
+    def subscribe(self, code_list, subtype_list, is_first_push=True, subscribe_push=True,
+                  is_detailed_orderbook=False, extended_time=False, session=None) -> Tuple[int, Any]:
+        if not self._call('subscribe'):
+            return RET_ERROR, "连接已关闭"
+        codes = [code_list] if isinstance(code_list, str) else list(code_list)
+        unknown = [code for code in codes if code not in self.data.quotes.index]
+        if unknown:
+            return RET_ERROR, f"未知股票 {unknown[0]}"
+        if self._chance(self.faults.subscribe_fail_rate):
+            return RET_ERROR, "订阅失败（注入故障）"
+        with self._lock:
+            new_codes = [code for code in codes if code not in self._subscribed]
+            if len(self._subscribed) + len(new_codes) > self.quota:
+                return RET_ERROR, f"订阅额度不足，剩余 {self.quota - len(self._subscribed)}"
+            now = time.monotonic()
+            for code in new_codes:
+                self._subscribed[code] = now
+        if is_first_push and subscribe_push:
+            self._schedule_push(new_codes)
+        self._start_ticker()
+        return RET_OK, None
+
+    def unsubscribe(self, code_list, subtype_list, unsubscribe_all=False) -> Tuple[int, Any]:
+        if not self._call('unsubscribe'):
+            return RET_ERROR, "连接已关闭"
+        codes = [code_list] if isinstance(code_list, str) else list(code_list)
+        now = time.monotonic()
+        with self._lock:
+            if any(now - self._subscribed.get(code, 0) < 60 for code in codes if code in self._subscribed):
+                return RET_ERROR, "订阅至少1分钟后才能取消"
+            for code in codes:
+                self._subscribed.pop(code, None)
+        return RET_OK, None
+
+    def unsubscribe_all(self) -> Tuple[int, Any]:
+        self._call('unsubscribe_all')
+        with self._lock:
+            self._subscribed.clear()
+        return RET_OK, None
+
+    def query_subscription(self, is_all_conn=True) -> Tuple[int, Any]:
+        if not self._call('query_subscription'):
+            return RET_ERROR, "连接已关闭"
+        with self._lock:
+            used = len(self._subscribed)
+            codes = list(self._subscribed)
+        return RET_OK, {'total_used': used, 'own_used': used, 'remain': self.quota - used,
+                        'sub_list': {SubType.QUOTE: codes} if codes else {}}
+
+    def get_stock_quote(self, code_list) -> Tuple[int, Any]:
+        if not self._call('get_stock_quote'):
+            return RET_ERROR, "连接已关闭"
+        codes = [code_list] if isinstance(code_list, str) else list(code_list)
+        with self._lock:
+            missing = [code for code in codes if code not in self._subscribed]
+        if missing:
+            return RET_ERROR, f"请先订阅 {missing[0]} 的QUOTE数据"
+        if self._chance(self.faults.quote_fail_rate):
+            return RET_ERROR, "获取报价失败（注入故障）"
+        return RET_OK, self.data.quote_rows(codes)
+
+    def _push(self, data: pd.DataFrame):
+        """把报价交给推送处理器，只推送仍在订阅中的合约"""
+        handler = self._handler
+        if self._closed or handler is None or data.empty or not hasattr(handler, 'dispatch'):
+            return
+        with self._lock:
+            data = data[data['code'].isin(list(self._subscribed))]
+        if not data.empty:
+            handler.dispatch(data.reset_index(drop=True))
+
+    def _schedule_push(self, codes: List[str]):
+        if not codes:
+            return
+        push = lambda: self._push(self.data.quote_rows(codes))
+        if self.faults.push_delay > 0:
+            timer = threading.Timer(self.faults.push_delay, push)
+            timer.daemon = True
+            timer.start()
+        else:
+            push()
+
+    def _start_ticker(self):
+        if self.faults.push_interval <= 0 or self._ticker is not None:
+            return
+        self._ticker = threading.Thread(target=self._tick_loop, name='opend-replay-ticker', daemon=True)
+        self._ticker.start()
+
+    def _tick_loop(self):
+        while not self._closed:
+            time.sleep(self.faults.push_interval)
+            with self._lock:
+                codes = list(self._subscribed)
+            if codes:
+                self._push(self.data.tick(codes, self._rng))
+
+def replay_context_factory(source, faults: Optional[ReplayFaults] = None,
+                           quota: Optional[int] = None) -> Callable[[], ReplayQuoteContext]:
+    """连接池用的建连函数：source为录制目录、'synthetic'或ReplayData，所有连接共用同一份数据"""
+    if isinstance(source, ReplayData):
+        data = source
+    elif source == 'synthetic':
+        data = synthetic_data()
+    else:
+        data = ReplayData.load(source)
+    faults = faults or ReplayFaults.from_env()
+    quota = quota if quota is not None else int(os.environ.get('OPEND_REPLAY_QUOTA', '1000'))
+    return lambda: ReplayQuoteContext(data, faults, quota)
+
+# 录制
+def record_opend(codes: List[str], out_dir: str, host: str = '127.0.0.1', port: int = 11111,
+                 max_expiries: int = 2, batch_size: int = 100) -> ReplayData:
+    """从真实OpenD录制期权链、报价和标的价格"""
+    ctx = OpenQuoteContext(host=host, port=port)
+    chains, quotes, underlying = [], [], {}
+    try:
+        for code in codes:
+            ret, expirations = ctx.get_option_expiration_date(code=code)
+            if ret != RET_OK:
+                print(f"⚠️ {code} 获取到期日期失败: {expirations}")
+                continue
+            for expiry in expirations['strike_time'].tolist()[:max_expiries]:
+                ret, chain = ctx.get_option_chain(code=code, start=expiry, end=expiry)
+                if ret != RET_OK:
+                    print(f"⚠️ {code} {expiry} 获取期权链失败: {chain}")
+                    continue
+                chains.append(chain)
+                contracts = chain['code'].tolist()
+                for i in range(0, len(contracts), batch_size):
+                    batch = contracts[i:i + batch_size]
+                    ret, err = ctx.subscribe(batch, [SubType.QUOTE], is_first_push=True, subscribe_push=False)
+                    if ret != RET_OK:
+                        print(f"⚠️ 订阅失败: {err}")
+                        continue
+                    time.sleep(1)
+                    ret, data = ctx.get_stock_quote(batch)
+                    if ret == RET_OK:
+                        quotes.append(data)
+                print(f"📼 已录制 {code} {expiry}: {len(contracts)} 个合约")
+            ret, snapshot = ctx.get_market_snapshot([code])
+            if ret == RET_OK and not snapshot.empty:
+                underlying[code] = float(snapshot['last_price'].iloc[0])
+    finally:
+        ctx.close()
+
+    if not chains:
+        raise RuntimeError("没有录制到任何期权链")
+    data = ReplayData(pd.concat(chains, ignore_index=True),
+                      pd.concat(quotes, ignore_index=True) if quotes else pd.DataFrame({'code': []}),
+                      underlying)
+    data.save(out_dir)
+    return data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="富途OpenD回放数据录制与生成")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help="从运行中的OpenD录制")
+    record.add_argument('--codes', nargs='+', required=True, help="标的代码，如 US.AAPL")
+    record.add_argument('--out', required=True, help="输出目录")
+    record.add_argument('--host', default=os.environ.get('OPEND_HOST', '127.0.0.1'))
+    record.add_argument('--port', type=int, default=int(os.environ.get('OPEND_PORT', '11111')))
+    record.add_argument('--max-expiries', type=int, default=2)
+
+    synth = commands.add_parser('synth', help="生成合成数据")
+    synth.add_argument('--out', required=True, help="输出目录")
+    synth.add_argument('--expiries', type=int, default=6)
+    synth.add_argument('--strikes', type=int, default=40, help="每个到期日的行权价数量")
+    synth.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        data = record_opend(args.codes, args.out, args.host, args.port, args.max_expiries)
+    else:
+        data = synthetic_data(n_expiries=args.expiries, strikes_per_expiry=args.strikes, seed=args.seed)
+        data.save(args.out)
+    print(f"✅ 已保存 {len(data.chains)} 个合约、{len(data.quotes)} 条报价到 {args.out}")
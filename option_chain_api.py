@@ -5,28 +5,68 @@
 基于FastAPI的期权链数据查询和CSV生成服务
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Tuple, NamedTuple
 import uvicorn
 import asyncio
+import bisect
+import codecs
+import contextvars
+import hashlib
+import heapq
+import itertools
 import os
-import tempfile
-from datetime import datetime
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 import json
+import math
+import zlib
 
-# 导入富途API相关模块
-from futu import *
+# 导入富途API相关模块（显式导入，避免futu中同名的Response覆盖FastAPI的Response）
+from futu import (RET_ERROR, RET_OK, OpenQuoteContext, OptionCondType, OptionDataFilter, OptionType, Session,
+                  StockQuoteHandlerBase, SubType)
+import numpy as np
 import pandas as pd
 import re
 
+from option_pricing import bs_greeks, bs_price, implied_volatility
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as pads
+    import pyarrow.parquet as pq
+except ImportError:  # 可选依赖，未安装时不提供Arrow/Parquet格式和历史快照
+    pa = None
+    pc = None
+    pads = None
+    pq = None
+
 # 创建FastAPI应用
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """服务启动时开启后台任务，关闭时释放资源"""
+    start_background_services()
+    try:
+        yield
+    finally:
+        shutdown_opend_pool()
+
 app = FastAPI(
     title="富途期权链查询API",
     description="提供期权链数据查询和CSV生成服务",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加CORS中间件
@@ -44,7 +84,11 @@ class OptionChainRequest(BaseModel):
     stock_code: str
     target_date: str
     option_type: Optional[str] = "ALL"  # ALL, CALL, PUT
-    option_cond_type: Optional[str] = "ALL"  # ALL, ITM, OTM, ATM
+    option_cond_type: Optional[str] = "ALL"  # ALL, ITM, OTM, ATM（ATM等同于atm_strikes=1）
+    strike_range_pct: Optional[float] = None  # 只保留行权价在标的价格±百分比以内的合约
+    atm_strikes: Optional[int] = None  # 每个到期日和类型只保留最接近平值的N个行权价
+    delta_min: Optional[float] = None  # Delta绝对值下限（看跌期权按绝对值比较）
+    delta_max: Optional[float] = None  # Delta绝对值上限
 
 class OptionChainResponse(BaseModel):
     """期权链查询响应模型"""
@@ -53,6 +97,48 @@ class OptionChainResponse(BaseModel):
     data: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
+class EVRequest(OptionChainRequest):
+    """期权期望价值计算请求模型"""
+    underlying_price: Optional[float] = None  # 标的价格，留空时按Delta=0.5附近的看涨期权估算
+    days_to_expiry: Optional[int] = None  # 到期天数，留空时按到期日计算
+
+class TermStructureRequest(BaseModel):
+    """多到期日期权链查询请求模型"""
+    stock_code: str
+    start_date: Optional[str] = None  # 起始到期日（含），留空表示不限
+    end_date: Optional[str] = None  # 截止到期日（含），留空表示不限
+    max_expiries: Optional[int] = None  # 最多返回的到期日数量
+
+class ScanRequest(BaseModel):
+    """多标的卖方机会扫描请求模型"""
+    symbols: Optional[List[str]] = None  # 留空时扫描stock_mapping和自选列表中的全部标的
+    max_expiries: int = 2  # 每个标的扫描最近的几个到期日
+    call_delta_min: float = 0.01
+    call_delta_max: float = 0.4
+    put_delta_min: float = -0.4
+    put_delta_max: float = -0.01
+    min_expected_value: Optional[float] = None  # 只保留EV不低于该值的合约
+    top_n: int = 20  # 每个标的及最终汇总保留的候选数量
+    concurrency: Optional[int] = None  # 同时扫描的标的数，上限为SCAN_MAX_CONCURRENCY
+
+class RiskPosition(BaseModel):
+    """组合风险分析中的一个期权持仓"""
+    stock_code: str
+    target_date: str
+    code: str  # 期权合约代码，须在该到期日的期权链中
+    quantity: int = -1  # 合约张数，负数为卖出
+    premium: Optional[float] = None  # 开仓价，留空时按当前最新价（无成交时用中间价）
+
+class RiskRequest(BaseModel):
+    """组合风险分析请求模型"""
+    positions: List[RiskPosition]
+    horizon_days: float = 1.0  # 风险期限（自然日）
+    confidence: float = 0.95  # VaR/ES置信度
+    price_steps: Optional[int] = None  # 标的价格网格点数，默认RISK_PRICE_STEPS
+    price_range_std: Optional[float] = None  # 价格网格覆盖的标准差倍数，默认RISK_PRICE_RANGE_STD
+    vol_shocks: Optional[List[float]] = None  # 隐含波动率平移（百分点），默认RISK_VOL_SHOCKS
+    underlying_prices: Optional[Dict[str, float]] = None  # 指定标的价格，未指定的按期权链反推
+
 class StockInfo(BaseModel):
     """股票信息模型"""
     code: str
@@ -83,241 +169,3466 @@ stock_mapping = {
     '平安': 'CN.000001'
 }
 
-# 工具函数
-def get_stock_code(stock_input: str) -> str:
-    """获取股票代码"""
-    if stock_input.startswith(('HK.', 'US.', 'CN.')):
-        return stock_input
-    
-    if stock_input in stock_mapping:
-        return stock_mapping[stock_input]
-    
-    raise ValueError(f"未找到股票 '{stock_input}' 的代码映射")
+# OpenD连接配置
+OPEND_HOST = os.environ.get('OPEND_HOST', '127.0.0.1')
+OPEND_PORT = int(os.environ.get('OPEND_PORT', '11111'))
+OPEND_REPLAY = os.environ.get('OPEND_REPLAY', '')  # 回放数据目录或synthetic，设置后用opend_replay替身代替OpenD
+OPEND_BROKER = os.environ.get('OPEND_BROKER', '')  # broker的Unix socket路径，多worker模式下由启动脚本设置，worker不直连OpenD
+OPEND_POOL_SIZE = int(os.environ.get('OPEND_POOL_SIZE', '4'))  # 连接池上限，避免耗尽OpenD连接数
+OPEND_POOL_TIMEOUT = float(os.environ.get('OPEND_POOL_TIMEOUT', '10'))  # 等待空闲连接的最长秒数
+OPEND_HEALTH_CHECK_INTERVAL = 30.0  # 空闲连接超过该秒数未检查时，借出前先做健康检查
+OPEND_RECONNECT_BACKOFF_BASE = 0.5  # 重连退避初始秒数
+OPEND_RECONNECT_BACKOFF_MAX = 30.0  # 重连退避最大秒数
 
-def validate_stock_code(stock_code: str) -> bool:
-    """验证股票代码格式"""
-    return bool(re.match(r'^(HK|US|CN)\.[A-Z0-9]+$', stock_code))
+# 行情就绪配置
+QUOTE_READY_TIMEOUT = float(os.environ.get('QUOTE_READY_TIMEOUT', '3'))  # 等待首次推送的最长秒数
+QUOTE_READY_FRACTION = float(os.environ.get('QUOTE_READY_FRACTION', '1.0'))  # 收到推送的合约比例达到该值即返回
+QUOTE_STALE_SECONDS = 60.0  # 最近一次推送早于该秒数的合约视为过期
+
+# 请求耗时统计配置
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '2'))  # 超过该秒数的请求打印各阶段耗时
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # 直方图桶上限（秒）
+
+# OpenD调用线程池配置
+OPEND_EXECUTOR_WORKERS = int(os.environ.get('OPEND_EXECUTOR_WORKERS', '16'))  # 执行阻塞OpenD调用的线程数
+OPEND_STAGE_LIMITS = {  # 各阶段同时进行的OpenD调用上限
+    'chain': 4,        # get_option_chain
+    'subscribe': 2,    # subscribe / unsubscribe
+    'quote': 4,        # get_stock_quote
+    'expiration': 4,   # get_option_expiration_date
+}
+
+# OpenD调用调度配置
+def parse_rate_limits(text: str, defaults: Dict[str, Tuple[int, float]]) -> Dict[str, Tuple[int, float]]:
+    """解析形如 get_option_chain=10/30,subscribe=60/30 的频率限制，覆盖默认值"""
+    limits = dict(defaults)
+    for item in text.split(','):
+        name, _, spec = item.strip().partition('=')
+        calls, _, seconds = spec.partition('/')
+        if name and calls:
+            limits[name.strip()] = (int(calls), float(seconds or 30))
+    return limits
+
+OPEND_RATE_LIMITS = parse_rate_limits(os.environ.get('OPEND_RATE_LIMITS', ''), {  # 各接口频率限制：(次数, 秒)
+    'get_option_chain': (10, 30),
+    'get_option_expiration_date': (60, 30),
+    'get_market_snapshot': (60, 30),
+    'subscribe': (60, 30),
+    'unsubscribe': (60, 30),
+})
+OPEND_THROTTLE_RETRIES = 2  # 仍被OpenD判定超频时退避重试的次数
+OPEND_PRIORITIES = ('interactive', 'prefetch', 'scan')  # 调用优先级从高到低：界面请求、后台预热、机会扫描
+OPEND_INTERFACE_STAGES = {  # 接口 -> 并发限制阶段
+    'get_option_chain': 'chain',
+    'get_market_snapshot': 'chain',
+    'get_stock_quote': 'quote',
+    'subscribe': 'subscribe',
+    'unsubscribe': 'subscribe',
+    'get_option_expiration_date': 'expiration',
+}
+
+# get_option_chain单次查询的到期日跨度上限（天）
+OPTION_CHAIN_MAX_SPAN_DAYS = int(os.environ.get('OPTION_CHAIN_MAX_SPAN_DAYS', '30'))
+
+# 批量报价配置
+QUOTE_CHUNK_SIZE = int(os.environ.get('QUOTE_CHUNK_SIZE', '200'))  # get_stock_quote单次请求的合约数
+QUOTE_CHUNK_RETRIES = 1  # 失败分片整体重试次数，仍失败则二分定位出错的合约
+QUOTE_SPLIT_MAX_DEPTH = 8  # 二分定位的最大深度，200个合约的分片8层即可定位到单个合约
+QUOTE_SPLIT_REASONS = ('unknown_code', 'unsubscribed', 'permission')  # 由个别合约引起、值得二分定位的错误
+QUOTE_FATAL_REASONS = ('disconnected', 'timeout', 'frequency')  # 与合约无关的错误，直接抛出不再重试和二分
+
+# 订阅管理配置
+SUBSCRIPTION_QUOTA = int(os.environ.get('SUBSCRIPTION_QUOTA', '0'))  # 可用订阅额度，0表示按OpenD返回的额度
+SUBSCRIPTION_MIN_SECONDS = 60.0  # OpenD要求订阅至少1分钟后才能取消
+SUBSCRIPTION_IDLE_SECONDS = float(os.environ.get('SUBSCRIPTION_IDLE_SECONDS', '600'))  # 无人使用超过该秒数的合约主动退订
+SUBSCRIBE_BATCH_SIZE = 20  # 初始批次大小
+SUBSCRIBE_BATCH_MAX = 200  # 批次大小上限
+
+# CSV导出配置
+CSV_STREAM_CHUNK_ROWS = 500  # 流式导出时每次整列格式化的行权价数量
+
+# 期权链版本配置
+CHAIN_VERSION_RETENTION = 32  # 每条期权链保留的最近版本数，since更早的版本时返回全量
+CHAIN_VERSION_MAX_KEYS = 1024  # 最多记录版本的期权链数量
+
+# 期权链实时推送配置
+CHAIN_PUSH_INTERVAL = float(os.environ.get('CHAIN_PUSH_INTERVAL', '0.5'))  # 每个客户端默认的最短推送间隔秒数
+CHAIN_PUSH_MIN_INTERVAL = 0.1  # 客户端可请求的最短推送间隔
+CHAIN_PUSH_HEARTBEAT = 15.0  # 无增量时发送心跳的间隔秒数
+CHAIN_PUSH_FIELDS = [  # 推送增量中包含的字段
+    'last_price', 'high_price', 'low_price', 'volume', 'open_interest',
+    'implied_volatility', 'delta', 'gamma', 'vega', 'theta', 'rho',
+]
+
+# 历史快照存储配置
+CHAIN_HISTORY_DIR = os.environ.get('CHAIN_HISTORY_DIR', 'chain_history')  # 快照存储目录，留空则不保存
+CHAIN_HISTORY_QUEUE_SIZE = 256  # 待写入快照队列上限，写入跟不上时丢弃新快照
+CHAIN_HISTORY_COMPACT_INTERVAL = float(os.environ.get('CHAIN_HISTORY_COMPACT_INTERVAL', '300'))  # 合并小文件的间隔秒数
+CHAIN_HISTORY_COMPACT_MIN_FILES = 8  # 分区内小文件达到该数量才合并
+CHAIN_HISTORY_ROW_GROUP_ROWS = 65536  # 合并后文件的行组大小，查询时按行组统计信息跳过
+CHAIN_HISTORY_LOOKBACK_DAYS = 7  # 按时间点查询时最多向前查找的天数
+CHAIN_HISTORY_MAX_SERIES_DAYS = 31  # 合约时间序列一次最多查询的天数
+
+# 到期日索引配置
+EXPIRATION_INDEX_FILE = os.environ.get('EXPIRATION_INDEX_FILE', 'expiration_index.json')  # 持久化文件，留空则不保存
+EXPIRATION_REFRESH_CHECK_SECONDS = 300.0  # 后台检查是否需要刷新的间隔
+EXPIRATION_ROLLOVER = {  # 各市场收盘后刷新到期日的时间（交易所时区）
+    'US': ('America/New_York', 16, 30),
+    'HK': ('Asia/Hong_Kong', 16, 30),
+    'CN': ('Asia/Shanghai', 15, 30),
+}
+
+# 本地希腊值配置
+GREEKS_LOCAL_MODE = os.environ.get('GREEKS_LOCAL_MODE', 'fill')  # fill: 补全OpenD为0的值；check: 同时核对OpenD的值；off: 关闭
+GREEKS_CHECK_TOLERANCE = 2.0  # 核对时隐含波动率偏差超过该百分点数记为不一致
+RISK_FREE_RATE = float(os.environ.get('RISK_FREE_RATE', '0.04'))  # 无风险利率（小数）
+MARKET_CLOSE = {  # 期权到期日收盘时间（交易所时区），用于计算剩余期限
+    'US': ('America/New_York', 16, 0),
+    'HK': ('Asia/Hong_Kong', 16, 0),
+    'CN': ('Asia/Shanghai', 15, 0),
+}
+GREEKS_SOURCES = ['vendor', 'local', 'missing']  # greeks_source取值：OpenD提供、本地计算、无法计算
+
+# 组合风险配置
+RISK_PRICE_STEPS = 201  # 标的价格网格点数
+RISK_PRICE_STEPS_MAX = 2001
+RISK_PRICE_RANGE_STD = 4.0  # 价格网格覆盖上下各N个标准差
+RISK_VOL_SHOCKS = [-10.0, -5.0, 0.0, 5.0, 10.0]  # 隐含波动率平移情景（百分点）
+RISK_VOL_SHOCKS_MAX = 21  # 波动率情景数上限
+RISK_MIN_VOLATILITY = 0.01  # 平移后的波动率下限（小数）
+RISK_MAX_POSITIONS = 500
+RISK_CACHE_ENTRIES = 256  # 按期权链版本缓存的风险结果数
+
+# 机会扫描配置
+SCAN_WATCHLIST = [code.strip() for code in os.environ.get('SCAN_WATCHLIST', '').split(',') if code.strip()]
+SCAN_MAX_CONCURRENCY = int(os.environ.get('SCAN_MAX_CONCURRENCY', '4'))  # 同时占用订阅额度的标的数上限
+
+# 期权链快照缓存配置
+CHAIN_CACHE_TTL = float(os.environ.get('CHAIN_CACHE_TTL', '5'))  # 快照保鲜秒数
+CHAIN_CACHE_MAX_MB = float(os.environ.get('CHAIN_CACHE_MAX_MB', '256'))  # 缓存内存上限
+CHAIN_CACHE_MAX_ENTRIES = int(os.environ.get('CHAIN_CACHE_MAX_ENTRIES', '512'))
+
+# 行情推送处理
+class QuotePushTracker(StockQuoteHandlerBase):
+    """报价推送处理器：记录每个合约最近一次推送时间，唤醒等待行情就绪的请求"""
+
+    def __init__(self):
+        super().__init__()
+        self._cond = threading.Condition()
+        self._last_push: Dict[str, float] = {}
+        self._listeners: List[Callable[[pd.DataFrame], None]] = []
+
+    def on_recv_rsp(self, rsp_pb):
+        ret_code, data = super().on_recv_rsp(rsp_pb)
+        if ret_code != RET_OK:
+            return RET_ERROR, data
+        self.dispatch(data)
+        return RET_OK, data
+
+    def dispatch(self, data: pd.DataFrame):
+        """登记一批推送数据"""
+        now = time.time()
+        with self._cond:
+            for code in data['code']:
+                self._last_push[code] = now
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(data)
+            except Exception as e:
+                print(f"⚠️ 推送监听处理出错: {e}")
+
+    def add_listener(self, listener: Callable[[pd.DataFrame], None]):
+        """注册推送监听，每批推送数据在推送线程中回调"""
+        with self._cond:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[pd.DataFrame], None]):
+        with self._cond:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def forget(self, codes: Optional[List[str]] = None):
+        """取消订阅后清除推送记录，codes为空时全部清除"""
+        with self._cond:
+            if codes is None:
+                self._last_push.clear()
+            else:
+                for code in codes:
+                    self._last_push.pop(code, None)
+
+    def wait_ready(self, codes: List[str], fraction: float = QUOTE_READY_FRACTION,
+                   timeout: float = QUOTE_READY_TIMEOUT) -> Dict[str, Any]:
+        """等待合约收到首次推送：全部到达、达到比例或超时即返回，并报告缺失和过期的合约"""
+        start = time.monotonic()
+        deadline = start + timeout
+        required = min(len(codes), max(0, math.ceil(len(codes) * fraction)))
+
+        with self._cond:
+            while True:
+                arrived = sum(1 for code in codes if code in self._last_push)
+                remaining = deadline - time.monotonic()
+                if arrived >= required or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            now = time.time()
+            missing = [code for code in codes if code not in self._last_push]
+            stale = [code for code in codes
+                     if code in self._last_push and now - self._last_push[code] > QUOTE_STALE_SECONDS]
+
+        return {
+            "total": len(codes),
+            "ready": len(codes) - len(missing),
+            "required": required,
+            "timed_out": arrived < required,
+            "waited_ms": round((time.monotonic() - start) * 1000, 1),
+            "missing": missing,
+            "stale": stale,
+        }
+
+# 请求耗时统计
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    """格式化Prometheus标签，转义反斜杠、引号和换行"""
+    parts = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class Histogram:
+    """按标签分组的Prometheus直方图"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], list] = {}  # 标签值 -> [各桶计数, 总和, 次数]
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
 
-def get_option_chain_data(code: str, target_date: str) -> Optional[pd.DataFrame]:
-    """获取指定到期日的期权链数据"""
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total, count)
+                            for labels, (counts, total, count) in self._series.items())
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                bucket_labels = _format_labels(self.labels, labels, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.labels, labels)
+            inf_labels = _format_labels(self.labels, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{label_text} {total:.6f}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+class Counter:
+    """按标签分组的Prometheus计数器"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+REQUEST_SECONDS = Histogram('optionchain_request_duration_seconds', "API请求总耗时",
+                            ('route', 'method', 'status', 'market'))
+STAGE_SECONDS = Histogram('optionchain_stage_duration_seconds', "请求内各阶段耗时",
+                          ('stage', 'route', 'market'))
+OPEND_ERRORS = Counter('optionchain_opend_errors_total', "OpenD接口返回错误的次数",
+                       ('interface', 'reason'))
+OPEND_WAIT_SECONDS = Histogram('optionchain_opend_rate_limit_wait_seconds', "OpenD调用等待频率限制窗口的时间",
+                               ('interface', 'priority'))
+OPEND_THROTTLED = Counter('optionchain_opend_throttled_total', "OpenD判定超频后退避重试的次数", ('interface',))
+OPEND_DEDUPLICATED = Counter('optionchain_opend_deduplicated_total', "与进行中的相同调用合并的次数",
+                             ('interface',))
+SUBSCRIPTION_SKIPPED = Counter('optionchain_subscription_skipped_total', "未能订阅的合约数", ('reason',))
+
+class RequestTrace:
+    """一次请求的各阶段耗时明细，阶段可能在OpenD线程池中记录"""
+
+    def __init__(self, route: str, method: str):
+        self.route = route
+        self.method = method
+        self.market = ''
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.spans.append((stage, seconds))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def breakdown(self) -> Dict[str, Tuple[int, float]]:
+        """按阶段汇总：阶段 -> (次数, 总耗时)"""
+        result: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            for stage, seconds in self.spans:
+                count, total = result.get(stage, (0, 0.0))
+                result[stage] = (count + 1, total + seconds)
+        return result
+
+_request_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar('request_trace', default=None)
+_symbol_market: contextvars.ContextVar[str] = contextvars.ContextVar('symbol_market', default='')  # 多标的请求中当前标的的市场
+
+def record_span(stage: str, seconds: float):
+    """记录一段阶段耗时：写入当前请求的明细，并按路由和市场计入直方图"""
+    trace = _request_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+        STAGE_SECONDS.observe(seconds, stage, trace.route, _symbol_market.get() or trace.market)
+    else:
+        STAGE_SECONDS.observe(seconds, stage, 'background', '')
+
+@contextmanager
+def span(stage: str):
+    """计时一段代码并记录为阶段耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+def stock_code_market(stock_code: str) -> str:
+    """股票代码所属市场（HK/US/CN）"""
+    return stock_code.split('.', 1)[0]
+
+def tag_request_market(*stock_codes: str):
+    """为当前请求标注市场（HK/US/CN），标的分属多个市场时标为MIXED"""
+    trace = _request_trace.get()
+    if trace is not None and not trace.market and stock_codes:
+        markets = {stock_code_market(code) for code in stock_codes}
+        trace.market = markets.pop() if len(markets) == 1 else 'MIXED'
+
+OPEND_ERROR_REASONS = (  # 按错误信息关键字归类，避免错误原文作为标签造成维度膨胀
+    ('quota', ('额度', 'quota')),
+    ('frequency', ('频率', '频繁', 'frequen')),
+    ('permission', ('权限', 'permission')),
+    ('timeout', ('超时', 'timeout')),
+    ('disconnected', ('连接', '断开', 'connect')),
+    ('unsubscribed', ('订阅', 'subscri')),
+    ('unknown_code', ('未知', 'unknown')),
+)
+
+def opend_error_reason(err: Any) -> str:
+    """按错误信息归类OpenD错误"""
+    message = str(err).lower()
+    for name, keywords in OPEND_ERROR_REASONS:
+        if any(keyword in message for keyword in keywords):
+            return name
+    return 'exception' if isinstance(err, BaseException) else 'other'
+
+def count_opend_error(interface: str, err: Any):
+    """记录OpenD接口错误"""
+    OPEND_ERRORS.inc(interface, opend_error_reason(err))
+
+# OpenD调用线程池
+class _Stage:
+    """单个阶段的并发状态"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_busy = 0.0
+
+class StageLimiter:
+    """按阶段限制OpenD调用并发数，并统计排队深度和等待时间"""
+
+    def __init__(self, limits: Dict[str, int]):
+        self._stages = {name: _Stage(limit) for name, limit in limits.items()}
+
+    @contextmanager
+    def stage(self, name: str):
+        """在阶段并发上限内执行一段OpenD调用"""
+        st = self._stages[name]
+        start = time.monotonic()
+        with st.cond:
+            st.waiting += 1
+            st.max_waiting = max(st.max_waiting, st.waiting)
+            while st.active >= st.limit:
+                st.cond.wait()
+            st.waiting -= 1
+            st.active += 1
+        began = time.monotonic()
+        record_span(f"{name}_queue", began - start)
+        try:
+            yield
+        finally:
+            finished = time.monotonic()
+            record_span(name, finished - began)
+            with st.cond:
+                st.active -= 1
+                st.calls += 1
+                st.total_wait += began - start
+                st.max_wait = max(st.max_wait, began - start)
+                st.total_busy += finished - began
+                st.cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        """各阶段统计信息"""
+        result = {}
+        for name, st in self._stages.items():
+            with st.cond:
+                result[name] = {
+                    "limit": st.limit,
+                    "active": st.active,
+                    "queued": st.waiting,
+                    "max_queued": st.max_waiting,
+                    "calls": st.calls,
+                    "avg_wait_ms": round(st.total_wait / st.calls * 1000, 3) if st.calls else 0.0,
+                    "max_wait_ms": round(st.max_wait * 1000, 3),
+                    "avg_busy_ms": round(st.total_busy / st.calls * 1000, 3) if st.calls else 0.0,
+                }
+        return result
+
+class OpenDExecutor:
+    """执行阻塞OpenD调用的有界线程池，避免阻塞事件循环"""
+
+    def __init__(self, max_workers: int = OPEND_EXECUTOR_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='opend')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._max_queued = 0
+
+    def _run(self, submitted_at: float, fn: Callable, *args, **kwargs):
+        record_span('executor_queue', time.perf_counter() - submitted_at)
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """提交到线程池，返回concurrent.futures.Future；复制调用方的上下文，阶段耗时计入原请求"""
+        with self._lock:
+            self._queued += 1
+            self._submitted += 1
+            self._max_queued = max(self._max_queued, self._queued)
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._run, time.perf_counter(), fn, *args, **kwargs)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """在线程池中执行并等待结果"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queued": self._queued,
+                "max_queued": self._max_queued,
+                "submitted": self._submitted,
+                "completed": self._completed,
+            }
+
+opend_executor = OpenDExecutor()
+opend_stages = StageLimiter(OPEND_STAGE_LIMITS)
+
+# OpenD调用调度
+_opend_priority: contextvars.ContextVar[str] = contextvars.ContextVar('opend_priority', default='interactive')
+
+@contextmanager
+def opend_priority(priority: str):
+    """在代码块内以指定优先级调用OpenD，提交到线程池的调用继承该优先级"""
+    token = _opend_priority.set(priority)
     try:
-        quote_ctx = OpenQuoteContext(host='127.0.0.1', port=11111)
+        yield
+    finally:
+        _opend_priority.reset(token)
+
+def current_opend_priority() -> str:
+    return _opend_priority.get()
+
+class _RateWindow:
+    """单个接口的滑动窗口限频：任意seconds秒内最多calls次调用，限额未用完时直接放行，用完后按优先级和到达顺序排队"""
+
+    def __init__(self, calls: int, seconds: float):
+        self.calls = max(1, calls)
+        self.seconds = seconds
+        self.cond = threading.Condition()
+        self._starts: deque = deque()  # 窗口内各次调用的开始时间
+        self._queue: List[list] = []  # [优先级序号, 到达序号]组成的堆
+
+    def _prune(self, now: float):
+        while self._starts and now - self._starts[0] >= self.seconds:
+            self._starts.popleft()
+
+    def acquire(self, ticket: list):
+        """排队直到轮到该调用且窗口内还有限额"""
+        with self.cond:
+            heapq.heappush(self._queue, ticket)
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                if self._queue[0] is ticket and len(self._starts) < self.calls:
+                    heapq.heappop(self._queue)
+                    self._starts.append(now)
+                    self.cond.notify_all()
+                    return
+                # 只有队首等到窗口内最早的调用过期，其余等待队首放行后唤醒
+                head = self._queue[0] is ticket
+                self.cond.wait(self._starts[0] + self.seconds - now if head else None)
+
+    def promote(self, ticket: list, rank: int):
+        """排队中的调用被更高优先级的调用合并时提升优先级"""
+        with self.cond:
+            if rank < ticket[0] and any(entry is ticket for entry in self._queue):
+                ticket[0] = rank
+                heapq.heapify(self._queue)
+                self.cond.notify_all()
+
+    def throttle(self):
+        """OpenD已判定超频（其他客户端共用账户或限额配置偏松）：视为窗口已满，等待一个完整窗口"""
+        with self.cond:
+            now = time.monotonic()
+            self._starts = deque([now] * self.calls)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            self._prune(time.monotonic())
+            queued = {priority: 0 for priority in OPEND_PRIORITIES}
+            for rank, _ in self._queue:
+                queued[OPEND_PRIORITIES[rank]] += 1
+            return {
+                "limit": f"{self.calls}/{self.seconds:g}s",
+                "used": len(self._starts),
+                "queued": queued,
+            }
+
+class _PendingCall:
+    """进行中的可合并调用"""
+
+    def __init__(self, ticket: list):
+        self.ticket = ticket
+        self.future: Future = Future()
+
+class OpenDScheduler:
+    """OpenD接口调用的统一入口：按接口滑动窗口限频、限额用尽时按优先级排队、合并相同的进行中调用，并统计排队时间"""
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]], stages: StageLimiter,
+                 throttle_retries: int = OPEND_THROTTLE_RETRIES):
+        self.stages = stages
+        self.throttle_retries = throttle_retries
+        self._lock = threading.Lock()
+        self.configure(limits)
+        self._seq = itertools.count()
+        self._pending: Dict[Tuple, _PendingCall] = {}
+
+        # 统计信息：接口 -> 计数，(接口, 优先级) -> [次数, 总等待, 最长等待]
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._waits: Dict[Tuple[str, str], list] = {}
+
+    def configure(self, limits: Dict[str, Tuple[int, float]]):
+        """替换各接口的频率限制，空字典表示不限频（回放替身）"""
+        self._windows = {name: _RateWindow(calls, seconds) for name, (calls, seconds) in limits.items()}
+
+    def _count(self, interface: str, field: str):
+        with self._lock:
+            counts = self._counts.setdefault(interface, {"calls": 0, "deduplicated": 0, "throttled": 0})
+            counts[field] += 1
+
+    def _observe_wait(self, interface: str, priority: str, seconds: float):
+        OPEND_WAIT_SECONDS.observe(seconds, interface, priority)
+        record_span('rate_limit', seconds)
+        with self._lock:
+            wait = self._waits.setdefault((interface, priority), [0, 0.0, 0.0])
+            wait[0] += 1
+            wait[1] += seconds
+            wait[2] = max(wait[2], seconds)
+
+    def _execute(self, interface: str, ticket: list, fn: Callable, args, kwargs) -> Tuple[int, Any]:
+        window = self._windows.get(interface)
+        stage = OPEND_INTERFACE_STAGES.get(interface)
+        priority = OPEND_PRIORITIES[ticket[0]]
+        for attempt in range(self.throttle_retries + 1):
+            if window is not None:
+                start = time.monotonic()
+                window.acquire(ticket)
+                self._observe_wait(interface, priority, time.monotonic() - start)
+            self._count(interface, 'calls')
+            with self.stages.stage(stage) if stage else nullcontext():
+                ret, data = fn(*args, **kwargs)
+            if ret == RET_OK or window is None or attempt == self.throttle_retries \
+                    or opend_error_reason(data) != 'frequency':
+                return ret, data
+            # 限额配置偏松或有其他客户端共用账户，退避后按原排队顺序重试
+            window.throttle()
+            self._count(interface, 'throttled')
+            OPEND_THROTTLED.inc(interface)
+            print(f"⚠️ {interface} 触发OpenD频率限制，退避后重试")
+        return ret, data
+
+    def call(self, interface: str, fn: Callable, *args, key: Optional[Tuple] = None, **kwargs) -> Tuple[int, Any]:
+        """经调度执行一次OpenD调用，返回(ret, data)；key相同的进行中调用只执行一次，结果共享"""
+        priority = _opend_priority.get()
+        rank = OPEND_PRIORITIES.index(priority) if priority in OPEND_PRIORITIES else 0
+        ticket = [rank, next(self._seq)]
+        if key is None:
+            return self._execute(interface, ticket, fn, args, kwargs)
+
+        key = (interface,) + key
+        with self._lock:
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _PendingCall(ticket)
+        if not owner:
+            window = self._windows.get(interface)
+            if window is not None:
+                window.promote(pending.ticket, rank)
+            self._count(interface, 'deduplicated')
+            OPEND_DEDUPLICATED.inc(interface)
+            ret, data = pending.future.result()
+            # 调用方可能修改返回的表，合并的调用各拿一份副本
+            return ret, (data.copy() if isinstance(data, pd.DataFrame) else data)
+
+        try:
+            result = self._execute(interface, ticket, fn, args, kwargs)
+            pending.future.set_result(result)
+            return result
+        except BaseException as e:
+            pending.future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """各接口的限额、窗口内已用次数、排队、合并和按优先级的等待统计"""
+        with self._lock:
+            counts = {interface: dict(values) for interface, values in self._counts.items()}
+            waits = {key: list(values) for key, values in self._waits.items()}
+            in_flight = len(self._pending)
+        result = {}
+        for interface in sorted(set(self._windows) | set(counts)):
+            window = self._windows.get(interface)
+            entry = window.stats() if window is not None else {"limit": None}
+            entry.update(counts.get(interface, {"calls": 0, "deduplicated": 0, "throttled": 0}))
+            entry["wait"] = {
+                priority: {
+                    "calls": wait[0],
+                    "avg_ms": round(wait[1] / wait[0] * 1000, 3),
+                    "max_ms": round(wait[2] * 1000, 3),
+                }
+                for (name, priority), wait in waits.items() if name == interface and wait[0]
+            }
+            result[interface] = entry
+        return {"interfaces": result, "in_flight": in_flight}
+
+# 回放替身没有频率限制，不限频以便基准测量的是代码本身
+opend_scheduler = OpenDScheduler({} if OPEND_REPLAY else OPEND_RATE_LIMITS, opend_stages)
+
+class BulkQuoteFetcher:
+    """把合约拆分为多个get_stock_quote请求并发获取，失败的分片重试，仍失败则二分定位出错的合约"""
+
+    def __init__(self, chunk_size: int = QUOTE_CHUNK_SIZE, retries: int = QUOTE_CHUNK_RETRIES,
+                 max_workers: int = OPEND_STAGE_LIMITS['quote']):
+        self.chunk_size = max(1, chunk_size)
+        self.retries = retries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='quote')
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self._fetches = 0
+        self._chunks = 0
+        self._retries = 0
+        self._splits = 0
+        self._unquoted = 0
+
+    def _request(self, quote_ctx, codes: List[str], retries: int = 0,
+                 depth: int = 0) -> Tuple[Optional[pd.DataFrame], List[str]]:
+        """获取一个分片的报价，返回报价和请求失败的合约；断线、超时和超频直接抛出"""
+        for attempt in range(retries + 1):
+            ret, data = opend_scheduler.call('get_stock_quote', quote_ctx.get_stock_quote, codes, key=tuple(codes))
+            if ret == RET_OK:
+                return data, []
+            count_opend_error('get_stock_quote', data)
+            reason = opend_error_reason(data)
+            if reason in QUOTE_FATAL_REASONS:
+                # 与合约无关，重试或二分只会变成大量排队的请求
+                raise ConnectionError(f"获取报价失败({reason}): {data}")
+            if attempt < retries:
+                with self._lock:
+                    self._retries += 1
         
-        # 查询指定到期日的期权链
-        ret, data = quote_ctx.get_option_chain(
-            code=code, 
-            start=target_date, 
-            end=target_date
-        )
+        if len(codes) == 1 or reason not in QUOTE_SPLIT_REASONS or depth >= QUOTE_SPLIT_MAX_DEPTH:
+            print(f"⚠️ {len(codes)} 个合约报价失败: {data}")
+            return None, list(codes)
         
-        if ret == RET_OK and data.shape[0] > 0:
-            # 获取期权合约代码列表用于订阅
-            option_codes = data['code'].tolist()
-            
-            # 订阅期权实时数据
-            print(f"📡 正在订阅 {len(option_codes)} 个期权合约的实时数据...")
-            
-            # 分批订阅，避免一次性订阅过多
-            batch_size = 20  # 减小批次大小，避免订阅失败
-            for i in range(0, len(option_codes), batch_size):
-                batch_codes = option_codes[i:i+batch_size]
-                # 只订阅实时报价数据，避免摆盘数据订阅失败
-                ret_sub = quote_ctx.subscribe(
-                    batch_codes, 
-                    [SubType.QUOTE],  # 只订阅报价数据
-                    is_first_push=True,  # 订阅成功后立即推送一次缓存数据
-                    subscribe_push=True,  # 订阅后推送
-                    session=Session.ALL   # 美股全时段数据
-                )
-                if ret_sub == RET_OK:
-                    print(f"✅ 成功订阅第 {i//batch_size + 1} 批 ({len(batch_codes)} 个合约)")
+        # 错误由个别合约引起，二分后其余合约照常取报价
+        with self._lock:
+            self._splits += 1
+        middle = len(codes) // 2
+        left, left_failed = self._request(quote_ctx, codes[:middle], depth=depth + 1)
+        right, right_failed = self._request(quote_ctx, codes[middle:], depth=depth + 1)
+        frames = [frame for frame in (left, right) if frame is not None]
+        return (pd.concat(frames, ignore_index=True) if frames else None), left_failed + right_failed
+
+    def fetch(self, quote_ctx, codes: List[str]) -> Tuple[Optional[pd.DataFrame], List[str]]:
+        """获取全部合约的报价，返回合并后的报价和未取得报价的合约（请求失败或结果中缺失）"""
+        chunks = [codes[i:i + self.chunk_size] for i in range(0, len(codes), self.chunk_size)]
+        # 其余分片在报价线程池中并发执行，调用线程处理第一片；并发数仍受quote阶段上限约束
+        futures = [self._executor.submit(contextvars.copy_context().run, self._request, quote_ctx, chunk, self.retries)
+                   for chunk in chunks[1:]]
+        results = [self._request(quote_ctx, chunks[0], self.retries)] if chunks else []
+        results += [future.result() for future in futures]
+        
+        frames = [frame for frame, _ in results if frame is not None and not frame.empty]
+        quote_data = pd.concat(frames, ignore_index=True) if frames else None
+        returned = set(quote_data['code']) if quote_data is not None else set()
+        unquoted = [code for code in codes if code not in returned]
+        
+        with self._lock:
+            self._fetches += 1
+            self._chunks += len(chunks)
+            self._unquoted += len(unquoted)
+        return quote_data, unquoted
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chunk_size": self.chunk_size,
+                "fetches": self._fetches,
+                "chunks": self._chunks,
+                "retries": self._retries,
+                "splits": self._splits,
+                "unquoted": self._unquoted,
+            }
+
+quote_fetcher = BulkQuoteFetcher()
+
+# OpenD连接池
+class _PooledContext:
+    """连接池中的单个行情连接"""
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.created_at = time.monotonic()
+        self.last_checked = time.monotonic()
+        self.needs_check = False
+
+class OpenDConnectionPool:
+    """长连接的OpenD行情连接池：有上限、借出前健康检查、断线后按指数退避重连"""
+
+    def __init__(self, host: str, port: int, max_size: int = OPEND_POOL_SIZE,
+                 acquire_timeout: float = OPEND_POOL_TIMEOUT,
+                 health_check_interval: float = OPEND_HEALTH_CHECK_INTERVAL,
+                 context_factory: Optional[Callable[[], Any]] = None):
+        self.host = host
+        self.port = port
+        self.context_factory = context_factory  # 自定义建连函数（如回放替身），为空时连接OpenD
+        self.max_size = max(1, max_size)
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0  # 已创建（含借出中）的连接数
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._connect_lock = threading.Lock()  # 串行建连，避免断线时大量请求同时重连
+
+        # 重连退避状态
+        self._consecutive_failures = 0
+        self._next_connect_at = 0.0
+
+        # 统计信息
+        self._acquires = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._connects = 0
+        self._reconnects = 0
+        self._connect_failures = 0
+        self._health_check_failures = 0
+
+    def _open_context(self):
+        """建立新的行情连接，失败时记录退避时间"""
+        with self._connect_lock:
+            now = time.monotonic()
+            if now < self._next_connect_at:
+                time.sleep(self._next_connect_at - now)
+
+            with span('connect'):
+                if self.context_factory is not None:
+                    ctx = self.context_factory()
                 else:
-                    print(f"⚠️  第 {i//batch_size + 1} 批订阅失败，错误码: {ret_sub}")
-                    # 尝试单个订阅
-                    for code in batch_codes:
-                        ret_single = quote_ctx.subscribe([code], [SubType.QUOTE])
-                        if ret_single == RET_OK:
-                            print(f"  ✅ 单个订阅成功: {code}")
-                        else:
-                            print(f"  ❌ 单个订阅失败: {code}")
-            
-            # 等待数据推送，根据文档建议至少等待1分钟
-            print("⏳ 等待实时数据推送...")
-            import time
-            time.sleep(3)  # 等待3秒让数据开始推送
-            
-            # 获取实时数据
-            enriched_data = enrich_option_data(quote_ctx, data)
-            
-            # 取消订阅以释放额度
-            print("🔄 正在取消订阅以释放额度...")
-            quote_ctx.unsubscribe_all()
-            
-            quote_ctx.close()
-            return enriched_data
-        else:
-            quote_ctx.close()
-            return None
-            
-    except Exception as e:
-        print(f"期权链查询时出错: {str(e)}")
+                    ctx = OpenQuoteContext(host=self.host, port=self.port)
+                ret, data = ctx.get_global_state()
+            if ret != RET_OK:
+                count_opend_error('get_global_state', data)
+                ctx.close()
+                self._connect_failures += 1
+                self._consecutive_failures += 1
+                backoff = min(OPEND_RECONNECT_BACKOFF_BASE * (2 ** (self._consecutive_failures - 1)),
+                              OPEND_RECONNECT_BACKOFF_MAX)
+                self._next_connect_at = time.monotonic() + backoff
+                raise ConnectionError(f"连接OpenD失败({self.host}:{self.port}): {data}，{backoff:.1f}秒后重试")
+
+            self._consecutive_failures = 0
+            self._next_connect_at = 0.0
+            self._connects += 1
+            return _PooledContext(ctx)
+
+    def _is_healthy(self, entry: _PooledContext) -> bool:
+        """检查连接是否仍可用"""
+        try:
+            ret, data = entry.ctx.get_global_state()
+        except Exception as e:
+            ret, data = RET_ERROR, e
+        entry.last_checked = time.monotonic()
+        entry.needs_check = False
+        if ret != RET_OK:
+            count_opend_error('get_global_state', data)
+            self._health_check_failures += 1
+            return False
+        return True
+
+    def _discard(self, entry: _PooledContext):
+        """关闭并丢弃失效连接"""
+        try:
+            entry.ctx.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: Optional[float] = None) -> _PooledContext:
+        """借出一个连接，池满时等待直到超时"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("OpenD连接池已关闭")
+            self._waiting += 1
+            try:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise TimeoutError(f"等待OpenD连接超时({timeout:.1f}秒)")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            entry = self._idle.popleft() if self._idle else None
+            if entry is None:
+                self._size += 1  # 先占位，连接在锁外建立
+            self._in_use += 1
+
+        reconnect = False
+        try:
+            if entry is not None:
+                stale = time.monotonic() - entry.last_checked > self.health_check_interval
+                if (entry.needs_check or stale) and not self._is_healthy(entry):
+                    self._discard(entry)
+                    entry = None
+                    reconnect = True
+            if entry is None:
+                entry = self._open_context()
+                if reconnect:
+                    self._reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._acquires += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return entry
+
+    def release(self, entry: _PooledContext, failed: bool = False):
+        """归还连接；请求异常时标记为下次借出前需检查"""
+        with self._cond:
+            self._in_use -= 1
+            if self._closed:
+                self._size -= 1
+                self._discard(entry)
+            else:
+                entry.needs_check = entry.needs_check or failed
+                self._idle.append(entry)
+            self._cond.notify()
+
+    def open_dedicated(self) -> _PooledContext:
+        """建立一个不归还连接池的专用连接（如订阅连接），共享重连退避和统计"""
+        return self._open_context()
+
+    def check_dedicated(self, entry: _PooledContext) -> bool:
+        """按健康检查间隔检查专用连接，返回是否可用"""
+        if time.monotonic() - entry.last_checked <= self.health_check_interval and not entry.needs_check:
+            return True
+        return self._is_healthy(entry)
+
+    def close_dedicated(self, entry: _PooledContext, reconnect: bool = False):
+        """关闭专用连接"""
+        self._discard(entry)
+        if reconnect:
+            with self._cond:
+                self._reconnects += 1
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """以上下文管理器方式使用连接"""
+        with span('pool_wait'):
+            entry = self.acquire(timeout)
+        failed = False
+        try:
+            yield entry.ctx
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(entry, failed=failed)
+
+    def close_all(self):
+        """关闭所有空闲连接，借出中的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.popleft())
+                self._size -= 1
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池统计信息"""
+        with self._cond:
+            return {
+                "host": self.host,
+                "port": self.port,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "acquires": self._acquires,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._total_wait / self._acquires * 1000, 3) if self._acquires else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+                "connects": self._connects,
+                "reconnects": self._reconnects,
+                "connect_failures": self._connect_failures,
+                "health_check_failures": self._health_check_failures,
+                "backoff_remaining_s": round(max(0.0, self._next_connect_at - time.monotonic()), 3),
+            }
+
+def replay_context_factory() -> Optional[Callable[[], Any]]:
+    """设置了OPEND_REPLAY时改用回放替身建连"""
+    if not OPEND_REPLAY:
         return None
+    from opend_replay import replay_context_factory as factory
+    print(f"📼 使用OpenD回放数据: {OPEND_REPLAY}")
+    return factory(OPEND_REPLAY)
 
-def enrich_option_data(quote_ctx: OpenQuoteContext, df: pd.DataFrame) -> pd.DataFrame:
-    """使用实时数据丰富期权数据"""
-    enriched_df = df.copy()
-    
-    # 添加实时数据列
-    enriched_df['last_price'] = 0.0
-    enriched_df['open_price'] = 0.0
-    enriched_df['high_price'] = 0.0
-    enriched_df['low_price'] = 0.0
-    enriched_df['prev_close_price'] = 0.0
-    enriched_df['volume'] = 0
-    enriched_df['turnover'] = 0.0
-    enriched_df['turnover_rate'] = 0.0
-    enriched_df['amplitude'] = 0
-    enriched_df['open_interest'] = 0
-    enriched_df['implied_volatility'] = 0.0
-    enriched_df['delta'] = 0.0
-    enriched_df['gamma'] = 0.0
-    enriched_df['vega'] = 0.0
-    enriched_df['theta'] = 0.0
-    enriched_df['rho'] = 0.0
-    enriched_df['premium'] = 0.0
-    
-    print("📊 正在获取实时数据...")
-    
-    # 批量获取实时报价，提高效率
-    all_codes = df['code'].tolist()
-    
-    # 使用get_stock_quote获取更丰富的实时数据
-    ret, quote_data = quote_ctx.get_stock_quote(all_codes)
-    if ret == RET_OK and not quote_data.empty:
-        print(f"✅ 成功获取 {len(quote_data)} 个合约的实时报价")
-        
-        # 创建代码到数据的映射
-        quote_dict = {}
-        for _, row in quote_data.iterrows():
-            quote_dict[row['code']] = row
-        
-        # 更新数据
-        for idx, row in df.iterrows():
-            code = row['code']
-            if code in quote_dict:
-                quote_row = quote_dict[code]
-                enriched_df.at[idx, 'last_price'] = quote_row.get('last_price', 0.0)
-                enriched_df.at[idx, 'open_price'] = quote_row.get('open_price', 0.0)
-                enriched_df.at[idx, 'high_price'] = quote_row.get('high_price', 0.0)
-                enriched_df.at[idx, 'low_price'] = quote_row.get('low_price', 0.0)
-                enriched_df.at[idx, 'prev_close_price'] = quote_row.get('prev_close_price', 0.0)
-                enriched_df.at[idx, 'volume'] = quote_row.get('volume', 0)
-                enriched_df.at[idx, 'turnover'] = quote_row.get('turnover', 0.0)
-                enriched_df.at[idx, 'turnover_rate'] = quote_row.get('turnover_rate', 0.0)
-                enriched_df.at[idx, 'amplitude'] = quote_row.get('amplitude', 0)
-                enriched_df.at[idx, 'open_interest'] = quote_row.get('open_interest', 0)
-                enriched_df.at[idx, 'implied_volatility'] = quote_row.get('implied_volatility', 0.0)
-                enriched_df.at[idx, 'delta'] = quote_row.get('delta', 0.0)
-                enriched_df.at[idx, 'gamma'] = quote_row.get('gamma', 0.0)
-                enriched_df.at[idx, 'vega'] = quote_row.get('vega', 0.0)
-                enriched_df.at[idx, 'theta'] = quote_row.get('theta', 0.0)
-                enriched_df.at[idx, 'rho'] = quote_row.get('rho', 0.0)
-                enriched_df.at[idx, 'premium'] = quote_row.get('premium', 0.0)
-    
-    print("✅ 实时数据获取完成")
-    return enriched_df
+opend_pool = OpenDConnectionPool(OPEND_HOST, OPEND_PORT, context_factory=replay_context_factory())
 
-def generate_csv_data(df: pd.DataFrame, target_date: str) -> List[List[str]]:
-    """生成期权链CSV数据 - 每个行权价一行，左边看涨期权，右边看跌期权"""
-    if df is None or df.empty:
-        return []
-    
-    # 计算到期天数
-    try:
-        target_date_obj = datetime.strptime(target_date, '%Y-%m-%d').date()
-        today = datetime.now().date()
-        days_to_expiry = (target_date_obj - today).days
-        expiry_info = f"到期日：{target_date}(W) {days_to_expiry}天到期"
-    except:
-        expiry_info = f"到期日：{target_date}(W) 6天到期"
-    
-    # 创建CSV数据
-    csv_data = []
-    
-    # 添加表头
-    header = [
-        "时间价值", "盈利概率", "Vega", "Theta", "Gamma", "Delta",  # 时间价值到Delta
-        "未平仓数", "成交量", "涨跌幅", "最新价", "中间价", "隐含波动率",  # 未平仓数到隐含波动率
-        "卖出价", "买入价", "行权价",  # 卖出价、买入价、行权价
-        "买入价", "卖出价", "隐含波动率", "中间价", "最新价", "涨跌幅",  # 买入价、卖出价、隐含波动率、中间价、最新价、涨跌幅
-        "成交量", "未平仓数", "Delta", "Gamma", "Theta", "Vega", "盈利概率", "时间价值"  # 成交量到时间价值
-    ]
-    csv_data.append(header)
-    
-    # 添加到期日信息行
-    info_row = [""] * 14 + [expiry_info] + [""] * 14
-    csv_data.append(info_row)
-    
-    # 按行权价分组，每个行权价生成一行
-    strike_groups = df.groupby('strike_price')
-    
-    for strike_price, group in strike_groups:
-        # 获取该行权价的看涨和看跌期权
-        call_options = group[group['option_type'] == 'CALL']
-        put_options = group[group['option_type'] == 'PUT']
-        
-        # 如果该行权价没有看涨或看跌期权，跳过
-        if call_options.empty or put_options.empty:
-            continue
-            
-        # 取第一个看涨期权和第一个看跌期权的数据
-        call_option = call_options.iloc[0]
-        put_option = put_options.iloc[0]
-        
-        # 计算涨跌幅
-        call_change_pct = f"{((call_option['last_price'] - call_option['prev_close_price']) / call_option['prev_close_price'] * 100):.2f}%" if call_option['prev_close_price'] != 0 else "0.00%"
-        put_change_pct = f"{((put_option['last_price'] - put_option['prev_close_price']) / put_option['prev_close_price'] * 100):.2f}%" if put_option['prev_close_price'] != 0 else "0.00%"
-        
-        # 计算中间价
-        call_mid_price = (call_option['high_price'] + call_option['low_price']) / 2
-        put_mid_price = (put_option['high_price'] + put_option['low_price']) / 2
-        
-        # 生成CSV行：左边是看涨期权，右边是看跌期权，中间是行权价
-        csv_row = [
-            # 左边：看涨期权信息
-            f"{call_option['premium']:.2f}", f"{call_change_pct}", f"{call_option['vega']:.4f}", f"{call_option['theta']:.4f}", f"{call_option['gamma']:.4f}", f"{call_option['delta']:.4f}",  # 时间价值到Delta
-            f"{call_option['open_interest']}张", f"{call_option['volume']}张", f"{call_change_pct}", f"{call_option['last_price']:.2f}", f"{call_mid_price:.3f}", f"{call_option['implied_volatility']:.2f}%",  # 未平仓数到隐含波动率
-            f"{call_option['high_price']:.2f}", f"{call_option['low_price']:.2f}", str(strike_price),  # 卖出价、买入价、行权价
-            # 右边：看跌期权信息
-            f"{put_option['low_price']:.2f}", f"{put_option['high_price']:.2f}", f"{put_option['implied_volatility']:.2f}%", f"{put_mid_price:.3f}", f"{put_option['last_price']:.2f}", f"{put_change_pct}",  # 买入价、卖出价、隐含波动率、中间价、最新价、涨跌幅
-            f"{put_option['volume']}张", f"{put_option['open_interest']}张", f"{put_option['delta']:.4f}", f"{put_option['gamma']:.4f}", f"{put_option['theta']:.4f}", f"{put_option['vega']:.4f}", f"{put_change_pct}", f"{put_option['premium']:.2f}"  # 成交量到时间价值
-        ]
-        
-        csv_data.append(csv_row)
-    
-    return csv_data
+def create_broker_client():
+    """多worker模式下连接broker进程，期权链和到期日都由broker统一向OpenD获取"""
+    if not OPEND_BROKER:
+        return None
+    from opend_broker import BrokerClient
+    print(f"🛰️ 通过broker访问OpenD: {OPEND_BROKER}")
+    return BrokerClient(OPEND_BROKER, priority=current_opend_priority)
+
+broker_client = create_broker_client()
+
+# 订阅管理
+class _Subscription:
+    """单个合约的订阅状态"""
+
+    def __init__(self):
+        self.subscribed_at = time.monotonic()
+        self.last_used = self.subscribed_at
+        self.refcount = 0
+        self.busy = False  # 正在订阅或退订，结果提交前其他请求等待
+
+class SubscriptionLease:
+    """一次请求持有的订阅，退出时归还引用计数，合约保持订阅供后续请求复用"""
+
+    def __init__(self, manager: "SubscriptionManager", ctx, codes: List[str], failed: List[str]):
+        self.manager = manager
+        self.ctx = ctx
+        self.codes = codes
+        self.failed = failed
+        self._released = False
+
+    def wait_ready(self, fraction: float = QUOTE_READY_FRACTION,
+                   timeout: float = QUOTE_READY_TIMEOUT) -> Dict[str, Any]:
+        """等待已订阅合约的推送就绪，订阅失败的合约计入缺失"""
+        status = self.manager.tracker.wait_ready(self.codes, fraction, timeout) if self.codes else {
+            "total": 0, "ready": 0, "required": 0, "timed_out": False,
+            "waited_ms": 0.0, "missing": [], "stale": [],
+        }
+        status["total"] += len(self.failed)
+        status["missing"] = status["missing"] + self.failed
+        status["unsubscribed"] = self.failed
+        return status
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.manager.release(self.codes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class SubscriptionManager:
+    """跨请求的订阅管理：按合约引用计数，额度不足时淘汰最久未用且已满1分钟的合约，批次大小自适应"""
+
+    def __init__(self, pool: OpenDConnectionPool, quota: int = SUBSCRIPTION_QUOTA):
+        self.pool = pool
+        self.configured_quota = quota
+        self.quota = quota
+        self.tracker = QuotePushTracker()
+
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._entry: Optional[_PooledContext] = None
+        self._generation = 0  # 每次重连加一，重连前发起的订阅结果作废
+        self._subs: "OrderedDict[str, _Subscription]" = OrderedDict()  # 按最近使用排序
+        self._batch_size = SUBSCRIBE_BATCH_SIZE
+
+        # 统计信息
+        self._leases = 0
+        self._subscribe_calls = 0
+        self._subscribe_failures = 0
+        self._evictions = 0
+        self._idle_unsubscribes = 0
+        self._over_quota = 0
+        self._wait_timeouts = 0  # 等待其他请求的订阅结果超时的次数
+        self._reconnects = 0
+
+    def _context(self):
+        """获取订阅专用连接，断线后重连并清空订阅状态（调用方持有锁）"""
+        if self._entry is not None and not self.pool.check_dedicated(self._entry):
+            print("⚠️ 订阅连接失效，正在重连...")
+            self.pool.close_dedicated(self._entry, reconnect=True)
+            self._entry = None
+            self._subs.clear()
+            self.tracker.forget()
+            self._reconnects += 1
+            self._generation += 1
+            self._cond.notify_all()
+
+        if self._entry is None:
+            self._entry = self.pool.open_dedicated()
+            self._entry.ctx.set_handler(self.tracker)
+            if self.configured_quota <= 0:
+                ret, data = opend_scheduler.call('query_subscription', self._entry.ctx.query_subscription)
+                if ret == RET_OK:
+                    self.quota = int(data.get('remain', 0)) + int(data.get('own_used', 0))
+                else:
+                    count_opend_error('query_subscription', data)
+                    self.quota = 100  # 无法查询时按最低档额度
+        return self._entry.ctx
+
+    def _subscribe(self, ctx, codes: List[str]) -> Tuple[List[str], List[str]]:
+        """按自适应批次订阅：成功则批次加倍，失败则减半重试，单个合约仍失败则放弃"""
+        subscribed, failed = [], []
+        pending = deque(codes)
+        while pending:
+            with self._lock:
+                batch = [pending.popleft() for _ in range(min(self._batch_size, len(pending)))]
+                self._subscribe_calls += 1
+            ret, err = opend_scheduler.call(
+                'subscribe',
+                ctx.subscribe,
+                batch,
+                [SubType.QUOTE],  # 只订阅报价数据
+                is_first_push=True,  # 订阅成功后立即推送一次缓存数据
+                subscribe_push=True,  # 订阅后推送
+                session=Session.ALL   # 美股全时段数据
+            )
+            if ret == RET_OK:
+                subscribed.extend(batch)
+                with self._lock:
+                    self._batch_size = min(self._batch_size * 2, SUBSCRIBE_BATCH_MAX)
+                continue
+
+            with self._lock:
+                self._subscribe_failures += 1
+            count_opend_error('subscribe', err)
+            if len(batch) == 1:
+                print(f"  ❌ 订阅失败: {batch[0]} ({err})")
+                failed.extend(batch)
+            else:
+                print(f"⚠️  {len(batch)} 个合约批量订阅失败({err})，缩小批次重试")
+                with self._lock:
+                    self._batch_size = max(1, len(batch) // 2)
+                pending.extendleft(reversed(batch))
+        return subscribed, failed
+
+    def _unsubscribe(self, ctx, codes: List[str]) -> List[str]:
+        """取消订阅（不持有锁），返回实际退订的合约"""
+        if not codes:
+            return []
+        ret, err = opend_scheduler.call('unsubscribe', ctx.unsubscribe, codes, [SubType.QUOTE])
+        if ret != RET_OK:
+            count_opend_error('unsubscribe', err)
+            print(f"⚠️  取消订阅失败: {err}")
+            return []
+        return codes
+
+    def _evictable(self, now: float, idle_only: bool) -> List[str]:
+        """按最久未用顺序列出可退订的合约（无人引用且已订阅满1分钟）"""
+        codes = []
+        for code, sub in self._subs.items():
+            if sub.busy or sub.refcount > 0 or now - sub.subscribed_at < SUBSCRIPTION_MIN_SECONDS:
+                continue
+            if idle_only and now - sub.last_used < SUBSCRIPTION_IDLE_SECONDS:
+                continue
+            codes.append(code)
+        return codes
+
+    def acquire(self, codes: List[str]) -> SubscriptionLease:
+        """为一次请求订阅合约并增加引用计数，已订阅的合约直接复用
+
+        额度在锁内预留，订阅和退订的往返在锁外进行，完成后再加锁提交或回滚。
+        """
+        codes = list(dict.fromkeys(codes))
+        with self._cond:
+            ctx = self._context()
+            generation = self._generation
+
+            # 其他请求正在订阅或退订的合约，等其结果提交后再决定是否复用
+            settled = lambda: not any(code in self._subs and self._subs[code].busy for code in codes)
+            if not self._cond.wait_for(settled, timeout=OPEND_POOL_TIMEOUT):
+                self._wait_timeouts += 1
+            if self._generation != generation:
+                ctx, generation = self._context(), self._generation
+            now = time.monotonic()
+
+            held, new_codes, waiting = [], [], []
+            for code in codes:
+                sub = self._subs.get(code)
+                if sub is None:
+                    new_codes.append(code)
+                elif sub.busy:
+                    waiting.append(code)
+                else:
+                    sub.refcount += 1
+                    sub.last_used = now
+                    self._subs.move_to_end(code)
+                    held.append(code)
+
+            # 长时间无人使用的合约，以及额度不足时最久未用的合约，标记后在锁外退订
+            idle = self._evictable(now, idle_only=True)
+            shortage = len(new_codes) - (self.quota - len(self._subs) + len(idle))
+            idle_set = set(idle)
+            victims = [code for code in self._evictable(now, idle_only=False) if code not in idle_set]
+            victims = victims[:max(0, shortage)]
+            for code in idle + victims:
+                self._subs[code].busy = True
+
+            # 按退订后的空余额度预留占位，其他请求看到占位会等待而不是重复订阅
+            room = max(0, self.quota - len(self._subs) + len(idle) + len(victims))
+            reserved, over_quota = new_codes[:room], new_codes[room:]
+            for code in reserved:
+                sub = _Subscription()
+                sub.refcount = 1
+                sub.busy = True
+                self._subs[code] = sub
+
+        try:
+            idle_done = self._unsubscribe(ctx, idle)
+            victims_done = self._unsubscribe(ctx, victims)
+            # 退订失败的合约仍占额度，超出部分的占位不再订阅，避免OpenD超额
+            unfreed = len(idle) + len(victims) - len(idle_done) - len(victims_done)
+            if unfreed:
+                keep = max(0, len(reserved) - unfreed)
+                reserved, dropped = reserved[:keep], reserved[keep:]
+                with self._cond:
+                    if self._generation == generation:
+                        for code in dropped:
+                            self._subs.pop(code, None)
+                    self._cond.notify_all()
+                over_quota = dropped + over_quota
+            subscribed, failed = self._subscribe(ctx, reserved)
+        except Exception:
+            # 回滚占位和退订标记，避免等待中的请求一直卡住
+            with self._cond:
+                if self._generation == generation:
+                    for code in reserved:
+                        self._subs.pop(code, None)
+                    for code in held:
+                        if code in self._subs:
+                            self._subs[code].refcount -= 1
+                    for code in idle + victims:
+                        if code in self._subs:
+                            self._subs[code].busy = False
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            if self._generation != generation:
+                # 期间订阅连接已重连，旧连接上的订阅随之失效
+                failed, subscribed = failed + subscribed, []
+            else:
+                removed = idle_done + victims_done
+                for code in removed:
+                    self._subs.pop(code, None)
+                self.tracker.forget(removed)
+                for code in idle + victims:
+                    sub = self._subs.get(code)
+                    if sub is not None:
+                        sub.busy = False
+                for code in failed:
+                    self._subs.pop(code, None)
+                for code in subscribed:
+                    self._subs[code].busy = False
+                self._idle_unsubscribes += len(idle_done)
+                self._evictions += len(victims_done)
+            self._over_quota += len(over_quota)
+            self._leases += 1
+            self._cond.notify_all()
+        if over_quota:
+            SUBSCRIPTION_SKIPPED.inc('over_quota', amount=len(over_quota))
+        if waiting:
+            SUBSCRIPTION_SKIPPED.inc('in_flight', amount=len(waiting))
+        if subscribed:
+            print(f"📡 新订阅 {len(subscribed)} 个合约，复用 {len(held)} 个已订阅合约")
+        return SubscriptionLease(self, ctx, held + subscribed, failed + over_quota + waiting)
+
+    def release(self, codes: List[str]):
+        """归还引用计数，合约保持订阅直到被淘汰或闲置退订"""
+        with self._lock:
+            now = time.monotonic()
+            for code in codes:
+                sub = self._subs.get(code)
+                if sub is not None:
+                    sub.refcount = max(0, sub.refcount - 1)
+                    sub.last_used = now
+
+    def close(self):
+        """退订全部合约并关闭订阅连接"""
+        with self._lock:
+            if self._entry is not None:
+                try:
+                    self._entry.ctx.unsubscribe_all()
+                except Exception:
+                    pass
+                self.pool.close_dedicated(self._entry)
+                self._entry = None
+            self._subs.clear()
+            self.tracker.forget()
+
+    def stats(self) -> Dict[str, Any]:
+        """订阅管理状态"""
+        with self._lock:
+            now = time.monotonic()
+            referenced = sum(1 for sub in self._subs.values() if sub.refcount > 0)
+            return {
+                "connected": self._entry is not None,
+                "quota": self.quota,
+                "subscribed": len(self._subs),
+                "referenced": referenced,
+                "idle": len(self._subs) - referenced,
+                "locked_min_period": sum(1 for sub in self._subs.values()
+                                         if now - sub.subscribed_at < SUBSCRIPTION_MIN_SECONDS),
+                "in_flight": sum(1 for sub in self._subs.values() if sub.busy),
+                "batch_size": self._batch_size,
+                "leases": self._leases,
+                "subscribe_calls": self._subscribe_calls,
+                "subscribe_failures": self._subscribe_failures,
+                "evictions": self._evictions,
+                "idle_unsubscribes": self._idle_unsubscribes,
+                "over_quota": self._over_quota,
+                "wait_timeouts": self._wait_timeouts,
+                "reconnects": self._reconnects,
+            }
+
+    def opend_usage(self) -> Optional[Dict[str, Any]]:
+        """查询OpenD侧的额度使用情况"""
+        with self._lock:
+            ctx = self._context()
+        ret, data = opend_scheduler.call('query_subscription', ctx.query_subscription)
+        if ret != RET_OK:
+            count_opend_error('query_subscription', data)
+            return None
+        return {key: data.get(key) for key in ('total_used', 'own_used', 'remain')}
+
+subscription_manager = SubscriptionManager(opend_pool)
+
+# 期权链快照缓存
+class ChainSnapshotCache:
+    """期权链快照缓存：TTL保鲜、按内存上限LRU淘汰，并发的相同未命中请求只回源一次"""
+
+    def __init__(self, ttl: float = CHAIN_CACHE_TTL, max_bytes: int = int(CHAIN_CACHE_MAX_MB * 1024 * 1024),
+                 max_entries: int = CHAIN_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[pd.DataFrame, float, int]]" = OrderedDict()
+        self._inflight: Dict[Tuple, Future] = {}
+        self._bytes = 0
+
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._loads = 0
+        self._load_failures = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def _lookup(self, key: Tuple) -> Tuple[bool, Optional[pd.DataFrame], Optional[Future], bool]:
+        """查找缓存：返回(是否命中, 数据, 回源Future, 是否由本请求回源)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[1] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return True, entry[0], None, False
+                self._remove(key)
+                self._expirations += 1
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return False, None, future, False
+
+            self._misses += 1
+            future = Future()
+            self._inflight[key] = future
+            return False, None, future, True
+
+    def _load(self, key: Tuple, future: Future, loader: Callable[[], Optional[pd.DataFrame]]):
+        """回源并把结果交给所有等待同一key的请求"""
+        try:
+            df = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._load_failures += 1
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._loads += 1
+            if df is None:
+                self._load_failures += 1
+            else:
+                self._store(key, df)
+        future.set_result(df)
+
+    def get_or_load(self, key: Tuple, loader: Callable[[], Optional[pd.DataFrame]]) -> Optional[pd.DataFrame]:
+        """命中则直接返回，否则调用loader回源；同一key同时只有一个请求回源，其余等待其结果。
+        返回的DataFrame在请求间共享，调用方不要原地修改"""
+        hit, df, future, owner = self._lookup(key)
+        if hit:
+            return df
+        if owner:
+            self._load(key, future, loader)
+        return future.result()
+
+    async def aget_or_load(self, key: Tuple, loader: Callable[[], Optional[pd.DataFrame]]) -> Optional[pd.DataFrame]:
+        """get_or_load的异步版本：回源在OpenD线程池中执行，等待时不占用线程"""
+        hit, df, future, owner = self._lookup(key)
+        if hit:
+            return df
+        if owner:
+            opend_executor.submit(self._load, key, future, loader)
+        # 屏蔽取消：客户端断开时不能取消其他请求也在等待的回源结果
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def put(self, key: Tuple, df: pd.DataFrame):
+        """直接写入一条快照（例如由多到期日查询拆分得到）"""
+        with self._lock:
+            self._store(key, df)
+
+    def _store(self, key: Tuple, df: pd.DataFrame):
+        """写入缓存并按LRU淘汰超出上限的条目（调用方持有锁）"""
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (df, time.monotonic(), nbytes)
+        self._bytes += nbytes
+        while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._evictions += 1
+
+    def _remove(self, key: Tuple):
+        """删除条目（调用方持有锁）"""
+        _, _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def invalidate(self, key: Optional[Tuple] = None):
+        """清除指定条目，key为空时清空缓存"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "inflight": len(self._inflight),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "hit_rate": round((self._hits + self._coalesced) / lookups, 4) if lookups else 0.0,
+                "loads": self._loads,
+                "load_failures": self._load_failures,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+chain_cache = ChainSnapshotCache()
+
+# 期权链版本
+def chain_row_hashes(df: pd.DataFrame) -> pd.Series:
+    """按合约计算代码和报价字段的哈希，索引为合约代码"""
+    fields = ['code'] + [field for field in QUOTE_FIELD_DEFAULTS if field in df.columns]
+    hashes = pd.util.hash_pandas_object(df[fields], index=False).to_numpy()
+    return pd.Series(hashes, index=df['code'].to_numpy())
+
+class ChainVersionStore:
+    """按内容哈希为期权链快照编版本，保留最近的版本用于计算变化的合约"""
+
+    def __init__(self, retention: int = CHAIN_VERSION_RETENTION, max_keys: int = CHAIN_VERSION_MAX_KEYS):
+        self.retention = retention
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._versions: "OrderedDict[Tuple, deque]" = OrderedDict()  # 键 -> [(版本, 合约哈希, 时间)]
+
+    def register(self, key: Tuple, df: pd.DataFrame) -> Tuple[str, pd.Series]:
+        """计算快照版本，内容有变化时记为新版本"""
+        hashes = chain_row_hashes(df)
+        version = hashlib.blake2b(hashes.to_numpy().tobytes(), digest_size=8).hexdigest()
+        with self._lock:
+            history = self._versions.get(key)
+            if history is None:
+                history = self._versions[key] = deque(maxlen=self.retention)
+                while len(self._versions) > self.max_keys:
+                    self._versions.popitem(last=False)
+            self._versions.move_to_end(key)
+            if not history or history[-1][0] != version:
+                history.append((version, hashes, time.time()))
+        return version, hashes
+
+    def changes(self, key: Tuple, since: str, hashes: pd.Series) -> Optional[Tuple[np.ndarray, List[str]]]:
+        """相对since版本有变化（含新增）的合约掩码和已移除的合约，since不在保留范围内时返回None"""
+        with self._lock:
+            previous = next((entry[1] for entry in self._versions.get(key, ()) if entry[0] == since), None)
+        if previous is None:
+            return None
+        positions = previous.index.get_indexer(hashes.index)
+        old = previous.to_numpy()[np.maximum(positions, 0)]
+        changed = (positions < 0) | (old != hashes.to_numpy())
+        removed = previous.index.difference(hashes.index).tolist()
+        return changed, removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chains": len(self._versions),
+                "versions": sum(len(history) for history in self._versions.values()),
+                "retention": self.retention,
+            }
+
+chain_versions = ChainVersionStore()
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match是否包含当前ETag（忽略弱校验前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+def select_chain_changes(key: Tuple, df: pd.DataFrame, version: str, hashes: pd.Series,
+                         since: Optional[str]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """带since时只保留变化的合约，返回数据和版本信息"""
+    info = {"version": version, "mode": "full"}
+    if since:
+        changes = chain_versions.changes(key, since, hashes)
+        if changes is None:
+            info["since_expired"] = True  # 版本已超出保留范围，返回全量供客户端重新同步
+        else:
+            changed, removed = changes
+            df = df[changed]
+            info.update({"mode": "diff", "since": since, "changed": len(df), "removed": removed})
+    return df, info
+
+# 期权链实时推送
+def _push_value(value: Any) -> Any:
+    """推送字段转为可JSON序列化的Python值，NaN/inf转为None"""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return value
+    return value if math.isfinite(value) else None
+
+class _ChainViewer:
+    """单个推送客户端：待发送的增量按合约合并，积压量不超过合约数"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float):
+        self.loop = loop
+        self.interval = interval
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.event = asyncio.Event()
+        self.last_sent = 0.0
+        self.batches = 0
+        self.coalesced = 0
+        self._notified = False
+
+    def offer(self, deltas: Dict[str, Dict[str, Any]]):
+        """合并一批增量并唤醒发送协程（调用方持有频道锁）"""
+        for code, fields in deltas.items():
+            merged = self.pending.get(code)
+            if merged is None:
+                self.pending[code] = dict(fields)
+            else:
+                merged.update(fields)
+                self.coalesced += 1
+        if not self._notified:
+            self._notified = True
+            try:
+                self.loop.call_soon_threadsafe(self.event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    async def next_batch(self, channel: "_ChainChannel") -> Optional[Dict[str, Dict[str, Any]]]:
+        """等待下一批增量并按客户端间隔节流，心跳间隔内无增量时返回None"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout=CHAIN_PUSH_HEARTBEAT)
+        except asyncio.TimeoutError:
+            return None
+        delay = self.last_sent + self.interval - self.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)  # 节流期间到达的增量继续合并
+        with channel.lock:
+            batch, self.pending = self.pending, {}
+            self.event.clear()
+            self._notified = False
+        self.last_sent = self.loop.time()
+        if batch:
+            self.batches += 1
+        return batch
+
+class _ChainChannel:
+    """一个(标的, 到期日)的推送频道：共用一份订阅，维护各合约最新字段并向客户端分发增量"""
+
+    def __init__(self, key: Tuple[str, str], opened: asyncio.Future):
+        self.key = key
+        self.opened = opened
+        self.lock = threading.Lock()
+        self.refs = 0
+        self.viewers: List[_ChainViewer] = []
+        self.records: List[Dict[str, Any]] = []
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self.lease: Optional[SubscriptionLease] = None
+        self.seq = 0
+
+    def load(self, df: pd.DataFrame):
+        """以快照初始化静态字段和最新推送字段"""
+        fields = [field for field in CHAIN_PUSH_FIELDS if field in df.columns]
+        with self.lock:
+            self.records = frame_to_records(df.drop(columns=fields))
+            self.state = {
+                record['code']: {field: _push_value(record[field]) for field in fields}
+                for record in df[['code'] + fields].to_dict('records')
+            }
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """当前完整快照（调用方持有锁）"""
+        return [{**record, **self.state.get(record['code'], {})} for record in self.records]
+
+    def apply(self, records: List[Dict[str, Any]]) -> int:
+        """比对推送与最新值，只把变化的字段分发给各客户端，返回有变化的合约数"""
+        with self.lock:
+            deltas = {}
+            for record in records:
+                code = record['code']
+                current = self.state.get(code)
+                if current is None:
+                    continue
+                changed = {}
+                for field, value in record.items():
+                    if field == 'code':
+                        continue
+                    value = _push_value(value)
+                    if current.get(field) != value:
+                        current[field] = value
+                        changed[field] = value
+                if changed:
+                    deltas[code] = changed
+            if deltas:
+                self.seq += 1
+                for viewer in self.viewers:
+                    viewer.offer(deltas)
+            return len(deltas)
+
+class ChainPushHub:
+    """期权链推送中心：同一(标的, 到期日)的所有客户端共用一份订阅，由报价推送驱动增量分发"""
+
+    def __init__(self, manager: SubscriptionManager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        self._channels: Dict[Tuple[str, str], _ChainChannel] = {}
+        self._by_code: Dict[str, List[_ChainChannel]] = {}
+
+        # 统计信息
+        self._pushes = 0
+        self._deltas = 0
+        self._joins = 0
+        manager.tracker.add_listener(self.on_push)
+
+    def on_push(self, data: pd.DataFrame):
+        """报价推送回调（推送线程）"""
+        fields = [field for field in CHAIN_PUSH_FIELDS if field in data.columns]
+        if 'code' not in data.columns or not fields:
+            return
+        with self._lock:
+            channels = {id(channel): channel for code in data['code']
+                        for channel in self._by_code.get(code, ())}
+            self._pushes += 1
+        if not channels:
+            return
+        records = data[['code'] + fields].to_dict('records')
+        changed = sum(channel.apply(records) for channel in channels.values())
+        with self._lock:
+            self._deltas += changed
+
+    async def _open(self, channel: _ChainChannel, code: str, target_date: str):
+        """加载快照、登记合约并订阅，先登记再订阅以免漏掉首次推送"""
+        df = await fetch_option_chain_snapshot(code, target_date)
+        if df is None or df.empty:
+            raise LookupError("未找到期权链数据")
+        channel.load(df)
+        codes = list(channel.state)
+        with self._lock:
+            for contract in codes:
+                self._by_code.setdefault(contract, []).append(channel)
+        channel.lease = await opend_executor.run(self.manager.acquire, codes)
+
+    async def join(self, code: str, target_date: str,
+                   interval: float = CHAIN_PUSH_INTERVAL) -> Tuple[_ChainChannel, _ChainViewer, Dict[str, Any]]:
+        """加入频道，频道不存在时创建；返回频道、客户端和首个完整快照"""
+        loop = asyncio.get_running_loop()
+        key = (code, target_date)
+        with self._lock:
+            channel = self._channels.get(key)
+            creator = channel is None
+            if creator:
+                channel = _ChainChannel(key, loop.create_future())
+                self._channels[key] = channel
+            channel.refs += 1
+            self._joins += 1
+
+        if creator:
+            try:
+                await self._open(channel, code, target_date)
+            except BaseException as e:
+                with self._lock:
+                    if self._channels.get(key) is channel:
+                        del self._channels[key]  # 打开失败的频道不再给新客户端复用
+                if isinstance(e, asyncio.CancelledError):
+                    channel.opened.cancel()
+                else:
+                    channel.opened.set_exception(e)
+                    channel.opened.exception()  # 由各等待者各自处理，避免未取回异常的警告
+                self.leave(channel, None)
+                raise
+            channel.opened.set_result(True)
+        else:
+            try:
+                await asyncio.shield(channel.opened)
+            except BaseException:
+                self.leave(channel, None)
+                raise
+
+        viewer = _ChainViewer(loop, interval)
+        with channel.lock:
+            channel.viewers.append(viewer)
+            snapshot = {
+                "stock_code": code,
+                "target_date": target_date,
+                "seq": channel.seq,
+                "quote_status": channel.lease.wait_ready(timeout=0),
+                "options": channel.snapshot(),
+            }
+        return channel, viewer, snapshot
+
+    def leave(self, channel: _ChainChannel, viewer: Optional[_ChainViewer]):
+        """客户端断开；频道无人观看时注销合约并归还订阅引用"""
+        with channel.lock:
+            if viewer in channel.viewers:
+                channel.viewers.remove(viewer)
+        with self._lock:
+            channel.refs -= 1
+            if channel.refs > 0:
+                return
+            if self._channels.get(channel.key) is channel:
+                del self._channels[channel.key]
+            for code in channel.state:
+                owners = self._by_code.get(code)
+                if owners and channel in owners:
+                    owners.remove(channel)
+                    if not owners:
+                        del self._by_code[code]
+        if channel.lease is not None:
+            opend_executor.submit(channel.lease.release)  # 订阅锁可能被慢调用占用，不阻塞事件循环
+
+    def stats(self) -> Dict[str, Any]:
+        """推送状态"""
+        with self._lock:
+            channels = list(self._channels.values())
+            data = {
+                "channels": len(channels),
+                "contracts": len(self._by_code),
+                "joins": self._joins,
+                "pushes": self._pushes,
+                "deltas": self._deltas,
+            }
+        data["viewers"] = []
+        for channel in channels:
+            with channel.lock:
+                data["viewers"].append({
+                    "stock_code": channel.key[0],
+                    "target_date": channel.key[1],
+                    "viewers": len(channel.viewers),
+                    "contracts": len(channel.state),
+                    "seq": channel.seq,
+                    "pending": sum(len(viewer.pending) for viewer in channel.viewers),
+                    "coalesced": sum(viewer.coalesced for viewer in channel.viewers),
+                })
+        return data
+
+chain_push_hub = ChainPushHub(subscription_manager)
+
+# 期权链历史快照
+def _history_table(df: pd.DataFrame, snapshot_ms: int) -> "pa.Table":
+    """快照转为固定列类型的Arrow表：报价字段统一为float64，全空列按字符串处理"""
+    # 分类列还原为字符串，历史文件的schema与是否压缩无关
+    dtypes = {field: 'float64' for field in QUOTE_FIELD_DEFAULTS if field in df.columns}
+    dtypes.update({field: object for field, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+    frame = df.astype(dtypes)
+    frame.insert(0, 'snapshot_ts', np.int64(snapshot_ms))
+    table = pa.Table.from_pandas(frame, preserve_index=False).replace_schema_metadata(None)
+    schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                        for field in table.schema])
+    return table.cast(schema)
+
+def _conform_table(table: "pa.Table", schema: "pa.Schema") -> "pa.Table":
+    """按目标schema对齐列顺序和类型，缺失的列补空值"""
+    columns = [table.column(field.name).cast(field.type) if field.name in table.column_names
+               else pa.nulls(len(table), field.type) for field in schema]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+class ChainHistoryStore:
+    """期权链历史快照：按 标的/到期日/日期 分区追加写入Parquet，后台合并小文件，支持按时间点和合约查询"""
+
+    def __init__(self, root: str = CHAIN_HISTORY_DIR):
+        self.root = root
+        self.enabled = bool(root) and pa is not None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=CHAIN_HISTORY_QUEUE_SIZE)
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._seq = 0
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        # 统计信息
+        self._recorded = 0
+        self._dropped = 0
+        self._written = 0
+        self._write_failures = 0
+        self._compactions = 0
+        self._compacted_files = 0
+
+    def start(self):
+        """启动后台写入和合并线程"""
+        if not self.enabled or self._threads:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        self._stop.clear()
+        for target, name in ((self._write_loop, 'chain-history-writer'),
+                             (self._compact_loop, 'chain-history-compactor')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"🗄️ 历史快照存储已启动: {os.path.abspath(self.root)}")
+
+    def stop(self):
+        """写完队列中的快照后停止后台线程"""
+        if not self._threads:
+            return
+        self._stop.set()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=10)
+        self._threads = []
+
+    def record(self, df: pd.DataFrame):
+        """登记一份新快照，不阻塞请求，队列满时丢弃"""
+        if not self._threads or df is None or df.empty:
+            return
+        try:
+            self._queue.put_nowait((time.time(), df))
+        except queue.Full:
+            with self._cond:
+                self._dropped += 1
+            return
+        with self._cond:
+            self._recorded += 1
+
+    def _partition(self, code: str, expiry: str, date: str) -> str:
+        return os.path.join(self.root, f"symbol={code}", f"expiry={expiry}", f"date={date}")
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            snapshot_time, df = item
+            try:
+                self._write_snapshot(snapshot_time, df)
+            except Exception as e:
+                with self._cond:
+                    self._write_failures += 1
+                print(f"⚠️ 历史快照写入失败: {e}")
+
+    def _write_snapshot(self, snapshot_time: float, df: pd.DataFrame):
+        """每个到期日写一个小文件，先写临时文件再改名，读取方不会看到写了一半的文件"""
+        snapshot_ms = int(snapshot_time * 1000)
+        date = datetime.fromtimestamp(snapshot_time).strftime('%Y-%m-%d')
+        for (owner, expiry), part in df.groupby(['stock_owner', 'strike_time'], sort=False, observed=True):
+            directory = self._partition(owner, expiry, date)
+            os.makedirs(directory, exist_ok=True)
+            with self._cond:
+                self._seq += 1
+                seq = self._seq
+            path = os.path.join(directory, f"part-{snapshot_ms:015d}-{seq:08d}.parquet")
+            pq.write_table(_history_table(part, snapshot_ms), path + '.tmp')
+            os.replace(path + '.tmp', path)
+            with self._cond:
+                self._written += 1
+
+    def _compact_loop(self):
+        while not self._stop.wait(CHAIN_HISTORY_COMPACT_INTERVAL):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"⚠️ 历史快照合并失败: {e}")
+
+    def compact(self):
+        """把小文件较多的分区合并为一个按时间排序、行组较大的文件"""
+        for directory, _, names in os.walk(self.root):
+            parts = sorted(name for name in names if name.startswith('part-') and name.endswith('.parquet'))
+            if len(parts) >= CHAIN_HISTORY_COMPACT_MIN_FILES:
+                self._compact_partition(directory, parts)
+
+    def _compact_partition(self, directory: str, parts: List[str]):
+        target = os.path.join(directory, 'data.parquet')
+        inputs = ([target] if os.path.exists(target) else []) + [os.path.join(directory, name) for name in parts]
+        files = [pq.ParquetFile(path) for path in inputs]
+        schema = pa.unify_schemas([file.schema_arrow for file in files])
+
+        # 逐批读入、凑满行组再写出，内存中最多一个行组
+        buffered, rows = [], 0
+        with pq.ParquetWriter(target + '.tmp', schema) as writer:
+            for file in files:
+                for batch in file.iter_batches(batch_size=CHAIN_HISTORY_ROW_GROUP_ROWS):
+                    buffered.append(_conform_table(pa.Table.from_batches([batch]), schema))
+                    rows += batch.num_rows
+                    if rows >= CHAIN_HISTORY_ROW_GROUP_ROWS:
+                        writer.write_table(pa.concat_tables(buffered), row_group_size=CHAIN_HISTORY_ROW_GROUP_ROWS)
+                        buffered, rows = [], 0
+            if buffered:
+                writer.write_table(pa.concat_tables(buffered), row_group_size=CHAIN_HISTORY_ROW_GROUP_ROWS)
+        files = None
+
+        # 等正在查询的请求结束后再替换，避免查询读到新旧文件重复的数据
+        with self._cond:
+            while self._readers:
+                self._cond.wait()
+            os.replace(target + '.tmp', target)
+            for name in parts:
+                os.remove(os.path.join(directory, name))
+            self._compactions += 1
+            self._compacted_files += len(parts)
+
+    @contextmanager
+    def _reading(self):
+        with self._cond:
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def _dataset(self, code: str, expiry: str, date: str):
+        """分区内所有文件组成的数据集（调用方处于_reading中）"""
+        directory = self._partition(code, expiry, date)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return None
+        paths = sorted(os.path.join(directory, name) for name in names if name.endswith('.parquet'))
+        return pads.dataset(paths, format='parquet') if paths else None
+
+    def as_of(self, code: str, expiry: str, at: float) -> Optional[pd.DataFrame]:
+        """返回指定时间点及之前最近一次的完整期权链快照"""
+        if not self.enabled:
+            return None
+        at_ms = int(at * 1000)
+        day = datetime.fromtimestamp(at).date()
+        with self._reading():
+            for offset in range(CHAIN_HISTORY_LOOKBACK_DAYS + 1):
+                dataset = self._dataset(code, expiry, (day - timedelta(days=offset)).isoformat())
+                if dataset is None:
+                    continue
+                # 先只读时间列找到最近的快照，再按时间过滤读出该快照
+                times = dataset.to_table(columns=['snapshot_ts'],
+                                         filter=pads.field('snapshot_ts') <= at_ms).column('snapshot_ts')
+                if len(times) == 0:
+                    continue
+                latest = pc.max(times).as_py()
+                df = dataset.to_table(filter=pads.field('snapshot_ts') == latest).to_pandas()
+                df.attrs['snapshot_time'] = latest / 1000
+                return df
+        return None
+
+    def series(self, code: str, expiry: str, contract: str, start: float, end: float,
+               fields: Optional[List[str]] = None) -> pd.DataFrame:
+        """返回单个合约在时间范围内的字段时间序列，只读取所需的列和匹配的行"""
+        if not self.enabled:
+            raise ValueError("历史快照存储未启用")
+        if end < start:
+            raise ValueError("结束时间早于开始时间")
+        first_day = datetime.fromtimestamp(start).date()
+        last_day = datetime.fromtimestamp(end).date()
+        if (last_day - first_day).days >= CHAIN_HISTORY_MAX_SERIES_DAYS:
+            raise ValueError(f"时间范围不能超过{CHAIN_HISTORY_MAX_SERIES_DAYS}天")
+        fields = fields or list(QUOTE_FIELD_DEFAULTS)
+
+        condition = ((pads.field('code') == contract)
+                     & (pads.field('snapshot_ts') >= int(start * 1000))
+                     & (pads.field('snapshot_ts') <= int(end * 1000)))
+        tables = []
+        with self._reading():
+            day = first_day
+            while day <= last_day:
+                dataset = self._dataset(code, expiry, day.isoformat())
+                day += timedelta(days=1)
+                if dataset is None:
+                    continue
+                unknown = [field for field in fields if field not in dataset.schema.names]
+                if unknown:
+                    raise ValueError(f"未知字段: {', '.join(unknown)}")
+                tables.append(dataset.to_table(columns=['snapshot_ts'] + fields, filter=condition))
+        if not tables:
+            return pd.DataFrame(columns=['snapshot_ts'] + fields)
+        return pa.concat_tables(tables).to_pandas().sort_values('snapshot_ts', ignore_index=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """存储统计信息"""
+        partitions = files = size = 0
+        if self.enabled and os.path.isdir(self.root):
+            with self._reading():
+                for directory, _, names in os.walk(self.root):
+                    data_files = [name for name in names if name.endswith('.parquet')]
+                    if data_files:
+                        partitions += 1
+                        files += len(data_files)
+                        size += sum(os.path.getsize(os.path.join(directory, name)) for name in data_files)
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "running": bool(self._threads),
+                "root": os.path.abspath(self.root) if self.root else None,
+                "queued": self._queue.qsize(),
+                "recorded": self._recorded,
+                "dropped": self._dropped,
+                "written": self._written,
+                "write_failures": self._write_failures,
+                "compactions": self._compactions,
+                "compacted_files": self._compacted_files,
+                "partitions": partitions,
+                "files": files,
+                "bytes": size,
+            }
+
+chain_history = ChainHistoryStore()
+
+# 期权到期日索引
+def last_rollover(market: str, now: Optional[float] = None) -> float:
+    """该市场最近一次收盘刷新时间点（Unix秒）"""
+    zone, hour, minute = EXPIRATION_ROLLOVER.get(market, EXPIRATION_ROLLOVER['US'])
+    local_now = datetime.fromtimestamp(time.time() if now is None else now, ZoneInfo(zone))
+    rollover = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if local_now < rollover:
+        rollover -= timedelta(days=1)
+    return rollover.timestamp()
+
+class ExpirationIndex:
+    """期权到期日索引：启动时从文件加载并后台预热，每个市场收盘后刷新，未命中时才实时查询OpenD"""
+
+    def __init__(self, path: str = EXPIRATION_INDEX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[List[str], float]] = {}  # 标的 -> (到期日列表, 更新时间)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._refresh_failures = 0
+
+    def symbols(self) -> List[str]:
+        """需要维护的标的：支持列表、自选列表以及查询过的标的"""
+        with self._lock:
+            known = list(self._entries)
+        return list(dict.fromkeys(list(stock_mapping.values()) + SCAN_WATCHLIST + known))
+
+    def lookup(self, code: str) -> Optional[List[str]]:
+        """只查内存"""
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return entry[0]
+
+    def refresh(self, code: str) -> Optional[List[str]]:
+        """实时查询OpenD并更新索引，失败时保留旧数据"""
+        ret, data = query_expiration_dates(code)
+        if ret != RET_OK:
+            with self._lock:
+                self._refresh_failures += 1
+            print(f"⚠️ 获取 {code} 期权到期日期失败: {data}")
+            return None
+        expiries = sorted(data['strike_time'].tolist())
+        with self._lock:
+            self._entries[code] = (expiries, time.time())
+            self._refreshes += 1
+        return expiries
+
+    def get(self, code: str) -> Optional[List[str]]:
+        """查询到期日，未命中时实时查询并持久化"""
+        expiries = self.lookup(code)
+        if expiries is None:
+            expiries = self.refresh(code)
+            if expiries is not None:
+                self.save()
+        return expiries
+
+    async def aget(self, code: str) -> Optional[List[str]]:
+        """命中时直接返回，未命中时在OpenD线程池中查询"""
+        expiries = self.lookup(code)
+        if expiries is None:
+            expiries = await opend_executor.run(self.get, code)
+        return expiries
+
+    def stale(self, now: Optional[float] = None) -> List[str]:
+        """早于所属市场最近一次收盘刷新时间点的标的"""
+        now = time.time() if now is None else now
+        with self._lock:
+            updated = {code: entry[1] for code, entry in self._entries.items()}
+        return [code for code in self.symbols()
+                if updated.get(code, 0) < last_rollover(code.split('.', 1)[0], now)]
+
+    def refresh_stale(self) -> int:
+        """刷新所有过期标的，返回成功数"""
+        refreshed = 0
+        for code in self.stale():
+            if self._stop.is_set():
+                break
+            try:
+                if self.refresh(code) is not None:
+                    refreshed += 1
+            except Exception as e:
+                with self._lock:
+                    self._refresh_failures += 1
+                print(f"⚠️ 刷新 {code} 期权到期日期出错: {e}")
+        if refreshed:
+            self.save()
+        return refreshed
+
+    def load(self):
+        """从文件加载上次保存的索引"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            with self._lock:
+                for code, entry in saved.items():
+                    self._entries[code] = (list(entry['expirations']), float(entry['updated_at']))
+            print(f"📅 已加载 {len(saved)} 个标的的期权到期日期")
+        except Exception as e:
+            print(f"⚠️ 读取到期日索引失败: {e}")
+
+    def save(self):
+        """写入临时文件后改名，避免中途退出留下损坏的文件"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {code: {"expirations": expiries, "updated_at": updated}
+                    for code, (expiries, updated) in self._entries.items()}
+        try:
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            print(f"⚠️ 保存到期日索引失败: {e}")
+
+    def start(self):
+        """加载文件并在后台线程中预热和定期刷新，不阻塞服务启动"""
+        self.load()
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name='expiration-index', daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                with opend_priority('prefetch'):
+                    self.refresh_stale()
+            except Exception as e:
+                print(f"⚠️ 到期日索引刷新出错: {e}")
+            if self._stop.wait(EXPIRATION_REFRESH_CHECK_SECONDS):
+                break
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        """索引统计信息"""
+        stale = set(self.stale())
+        with self._lock:
+            return {
+                "symbols": len(self._entries),
+                "stale": len(stale),
+                "hits": self._hits,
+                "misses": self._misses,
+                "refreshes": self._refreshes,
+                "refresh_failures": self._refresh_failures,
+                "entries": {
+                    code: {
+                        "count": len(expiries),
+                        "updated_at": datetime.fromtimestamp(updated).isoformat(),
+                        "stale": code in stale,
+                    }
+                    for code, (expiries, updated) in self._entries.items()
+                },
+            }
+
+expiration_index = ExpirationIndex()
+
+# 工具函数
+def get_stock_code(stock_input: str) -> str:
+    """获取股票代码"""
+    if stock_input.startswith(('HK.', 'US.', 'CN.')):
+        return stock_input
+    
+    if stock_input in stock_mapping:
+        return stock_mapping[stock_input]
+    
+    raise ValueError(f"未找到股票 '{stock_input}' 的代码映射")
+
+def is_valid_stock_code(stock_code: str) -> bool:
+    """验证股票代码格式（无副作用）"""
+    return bool(re.match(r'^(HK|US|CN)\.[A-Z0-9]+$', stock_code))
+
+def validate_stock_code(stock_code: str) -> bool:
+    """验证单标的请求的股票代码格式，合法时为当前请求标注市场"""
+    valid = is_valid_stock_code(stock_code)
+    if valid:
+        tag_request_market(stock_code)
+    return valid
+
+# 期权链过滤
+OPTION_TYPES = {'ALL': OptionType.ALL, 'CALL': OptionType.CALL, 'PUT': OptionType.PUT}
+OPTION_COND_TYPES = {'ALL': OptionCondType.ALL, 'ITM': OptionCondType.WITHIN, 'OTM': OptionCondType.OUTSIDE}
+
+class ChainFilter(NamedTuple):
+    """期权链服务端过滤条件，可作为缓存键的一部分"""
+    option_type: str = 'ALL'
+    cond_type: str = 'ALL'
+    strike_range_pct: Optional[float] = None
+    atm_strikes: Optional[int] = None
+    delta_min: Optional[float] = None
+    delta_max: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self != NO_CHAIN_FILTER
+
+    @property
+    def needs_spot(self) -> bool:
+        """行权价窗口需要标的价格"""
+        return bool(self.strike_range_pct or self.atm_strikes)
+
+    @property
+    def has_delta(self) -> bool:
+        return self.delta_min is not None or self.delta_max is not None
+
+NO_CHAIN_FILTER = ChainFilter()
+
+def chain_filter_from_request(request: OptionChainRequest) -> ChainFilter:
+    """校验并规范化请求中的过滤条件"""
+    option_type = (request.option_type or 'ALL').upper()
+    cond_type = (request.option_cond_type or 'ALL').upper()
+    if option_type not in OPTION_TYPES:
+        raise HTTPException(status_code=400, detail="option_type 只能是 ALL、CALL 或 PUT")
+    if cond_type not in ('ALL', 'ITM', 'OTM', 'ATM'):
+        raise HTTPException(status_code=400, detail="option_cond_type 只能是 ALL、ITM、OTM 或 ATM")
+    atm_strikes = request.atm_strikes
+    if cond_type == 'ATM':
+        # OpenD没有平值条件，按最接近标的价格的行权价实现
+        cond_type, atm_strikes = 'ALL', atm_strikes or 1
+    if request.strike_range_pct is not None and request.strike_range_pct <= 0:
+        raise HTTPException(status_code=400, detail="strike_range_pct 必须大于0")
+    if atm_strikes is not None and atm_strikes < 1:
+        raise HTTPException(status_code=400, detail="atm_strikes 必须大于等于1")
+    for value in (request.delta_min, request.delta_max):
+        if value is not None and not 0 <= value <= 1:
+            raise HTTPException(status_code=400, detail="delta_min/delta_max 必须在0到1之间")
+    if request.delta_min is not None and request.delta_max is not None and request.delta_min > request.delta_max:
+        raise HTTPException(status_code=400, detail="delta_min 不能大于 delta_max")
+    return ChainFilter(option_type, cond_type, request.strike_range_pct or None, atm_strikes,
+                       request.delta_min, request.delta_max)
+
+def delta_data_filter(chain_filter: ChainFilter, option_type: str) -> Optional[OptionDataFilter]:
+    """把Delta绝对值区间转换为OpenD的带符号区间（看跌期权Delta为负）"""
+    if not chain_filter.has_delta:
+        return None
+    low, high = chain_filter.delta_min, chain_filter.delta_max
+    if option_type == 'PUT':
+        low, high = (-high if high is not None else None), (-low if low is not None else None)
+    data_filter = OptionDataFilter()
+    if low is not None:
+        data_filter.delta_min = low
+    if high is not None:
+        data_filter.delta_max = high
+    return data_filter
+
+def fetch_chain_frames(quote_ctx, code: str, start: str, end: str,
+                       chain_filter: ChainFilter = NO_CHAIN_FILTER) -> Tuple[int, Any]:
+    """查询期权链，类型、价内外和Delta区间在OpenD端过滤"""
+    # 带Delta区间时看涨和看跌的符号相反，需分别查询
+    kinds = ['CALL', 'PUT'] if chain_filter.option_type == 'ALL' and chain_filter.has_delta else [chain_filter.option_type]
+    frames = []
+    for kind in kinds:
+        ret, data = opend_scheduler.call(
+            'get_option_chain',
+            quote_ctx.get_option_chain,
+            code=code,
+            start=start,
+            end=end,
+            option_type=OPTION_TYPES[kind],
+            option_cond_type=OPTION_COND_TYPES[chain_filter.cond_type],
+            data_filter=delta_data_filter(chain_filter, kind),
+            key=(code, start, end, kind, chain_filter.cond_type, chain_filter.delta_min, chain_filter.delta_max)
+        )
+        if ret != RET_OK:
+            return ret, data
+        frames.append(data)
+    if len(frames) == 1:
+        return RET_OK, frames[0]
+    return RET_OK, pd.concat(frames, ignore_index=True)
+
+def query_underlying_price(quote_ctx, code: str) -> Optional[float]:
+    """通过市场快照查询标的最新价"""
+    ret, data = opend_scheduler.call('get_market_snapshot', quote_ctx.get_market_snapshot, [code], key=(code,))
+    if ret != RET_OK:
+        count_opend_error('get_market_snapshot', data)
+        print(f"⚠️ 获取 {code} 标的价格失败: {data}")
+        return None
+    price = float(data['last_price'].iloc[0]) if not data.empty else 0.0
+    return price if price > 0 else None
+
+def apply_strike_window(data: pd.DataFrame, spot: Optional[float], chain_filter: ChainFilter) -> pd.DataFrame:
+    """按标的价格截取行权价窗口，标的价格未知时不截取"""
+    if not spot:
+        print("⚠️ 标的价格未知，跳过行权价窗口过滤")
+        return data
+    distance = (data['strike_price'] - spot).abs()
+    keep = pd.Series(True, index=data.index)
+    if chain_filter.strike_range_pct:
+        keep &= distance <= spot * chain_filter.strike_range_pct / 100
+    if chain_filter.atm_strikes:
+        # 每个到期日和类型内按离标的价格的距离排名，距离相同的行权价并列
+        rank = distance.groupby([data['strike_time'], data['option_type']]).rank(method='dense')
+        keep &= rank <= chain_filter.atm_strikes
+    return data[keep].reset_index(drop=True)
+
+def quote_option_chain(data: pd.DataFrame, record: bool = True) -> pd.DataFrame:
+    """订阅期权链合约、等待推送就绪并并入实时报价"""
+    # 获取期权合约代码列表用于订阅
+    option_codes = data['code'].tolist()
+    
+    # 订阅期权实时数据，已订阅的合约跨请求复用
+    print(f"📡 正在订阅 {len(option_codes)} 个期权合约的实时数据...")
+    with span('subscription'):
+        lease = subscription_manager.acquire(option_codes)
+    with lease:
+        # 等待首次推送到达，而不是固定等待
+        print("⏳ 等待实时数据推送...")
+        with span('quote_wait'):
+            quote_status = lease.wait_ready()
+        print(f"📶 {quote_status['ready']}/{quote_status['total']} 个合约已收到推送，"
+              f"耗时 {quote_status['waited_ms']}ms")
+        
+        # 获取实时数据（只请求订阅成功的合约，未订阅的合约会导致整批报价失败）
+        enriched_data = enrich_option_data(lease.ctx, data, lease.codes)
+        
+        # OpenD未返回的希腊值在本地计算，标的价格优先按平价关系反推，不行再查市场快照
+        owner = str(data['stock_owner'].iloc[0])
+        with span('greeks'):
+            fill_local_greeks(enriched_data, spot_fallback=lambda: query_underlying_price(lease.ctx, owner))
+        
+        # 压缩为紧凑期权链后再缓存和保存历史
+        enriched_data = OptionChainFrame.from_pandas(enriched_data).to_pandas()
+        quote_status['unquoted'] = enriched_data.attrs.pop('unquoted', [])
+        quote_status['greeks'] = enriched_data.attrs.pop('greeks', None)
+        enriched_data.attrs['quote_status'] = quote_status
+        if record:
+            chain_history.record(enriched_data)
+        return enriched_data
+
+def get_option_chain_data(code: str, target_date: str,
+                          chain_filter: ChainFilter = NO_CHAIN_FILTER) -> Optional[pd.DataFrame]:
+    """获取指定到期日的期权链数据，过滤条件在订阅前生效"""
+    if broker_client is not None:
+        return broker_client.snapshot('chain', code=code, target_date=target_date, chain_filter=list(chain_filter))
+    try:
+        spot = None
+        with opend_pool.connection() as quote_ctx:
+            # 查询指定到期日的期权链，类型、价内外和Delta区间下推到OpenD
+            ret, data = fetch_chain_frames(quote_ctx, code, target_date, target_date, chain_filter)
+            if ret == RET_OK and not data.empty and chain_filter.needs_spot:
+                spot = query_underlying_price(quote_ctx, code)
+        
+        if ret != RET_OK:
+            count_opend_error('get_option_chain', data)
+            return None
+        if data.shape[0] == 0:
+            return None
+        
+        if chain_filter.needs_spot:
+            total = len(data)
+            data = apply_strike_window(data, spot, chain_filter)
+            print(f"🎯 行权价窗口保留 {len(data)}/{total} 个合约")
+            if data.empty:
+                return None
+        
+        # 过滤后的期权链只是部分快照，不写入历史
+        return quote_option_chain(data, record=not chain_filter.active)
+            
+    except Exception as e:
+        count_opend_error('get_option_chain', e)
+        print(f"期权链查询时出错: {str(e)}")
+        return None
+
+def chain_query_windows(expiries: List[str], max_span_days: int = OPTION_CHAIN_MAX_SPAN_DAYS) -> List[Tuple[str, str]]:
+    """把到期日列表合并为尽量少的查询区间，每个区间不超过get_option_chain的时间跨度上限"""
+    windows = []
+    for expiry in sorted(expiries):
+        day = datetime.strptime(expiry, '%Y-%m-%d')
+        if windows and (day - datetime.strptime(windows[-1][0], '%Y-%m-%d')).days <= max_span_days:
+            windows[-1][1] = expiry
+        else:
+            windows.append([expiry, expiry])
+    return [(start, end) for start, end in windows]
+
+def get_term_structure_data(code: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                            max_expiries: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """一次性获取多个到期日的期权链：按时间跨度上限分段查询，合并后统一订阅和取报价"""
+    if broker_client is not None:
+        return broker_client.snapshot('term', code=code, start_date=start_date, end_date=end_date,
+                                      max_expiries=max_expiries)
+    try:
+        dates = expiration_index.get(code)
+        if dates is None:
+            return None
+        
+        expiries = [
+            expiry for expiry in dates
+            if (not start_date or expiry >= start_date) and (not end_date or expiry <= end_date)
+        ]
+        if max_expiries:
+            expiries = expiries[:max_expiries]
+        if not expiries:
+            return None
+        
+        windows = chain_query_windows(expiries)
+        print(f"📅 {len(expiries)} 个到期日合并为 {len(windows)} 次期权链查询")
+        frames = []
+        with opend_pool.connection() as quote_ctx:
+            for window_start, window_end in windows:
+                # 与未过滤的单到期日查询使用相同的合并键
+                ret, data = opend_scheduler.call('get_option_chain', quote_ctx.get_option_chain,
+                                                 code=code, start=window_start, end=window_end,
+                                                 key=(code, window_start, window_end, 'ALL', 'ALL', None, None))
+                if ret == RET_OK and not data.empty:
+                    frames.append(data)
+                else:
+                    if ret != RET_OK:
+                        count_opend_error('get_option_chain', data)
+                    print(f"⚠️  {window_start} ~ {window_end} 期权链查询失败: {data}")
+        
+        if not frames:
+            return None
+        
+        data = pd.concat(frames, ignore_index=True).drop_duplicates('code')
+        data = data[data['strike_time'].isin(expiries)].reset_index(drop=True)
+        if data.empty:
+            return None
+        
+        enriched_data = quote_option_chain(data)
+        
+        # 顺带填充单个到期日的缓存（按到期日切片，不复制数据），后续按到期日查询可直接命中
+        quote_status = enriched_data.attrs['quote_status']
+        chain = OptionChainFrame(enriched_data)
+        for expiry in chain.expiries():
+            part = chain.slice(expiry=expiry)
+            part.attrs['quote_status'] = slice_quote_status(quote_status, part['code'])
+            chain_cache.put((code, expiry), part)
+        
+        return enriched_data
+        
+    except Exception as e:
+        print(f"期权期限结构查询时出错: {str(e)}")
+        return None
+
+def slice_quote_status(quote_status: Dict[str, Any], codes: pd.Series) -> Dict[str, Any]:
+    """从多到期日的行情就绪报告中截取部分合约"""
+    wanted = set(codes)
+    result = dict(quote_status)
+    for field in ('missing', 'stale', 'unsubscribed', 'unquoted'):
+        if field in quote_status:
+            result[field] = [code for code in quote_status[field] if code in wanted]
+    result['total'] = len(wanted)
+    result['ready'] = len(wanted) - len(result['missing'])
+    return result
+
+def summarize_term_structure(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """按到期日汇总合约数量、行权价范围、平均隐含波动率和成交持仓"""
+    iv = df['implied_volatility'].where(df['implied_volatility'] > 0)
+    summary = df.assign(
+        is_call=df['option_type'] == 'CALL',
+        is_put=df['option_type'] == 'PUT',
+        iv=iv,
+    ).groupby('strike_time', observed=True).agg(
+        total_options=('code', 'size'),
+        call_options=('is_call', 'sum'),
+        put_options=('is_put', 'sum'),
+        min_strike=('strike_price', 'min'),
+        max_strike=('strike_price', 'max'),
+        avg_implied_volatility=('iv', 'mean'),
+        volume=('volume', 'sum'),
+        open_interest=('open_interest', 'sum'),
+    ).reset_index()
+    summary.insert(1, 'days_to_expiry', days_until(summary['strike_time']))
+    return frame_to_records(summary)
+
+def get_term_structure_snapshot(code: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                                max_expiries: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """通过快照缓存获取多到期日期权链"""
+    return chain_cache.get_or_load(('term', code, start_date, end_date, max_expiries),
+                                   lambda: get_term_structure_data(code, start_date, end_date, max_expiries))
+
+async def fetch_term_structure_snapshot(code: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                                        max_expiries: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """通过快照缓存获取多到期日期权链，回源在OpenD线程池中执行"""
+    return await chain_cache.aget_or_load(('term', code, start_date, end_date, max_expiries),
+                                          lambda: get_term_structure_data(code, start_date, end_date, max_expiries))
+
+def chain_cache_key(code: str, target_date: str, chain_filter: ChainFilter = NO_CHAIN_FILTER) -> Tuple:
+    """期权链快照缓存键，未过滤的期权链与期限结构预填充的键一致"""
+    if chain_filter.active:
+        return (code, target_date, chain_filter)
+    return (code, target_date)
+
+def get_option_chain_snapshot(code: str, target_date: str,
+                              chain_filter: ChainFilter = NO_CHAIN_FILTER) -> Optional[pd.DataFrame]:
+    """通过快照缓存获取期权链数据"""
+    return chain_cache.get_or_load(chain_cache_key(code, target_date, chain_filter),
+                                   lambda: get_option_chain_data(code, target_date, chain_filter))
+
+async def fetch_option_chain_snapshot(code: str, target_date: str,
+                                      chain_filter: ChainFilter = NO_CHAIN_FILTER) -> Optional[pd.DataFrame]:
+    """通过快照缓存获取期权链数据，回源在OpenD线程池中执行"""
+    return await chain_cache.aget_or_load(chain_cache_key(code, target_date, chain_filter),
+                                          lambda: get_option_chain_data(code, target_date, chain_filter))
+
+def query_expiration_dates(code: str) -> Tuple[int, Any]:
+    """查询期权到期日期"""
+    if broker_client is not None:
+        try:
+            expiries = broker_client.call('expirations', code=code)['expirations']
+        except Exception as e:
+            return RET_ERROR, str(e)
+        if expiries is None:
+            return RET_ERROR, "broker未返回到期日"
+        return RET_OK, pd.DataFrame({'strike_time': expiries})
+    with opend_pool.connection() as quote_ctx:
+        ret, data = opend_scheduler.call('get_option_expiration_date', quote_ctx.get_option_expiration_date,
+                                         code=code, key=(code,))
+    if ret != RET_OK:
+        count_opend_error('get_option_expiration_date', data)
+    return ret, data
+
+# 实时报价字段及缺失报价时的默认值（默认值类型决定列类型）
+QUOTE_FIELD_DEFAULTS = {
+    'last_price': 0.0,
+    'open_price': 0.0,
+    'high_price': 0.0,
+    'low_price': 0.0,
+    'prev_close_price': 0.0,
+    'volume': 0,
+    'turnover': 0.0,
+    'turnover_rate': 0.0,
+    'amplitude': 0,
+    'open_interest': 0,
+    'implied_volatility': 0.0,
+    'delta': 0.0,
+    'gamma': 0.0,
+    'vega': 0.0,
+    'theta': 0.0,
+    'rho': 0.0,
+    'premium': 0.0,
+}
+
+def merge_quote_data(df: pd.DataFrame, quote_data: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """按合约代码把报价数据一次性并入期权链，没有报价的合约保持默认值"""
+    quotes = None
+    if quote_data is not None and not quote_data.empty:
+        # 同一代码出现多次时以最后一条为准
+        quotes = quote_data.drop_duplicates('code', keep='last').set_index('code')
+        positions = quotes.index.get_indexer(df['code'])
+        matched = positions >= 0
+        if not matched.any():
+            quotes = None
+    
+    # 先算好全部报价列再一次拼接，避免复制后逐列插入
+    columns = {}
+    for field, default in QUOTE_FIELD_DEFAULTS.items():
+        if quotes is None or field not in quotes.columns:
+            columns[field] = np.full(len(df), default)
+            continue
+        
+        values = np.full(len(df), default, dtype='float64')
+        source = pd.to_numeric(quotes[field], errors='coerce').to_numpy(dtype='float64')
+        values[matched] = source[positions[matched]]
+        # 整数列只有在全部为整数值时才保持int64，否则与逐行写入时一样升级为float64
+        if isinstance(default, int) and np.all(np.mod(values, 1) == 0):
+            values = values.astype('int64')
+        columns[field] = values
+    
+    existing = [field for field in QUOTE_FIELD_DEFAULTS if field in df.columns]
+    if existing:
+        # 已有的报价列原位替换，保持列顺序
+        enriched_df = df.copy()
+        for field, values in columns.items():
+            enriched_df[field] = values
+        return enriched_df
+    return pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+
+def enrich_option_data(quote_ctx: OpenQuoteContext, df: pd.DataFrame,
+                       codes: Optional[List[str]] = None) -> pd.DataFrame:
+    """使用实时数据丰富期权数据，codes指定需要取报价的合约（默认全部）"""
+    print("📊 正在获取实时数据...")
+    
+    # 分片并发获取实时报价，单个合约出错不影响其余合约
+    all_codes = df['code'].tolist() if codes is None else codes
+    quote_data, unquoted = quote_fetcher.fetch(quote_ctx, all_codes) if all_codes else (None, [])
+    if quote_data is not None:
+        print(f"✅ 成功获取 {len(quote_data)} 个合约的实时报价")
+    if unquoted:
+        print(f"⚠️ {len(unquoted)} 个合约未能获取报价")
+    
+    with span('enrich'):
+        enriched_df = merge_quote_data(df, quote_data)
+        # 没有报价的合约保持默认值，用quote_available标出，避免被当作真实价格
+        enriched_df['quote_available'] = (df['code'].isin(quote_data['code']).to_numpy()
+                                          if quote_data is not None else False)
+    enriched_df.attrs['unquoted'] = unquoted
+    
+    print("✅ 实时数据获取完成")
+    return enriched_df
+
+# 紧凑期权链
+CHAIN_CATEGORY_FIELDS = ['option_type', 'strike_time', 'stock_owner', 'stock_type', 'index_option_type']  # 重复取值的字符串列
+CHAIN_SORT_FIELDS = ['strike_time', 'option_type', 'strike_price']
+
+class OptionChainFrame:
+    """紧凑期权链：重复字符串存为分类编码（数值列保持float64，CSV和JSON输出与原数据一致），按 到期日/类型/行权价 排序，按到期日和类型切片不复制数据"""
+
+    def __init__(self, frame: pd.DataFrame):
+        """frame须已按CHAIN_SORT_FIELDS排序（由from_pandas生成）"""
+        self.frame = frame
+        self._groups: Dict[Tuple[str, str], Tuple[int, int]] = {}  # (到期日, 类型) -> 行区间
+        if frame.empty or not set(CHAIN_SORT_FIELDS) <= set(frame.columns):
+            return
+        expiry = frame['strike_time'].to_numpy()
+        kind = frame['option_type'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, (expiry[1:] != expiry[:-1]) | (kind[1:] != kind[:-1])])
+        stops = np.r_[starts[1:], len(frame)]
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            self._groups[(expiry[start], kind[start])] = (start, stop)
+
+    @classmethod
+    def from_pandas(cls, df: pd.DataFrame) -> "OptionChainFrame":
+        """一次转换列类型并排序，保留attrs"""
+        # pandas 3起字符串列默认为str类型而非object
+        dtypes = {field: 'category' for field in CHAIN_CATEGORY_FIELDS
+                  if field in df.columns and pd.api.types.is_string_dtype(df[field].dtype)}
+        frame = df.astype(dtypes) if dtypes else df
+        sort_fields = [field for field in CHAIN_SORT_FIELDS if field in frame.columns]
+        if sort_fields:
+            frame = frame.sort_values(sort_fields, kind='stable', ignore_index=True)
+        elif frame is df:
+            frame = df.copy()
+        frame.attrs = dict(df.attrs)
+        return cls(frame)
+
+    def to_pandas(self) -> pd.DataFrame:
+        """返回底层DataFrame（不复制，调用方不要原地修改）"""
+        return self.frame
+
+    def expiries(self) -> List[str]:
+        return sorted({expiry for expiry, _ in self._groups})
+
+    def slice(self, expiry: Optional[str] = None, option_type: Optional[str] = None,
+              strike_min: Optional[float] = None, strike_max: Optional[float] = None) -> pd.DataFrame:
+        """按到期日、类型和行权价区间切片；指定到期日且结果行连续时返回视图，否则返回副本"""
+        if expiry is None:
+            keep = pd.Series(True, index=self.frame.index)
+            if option_type is not None:
+                keep &= self.frame['option_type'] == option_type
+            if strike_min is not None:
+                keep &= self.frame['strike_price'] >= strike_min
+            if strike_max is not None:
+                keep &= self.frame['strike_price'] <= strike_max
+            return self.frame[keep].reset_index(drop=True)
+        
+        ranges = sorted(bounds for (group_expiry, kind), bounds in self._groups.items()
+                        if group_expiry == expiry and option_type in (None, kind))
+        if strike_min is not None or strike_max is not None:
+            # 组内行权价有序，二分查找区间边界
+            strikes = self.frame['strike_price'].to_numpy()
+            ranges = [(start + (int(np.searchsorted(strikes[start:stop], strike_min, 'left')) if strike_min is not None else 0),
+                       start + (int(np.searchsorted(strikes[start:stop], strike_max, 'right')) if strike_max is not None else stop - start))
+                      for start, stop in ranges]
+            ranges = [(start, stop) for start, stop in ranges if stop > start]
+        if not ranges:
+            return self.frame.iloc[0:0]
+        
+        contiguous = all(ranges[i][1] == ranges[i + 1][0] for i in range(len(ranges) - 1))
+        if contiguous:
+            part = self.frame.iloc[ranges[0][0]:ranges[-1][1]]
+        else:
+            part = self.frame.iloc[np.concatenate([np.arange(start, stop) for start, stop in ranges])]
+        part.index = pd.RangeIndex(len(part))
+        return part
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.frame.memory_usage(index=True, deep=True).sum())
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+# 本地希腊值
+def years_to_expiry(strike_time: pd.Series, market: str, now: Optional[float] = None) -> np.ndarray:
+    """到期日收盘前的年化剩余期限（按自然日），已到期为0"""
+    zone, hour, minute = MARKET_CLOSE.get(market, MARKET_CLOSE['US'])
+    expiry = pd.to_datetime(np.asarray(strike_time, dtype=object), errors='coerce')
+    close = (expiry + pd.Timedelta(hours=hour, minutes=minute)).tz_localize(zone)
+    # 默认按整分钟计算，同一分钟内重复加载得到相同的本地希腊值，不会产生新的期权链版本
+    current = pd.Timestamp(time.time() // 60 * 60 if now is None else now, unit='s', tz='UTC')
+    seconds = np.asarray((close - current).total_seconds(), dtype='float64')
+    return np.maximum(seconds, 0.0) / (365 * 86400)
+
+def option_prices(df: pd.DataFrame) -> np.ndarray:
+    """求解隐含波动率用的期权价格：最新价，没有成交时用最高最低价的中间价"""
+    last = df['last_price'].to_numpy(dtype='float64')
+    mid = ((df['high_price'] + df['low_price']) / 2).to_numpy(dtype='float64')
+    return np.where(last > 0, last, np.where(mid > 0, mid, np.nan))
+
+def parity_spot(df: pd.DataFrame, price: np.ndarray, t: np.ndarray, rate: float = RISK_FREE_RATE) -> Optional[float]:
+    """用每个到期日最接近平值的看涨/看跌期权按平价关系反推标的价格，无需额外调用OpenD"""
+    frame = pd.DataFrame({
+        'expiry': np.asarray(df['strike_time'], dtype=object),
+        'strike': df['strike_price'].to_numpy(dtype='float64'),
+        'is_call': (df['option_type'] == 'CALL').to_numpy(),
+        'price': price,
+        't': t,
+    })
+    frame = frame[(frame['price'] > 0) & (frame['t'] > 0)]
+    calls = frame[frame['is_call']].drop_duplicates(['expiry', 'strike'])
+    puts = frame[~frame['is_call']].drop_duplicates(['expiry', 'strike'])
+    pairs = calls.merge(puts, on=['expiry', 'strike'], suffixes=('_call', '_put'))
+    if pairs.empty:
+        return None
+    pairs['spread'] = (pairs['price_call'] - pairs['price_put']).abs()
+    nearest = pairs.loc[pairs.groupby('expiry')['spread'].idxmin()]
+    estimates = (nearest['price_call'] - nearest['price_put']
+                 + nearest['strike'] * np.exp(-rate * nearest['t_call']))
+    spot = float(np.median(estimates))
+    return spot if spot > 0 else None
+
+def fill_local_greeks(df: pd.DataFrame, spot_fallback: Optional[Callable[[], Optional[float]]] = None,
+                      mode: str = GREEKS_LOCAL_MODE, rate: float = RISK_FREE_RATE) -> pd.DataFrame:
+    """按Black-Scholes补全OpenD未返回（为0）的隐含波动率和希腊值，check模式同时核对OpenD的值。
+    greeks_source标出每个合约的数值来源，原地修改并返回df"""
+    if mode not in ('fill', 'check') or df.empty:
+        return df
+    
+    vendor_iv = df['implied_volatility'].to_numpy(dtype='float64')
+    vendor = vendor_iv > 0
+    need = ~vendor if mode == 'fill' else np.ones(len(df), dtype=bool)
+    source = np.where(vendor, 'vendor', 'missing').astype(object)
+    deviation = np.full(len(df), np.nan)
+    summary: Dict[str, Any] = {"mode": mode}
+    
+    if need.any():
+        market = str(df['stock_owner'].iloc[0]).split('.', 1)[0]
+        t = years_to_expiry(df['strike_time'], market)
+        price = option_prices(df)
+        is_call = (df['option_type'] == 'CALL').to_numpy()
+        strike = df['strike_price'].to_numpy(dtype='float64')
+        spot = parity_spot(df, price, t, rate)
+        if spot is None and spot_fallback is not None:
+            spot = spot_fallback()
+        summary["spot"] = spot
+        
+        if spot:
+            rows = np.flatnonzero(need)
+            iv = implied_volatility(price[rows], is_call[rows], spot, strike[rows], t[rows], rate)
+            solved = np.isfinite(iv)
+            rows, iv = rows[solved], iv[solved]
+            greeks = bs_greeks(is_call[rows], spot, strike[rows], t[rows], rate, iv)
+            greeks['implied_volatility'] = iv * 100  # OpenD返回百分数
+            
+            fill = ~vendor[rows]
+            target = rows[fill]
+            if target.size:
+                for field, values in greeks.items():
+                    column = df[field].to_numpy(dtype='float64', copy=True)
+                    column[target] = values[fill]
+                    df[field] = column
+                source[target] = 'local'
+            if mode == 'check':
+                checked = rows[~fill]
+                deviation[checked] = np.abs(greeks['implied_volatility'][~fill] - vendor_iv[checked])
+                summary["checked"] = int(checked.size)
+                summary["mismatched"] = int((deviation[checked] > GREEKS_CHECK_TOLERANCE).sum())
+    
+    summary.update({name: int((source == name).sum()) for name in GREEKS_SOURCES})
+    df['greeks_source'] = pd.Categorical(source, categories=GREEKS_SOURCES)
+    if mode == 'check':
+        df['iv_deviation'] = deviation
+    df.attrs['greeks'] = summary
+    if summary['local']:
+        print(f"🧮 本地计算了 {summary['local']} 个合约的隐含波动率和希腊值")
+    return df
+
+def _format_column(values: pd.Series, spec: str = '', suffix: str = '') -> List[str]:
+    """按格式批量格式化一列数值"""
+    return [format(value, spec) + suffix for value in values.tolist()]
+
+def _format_change_pct(last_price: pd.Series, prev_close_price: pd.Series) -> List[str]:
+    """批量计算涨跌幅，昨收为0时记为0.00%"""
+    last = last_price.to_numpy()
+    prev = prev_close_price.to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (last - prev) / prev * 100
+    return [f"{pct:.2f}%" if has_prev else "0.00%"
+            for pct, has_prev in zip(change.tolist(), (prev != 0).tolist())]
+
+def _csv_header_rows(target_date: str) -> List[List[str]]:
+    """CSV表头和到期日信息行"""
+    # 计算到期天数
+    try:
+        target_date_obj = datetime.strptime(target_date, '%Y-%m-%d').date()
+        today = datetime.now().date()
+        days_to_expiry = (target_date_obj - today).days
+        expiry_info = f"到期日：{target_date}(W) {days_to_expiry}天到期"
+    except:
+        expiry_info = f"到期日：{target_date}(W) 6天到期"
+    
+    # 添加表头
+    header = [
+        "时间价值", "盈利概率", "Vega", "Theta", "Gamma", "Delta",  # 时间价值到Delta
+        "未平仓数", "成交量", "涨跌幅", "最新价", "中间价", "隐含波动率",  # 未平仓数到隐含波动率
+        "卖出价", "买入价", "行权价",  # 卖出价、买入价、行权价
+        "买入价", "卖出价", "隐含波动率", "中间价", "最新价", "涨跌幅",  # 买入价、卖出价、隐含波动率、中间价、最新价、涨跌幅
+        "成交量", "未平仓数", "Delta", "Gamma", "Theta", "Vega", "盈利概率", "时间价值"  # 成交量到时间价值
+    ]
+    
+    # 添加到期日信息行
+    info_row = [""] * 14 + [expiry_info] + [""] * 14
+    return [header, info_row]
+
+def _pair_by_strike(df: pd.DataFrame) -> pd.DataFrame:
+    """按行权价一次性配对：每个行权价取第一个看涨和第一个看跌期权，缺任意一边则跳过"""
+    chain = df[df['strike_price'].notna()]
+    calls = chain[chain['option_type'] == 'CALL'].drop_duplicates('strike_price', keep='first')
+    puts = chain[chain['option_type'] == 'PUT'].drop_duplicates('strike_price', keep='first')
+    return calls.merge(puts, on='strike_price', how='inner', suffixes=('_call', '_put'), sort=True)
+
+def _format_pair_rows(pairs: pd.DataFrame) -> List[List[str]]:
+    """把配对后的行权价整列格式化为CSV行"""
+    call = {field: pairs[f"{field}_call"] for field in QUOTE_FIELD_DEFAULTS}
+    put = {field: pairs[f"{field}_put"] for field in QUOTE_FIELD_DEFAULTS}
+    
+    # 整列计算涨跌幅和中间价
+    call_change_pct = _format_change_pct(call['last_price'], call['prev_close_price'])
+    put_change_pct = _format_change_pct(put['last_price'], put['prev_close_price'])
+    call_mid_price = (call['high_price'] + call['low_price']) / 2
+    put_mid_price = (put['high_price'] + put['low_price']) / 2
+    
+    # 按列批量格式化：左边是看涨期权，右边是看跌期权，中间是行权价
+    columns = [
+        # 左边：看涨期权信息
+        _format_column(call['premium'], '.2f'), call_change_pct, _format_column(call['vega'], '.4f'),
+        _format_column(call['theta'], '.4f'), _format_column(call['gamma'], '.4f'), _format_column(call['delta'], '.4f'),  # 时间价值到Delta
+        _format_column(call['open_interest'], suffix='张'), _format_column(call['volume'], suffix='张'), call_change_pct,
+        _format_column(call['last_price'], '.2f'), _format_column(call_mid_price, '.3f'),
+        _format_column(call['implied_volatility'], '.2f', '%'),  # 未平仓数到隐含波动率
+        _format_column(call['high_price'], '.2f'), _format_column(call['low_price'], '.2f'),
+        _format_column(pairs['strike_price']),  # 卖出价、买入价、行权价
+        # 右边：看跌期权信息
+        _format_column(put['low_price'], '.2f'), _format_column(put['high_price'], '.2f'),
+        _format_column(put['implied_volatility'], '.2f', '%'), _format_column(put_mid_price, '.3f'),
+        _format_column(put['last_price'], '.2f'), put_change_pct,  # 买入价、卖出价、隐含波动率、中间价、最新价、涨跌幅
+        _format_column(put['volume'], suffix='张'), _format_column(put['open_interest'], suffix='张'),
+        _format_column(put['delta'], '.4f'), _format_column(put['gamma'], '.4f'), _format_column(put['theta'], '.4f'),
+        _format_column(put['vega'], '.4f'), put_change_pct, _format_column(put['premium'], '.2f')  # 成交量到时间价值
+    ]
+    
+    return [list(row) for row in zip(*columns)]
+
+def iter_csv_rows(df: pd.DataFrame, target_date: str, chunk_rows: int = CSV_STREAM_CHUNK_ROWS):
+    """逐行生成期权链CSV数据，按行权价分块整列格式化，内存占用与分块大小相关而非整表大小"""
+    if df is None or df.empty:
+        return
+    
+    yield from _csv_header_rows(target_date)
+    
+    pairs = _pair_by_strike(df)
+    for start in range(0, len(pairs), chunk_rows):
+        yield from _format_pair_rows(pairs.iloc[start:start + chunk_rows])
+
+def generate_csv_data(df: pd.DataFrame, target_date: str) -> List[List[str]]:
+    """生成期权链CSV数据 - 每个行权价一行，左边看涨期权，右边看跌期权"""
+    return list(iter_csv_rows(df, target_date))
+
+def format_csv_row(row: List[str]) -> str:
+    """格式化一行CSV，每个单元格加双引号"""
+    return ','.join(f'"{cell}"' for cell in row) + '\n'
+
+def format_csv_content(csv_data: List[List[str]]) -> str:
+    """把CSV数据拼接为文本，每个单元格加双引号"""
+    return ''.join(format_csv_row(row) for row in csv_data)
+
+def iter_csv_bytes(rows, compress: bool = False, buffer_size: int = 64 * 1024):
+    """把CSV行流式编码为UTF-8（带BOM）字节块，可选gzip压缩"""
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 输出gzip格式
+    buffer = [codecs.BOM_UTF8]
+    buffered = len(codecs.BOM_UTF8)
+    
+    for row in rows:
+        line = format_csv_row(row).encode('utf-8')
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= buffer_size:
+            chunk = b''.join(buffer)
+            buffer, buffered = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    
+    chunk = b''.join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+def write_csv_file(csv_data: List[List[str]], file_path: str) -> int:
+    """按块写入CSV文件，返回写入的字节数"""
+    file_size = 0
+    with open(file_path, 'wb') as f:
+        for chunk in iter_csv_bytes(csv_data):
+            f.write(chunk)
+            file_size += len(chunk)
+    return file_size
+
+def csv_filename(stock_code: str, target_date: str) -> str:
+    """生成CSV文件名"""
+    stock_name = stock_code.replace('.', '_')
+    date_str = target_date.replace('-', '')
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    return f"{stock_name}_{date_str}_{timestamp}.csv"
+
+def csv_streaming_response(rows, filename: str, compress: bool = False) -> StreamingResponse:
+    """以流式响应返回CSV文件下载"""
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(
+        iter_csv_bytes(rows, compress),
+        media_type='text/csv; charset=utf-8',
+        headers=headers
+    )
+
+# 期望价值(EV)计算，与前端calculateExpectedValue的算法保持一致
+EV_DELTA_WEIGHT = 0.8  # 行权概率中Delta的权重
+EV_PROFIT_WEIGHT = 0.2  # 行权概率中盈利概率的权重
+EV_TRADING_DAYS = 252.0  # 年化交易日
+EV_PRICE_RANGE_STD = 3.0  # 积分区间为标的价格上下各3个标准差
+
+def _norm_cdf(z: np.ndarray) -> np.ndarray:
+    """标准正态分布累积分布函数（与前端相同的erf近似）"""
+    x = np.abs(z) / math.sqrt(2)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    y = 1.0 - (((((1.061405429 * t - 1.453152027) * t) + 1.421413741) * t - 0.284496736) * t
+               + 0.254829592) * t * np.exp(-x * x)
+    return 0.5 * (1.0 + np.sign(z) * y)
+
+def estimate_underlying_price(df: pd.DataFrame) -> Optional[float]:
+    """用Delta=0.5上下最近的两个看涨期权行权价加权估算标的价格（与前端导入CSV时的方法一致）"""
+    calls = df[(df['option_type'] == 'CALL') & (df['delta'] > 0)]
+    if calls.empty:
+        return None
+    upper = calls[calls['delta'] > 0.5].nsmallest(1, 'delta')
+    lower = calls[calls['delta'] < 0.5].nlargest(1, 'delta')
+    if not upper.empty and not lower.empty:
+        upper_weight = 1 / abs(upper['delta'].iloc[0] - 0.5)
+        lower_weight = 1 / abs(lower['delta'].iloc[0] - 0.5)
+        return float((upper['strike_price'].iloc[0] * upper_weight + lower['strike_price'].iloc[0] * lower_weight)
+                     / (upper_weight + lower_weight))
+    nearest = upper if not upper.empty else lower
+    if not nearest.empty:
+        return float(nearest['strike_price'].iloc[0])
+    return float(calls['strike_price'].median())
+
+def days_until(strike_time: pd.Series) -> np.ndarray:
+    """按到期日计算每个合约的剩余天数"""
+    # 紧凑期权链的到期日是分类列，先转为普通数组，避免to_datetime返回Categorical
+    expiry = pd.to_datetime(np.asarray(strike_time, dtype=object), errors='coerce')
+    today = pd.Timestamp(datetime.now().date())
+    return np.asarray((expiry - today).days, dtype='float64')
+
+def _potential_payout(option_is_call: np.ndarray, strike: np.ndarray, premium: np.ndarray,
+                      underlying_price: np.ndarray, sigma: np.ndarray) -> np.ndarray:
+    """卖方潜在赔付：在标的价格±3σ区间内对(行权损失-权利金)的正部做正态期望，使用闭式解代替1000步数值积分"""
+    lo = underlying_price - EV_PRICE_RANGE_STD * sigma
+    hi = underlying_price + EV_PRICE_RANGE_STD * sigma
+    # 看涨：损失 x-(K+权利金)；看跌：损失 (K-权利金)-x
+    breakeven = np.where(option_is_call, strike + premium, strike - premium)
+    a = np.where(option_is_call, np.maximum(breakeven, lo), lo)
+    b = np.where(option_is_call, hi, np.minimum(breakeven, hi))
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        safe_sigma = np.where(sigma > 0, sigma, 1.0)
+        za = (a - underlying_price) / safe_sigma
+        zb = (b - underlying_price) / safe_sigma
+        mass = _norm_cdf(zb) - _norm_cdf(za)
+        # σ²·pdf(x) = σ/√(2π)·exp(-z²/2)
+        density_a = safe_sigma / math.sqrt(2 * math.pi) * np.exp(-0.5 * za * za)
+        density_b = safe_sigma / math.sqrt(2 * math.pi) * np.exp(-0.5 * zb * zb)
+        call_payout = density_a - density_b + (underlying_price - breakeven) * mass
+        put_payout = (breakeven - underlying_price) * mass + density_b - density_a
+        payout = np.where(option_is_call, call_payout, put_payout)
+        payout = np.where(b > a, np.maximum(payout, 0.0), 0.0)
+
+    # 波动率或期限为0时退化为到期价格等于当前价格
+    degenerate = np.where(option_is_call, underlying_price - breakeven, breakeven - underlying_price)
+    return np.where(sigma > 0, payout, np.maximum(degenerate, 0.0))
+
+def compute_option_ev(df: pd.DataFrame, underlying_price: float,
+                      days_to_expiry: Optional[float] = None,
+                      profit_probability: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """整条期权链一次性计算卖方期望价值：行权概率、潜在赔付、EV和风险收益比"""
+    is_call = (df['option_type'] == 'CALL').to_numpy()
+    strike = df['strike_price'].to_numpy(dtype='float64')
+    mid_price = ((df['high_price'] + df['low_price']) / 2).to_numpy(dtype='float64')
+    delta = df['delta'].to_numpy(dtype='float64')
+    iv = df['implied_volatility'].to_numpy(dtype='float64') / 100  # OpenD返回百分数
+    days = np.full(len(df), float(days_to_expiry)) if days_to_expiry is not None else days_until(df['strike_time'])
+    days = np.nan_to_num(np.maximum(days, 0.0))
+    spot = np.full(len(df), float(underlying_price))
+
+    if profit_probability is None:
+        # 与前端一致：CSV“盈利概率”列为涨跌幅绝对值，保留一位小数
+        prev = df['prev_close_price'].to_numpy(dtype='float64')
+        last = df['last_price'].to_numpy(dtype='float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = np.where(prev != 0, (last - prev) / prev * 100, 0.0)
+        profit_probability = np.round(np.abs(np.nan_to_num(change)), 1) / 100
+
+    intrinsic = np.where(is_call, np.maximum(0.0, spot - strike), np.maximum(0.0, strike - spot))
+    is_itm = np.where(is_call, spot > strike, spot < strike)
+
+    exercise_prob = np.clip(np.abs(delta) * EV_DELTA_WEIGHT + profit_probability * EV_PROFIT_WEIGHT, 0.01, 0.99)
+    sigma = spot * iv * np.sqrt(days / EV_TRADING_DAYS)
+    payout = _potential_payout(is_call, strike, mid_price, spot, sigma)
+    payout = np.where(is_itm, intrinsic + payout, payout)
+
+    premium_component = mid_price * (1 - exercise_prob)
+    payout_component = payout * exercise_prob
+    with np.errstate(divide='ignore', invalid='ignore'):
+        risk_reward = np.where(mid_price > 0, payout / mid_price, np.nan)
+
+    return pd.DataFrame({
+        'code': df['code'].to_numpy(),
+        'option_type': df['option_type'].to_numpy(),
+        'strike_price': strike,
+        'strike_time': df['strike_time'].to_numpy(),
+        'mid_price': mid_price,
+        'delta': delta,
+        'implied_volatility': iv,
+        'days_to_expiry': days,
+        'intrinsic_value': intrinsic,
+        'time_value': mid_price - intrinsic,
+        'is_itm': is_itm,
+        'exercise_probability': exercise_prob,
+        'no_exercise_probability': 1 - exercise_prob,
+        'potential_payout': payout,
+        'premium_component': premium_component,
+        'payout_component': payout_component,
+        'expected_value': premium_component - payout_component,
+        'risk_reward_ratio': risk_reward,
+    }, index=df.index)
+
+def scan_candidates(df: pd.DataFrame, request: ScanRequest) -> pd.DataFrame:
+    """在期权链中筛选README推荐的Delta区间内的卖方候选，计算EV并按EV收益率排序"""
+    delta = df['delta']
+    in_band = (
+        ((df['option_type'] == 'CALL') & delta.between(request.call_delta_min, request.call_delta_max)) |
+        ((df['option_type'] == 'PUT') & delta.between(request.put_delta_min, request.put_delta_max))
+    )
+    candidates = df[in_band & (df['high_price'] + df['low_price'] > 0)]
+    if candidates.empty:
+        return candidates.iloc[:, :0]
+    
+    # 用最近到期日的看涨期权估算标的价格，Delta在近月最接近真实值
+    underlying_price = None
+    for _, part in df.groupby('strike_time', observed=True):
+        underlying_price = estimate_underlying_price(part)
+        if underlying_price:
+            break
+    if not underlying_price:
+        return candidates.iloc[:, :0]
+    
+    ev = compute_option_ev(candidates, underlying_price)
+    # 不同标的价格量级不同，按行权价名义本金归一化后排序
+    ev['ev_yield'] = ev['expected_value'] / ev['strike_price']
+    ev['underlying_price'] = underlying_price
+    ev.insert(0, 'stock_code', candidates['stock_owner'].to_numpy())
+    if request.min_expected_value is not None:
+        ev = ev[ev['expected_value'] >= request.min_expected_value]
+    return ev.sort_values('ev_yield', ascending=False)
+
+def scan_symbols(request: ScanRequest) -> List[str]:
+    """确定扫描的标的列表（去重并保持顺序）"""
+    symbols = request.symbols or list(stock_mapping.values()) + SCAN_WATCHLIST
+    resolved = []
+    for symbol in symbols:
+        try:
+            code = get_stock_code(symbol)
+        except ValueError:
+            continue
+        if is_valid_stock_code(code):
+            resolved.append(code)
+    return list(dict.fromkeys(resolved))
+
+# 组合风险
+def underlying_spot(df: pd.DataFrame) -> Optional[float]:
+    """从期权链估算标的价格：先按平价关系反推，不行再按Delta估算"""
+    market = str(df['stock_owner'].iloc[0]).split('.', 1)[0]
+    spot = parity_spot(df, option_prices(df), years_to_expiry(df['strike_time'], market))
+    return spot or estimate_underlying_price(df)
+
+def atm_volatility(df: pd.DataFrame, spot: float) -> Optional[float]:
+    """离标的价格最近的行权价上的隐含波动率（小数），用于生成标的价格情景"""
+    iv = df['implied_volatility'].to_numpy(dtype='float64')
+    strike = df['strike_price'].to_numpy(dtype='float64')
+    valid = iv > 0
+    if not valid.any():
+        return None
+    distance = np.abs(strike[valid] - spot)
+    return float(np.median(iv[valid][distance == distance.min()])) / 100
+
+def compute_portfolio_risk(legs: pd.DataFrame, spots: Dict[str, float], move_vols: Dict[str, float],
+                           horizon_days: float, confidence: float, price_steps: int, price_range_std: float,
+                           vol_shocks: List[float], rate: float = RISK_FREE_RATE) -> Dict[str, Any]:
+    """在共同的 波动率平移×标准正态情景 网格上一次性为全部持仓重新定价，汇总盈亏分布、VaR/ES和希腊值。
+    各标的按同一个z值移动（完全相关），是对分散化效果的保守估计"""
+    horizon = horizon_days / 365
+    z = np.linspace(-price_range_std, price_range_std, price_steps)
+    weights = np.exp(-0.5 * z * z)
+    weights /= weights.sum()
+    shocks = np.asarray(vol_shocks, dtype='float64')
+    
+    owners = legs['stock_code'].to_numpy()
+    symbols = list(dict.fromkeys(owners.tolist()))
+    spot = np.array([spots[owner] for owner in owners])
+    move = np.array([move_vols[owner] for owner in owners])
+    is_call = (legs['option_type'] == 'CALL').to_numpy()
+    strike = legs['strike_price'].to_numpy(dtype='float64')
+    iv = legs['implied_volatility'].to_numpy(dtype='float64') / 100
+    remaining = np.maximum(legs['t'].to_numpy(dtype='float64') - horizon, 0.0)
+    premium = legs['premium'].to_numpy(dtype='float64')
+    multiplier = legs['quantity'].to_numpy(dtype='float64') * legs['lot_size'].to_numpy(dtype='float64')
+    
+    # 维度：持仓 × 波动率情景 × 价格情景
+    prices = spot[:, None] * np.exp(move[:, None] * math.sqrt(horizon) * z[None, :] - 0.5 * move[:, None] ** 2 * horizon)
+    sigma = np.maximum(iv[:, None] + shocks[None, :] / 100, RISK_MIN_VOLATILITY)
+    S = prices[:, None, :]
+    K = strike[:, None, None]
+    T = remaining[:, None, None]
+    value = bs_price(is_call[:, None, None], S, K, T, rate, sigma[:, :, None])
+    intrinsic = np.where(is_call[:, None, None], np.maximum(S - K, 0.0), np.maximum(K - S, 0.0))
+    value = np.where(T > 0, value, intrinsic)  # 风险期限内到期的按内在价值结算
+    leg_pnl = multiplier[:, None, None] * (value - premium[:, None, None])
+    pnl = leg_pnl.sum(axis=0)
+    
+    # 以不平移波动率的情景为基准分布
+    base_index = int(np.argmin(np.abs(shocks)))
+    base = pnl[base_index]
+    order = np.argsort(base, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    alpha = 1 - confidence
+    cutoff = min(int(np.searchsorted(cumulative, alpha)), len(order) - 1)
+    tail = order[:cutoff + 1]
+    value_at_risk = max(0.0, -float(base[order[cutoff]]))
+    expected_shortfall = max(0.0, -float(np.dot(weights[tail], base[tail]) / weights[tail].sum()))
+    
+    greeks = bs_greeks(is_call, spot, strike, np.maximum(legs['t'].to_numpy(dtype='float64'), 1e-9), rate,
+                       np.maximum(iv, RISK_MIN_VOLATILITY))
+    exposure = {field: multiplier * values for field, values in greeks.items()}
+    exposure['dollar_delta'] = exposure['delta'] * spot
+    
+    underlyings = []
+    for index, owner in enumerate(symbols):
+        mask = owners == owner
+        first = int(np.flatnonzero(mask)[0])
+        underlyings.append({
+            "stock_code": owner,
+            "spot": spots[owner],
+            "move_volatility": move_vols[owner],
+            "prices": prices[first].tolist(),
+            "premium": float(-(multiplier[mask] * premium[mask]).sum()),
+            **{field: float(values[mask].sum()) for field, values in exposure.items()},
+        })
+    
+    leg_expected = leg_pnl[:, base_index, :] @ weights
+    return {
+        "positions": len(legs),
+        "horizon_days": horizon_days,
+        "confidence": confidence,
+        "premium": float(-(multiplier * premium).sum()),  # 净收取权利金
+        "expected_pnl": float(np.dot(weights, base)),
+        "expected_loss": float(np.dot(weights, np.maximum(-base, 0.0))),
+        "var": value_at_risk,
+        "es": expected_shortfall,
+        "worst_case": float(pnl.min()),
+        "best_case": float(pnl.max()),
+        "greeks": {field: float(values.sum()) for field, values in exposure.items()},
+        "underlyings": underlyings,
+        "distribution": {
+            "z": z.tolist(),
+            "probability": weights.tolist(),
+            "pnl": base.tolist(),
+        },
+        "grid": {
+            "vol_shocks": shocks.tolist(),
+            "pnl": pnl.tolist(),
+        },
+        "legs": [
+            {"code": code, "quantity": int(quantity), "premium": float(price), "expected_pnl": float(expected)}
+            for code, quantity, price, expected in zip(legs['code'], legs['quantity'], premium, leg_expected)
+        ],
+    }
+
+class RiskResultCache:
+    """组合风险结果缓存，键包含各期权链的版本，期权链变化后自动失效"""
+
+    def __init__(self, max_entries: int = RISK_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_compute(self, key: Tuple, compute: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """返回(结果, 是否命中)"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return result, True
+            self._misses += 1
+        result = compute()
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+risk_cache = RiskResultCache()
+
+def parse_history_time(value: Optional[str], default: Optional[float] = None) -> float:
+    """解析历史查询的时间参数：Unix秒数或ISO时间（不带时区按本地时间）"""
+    if not value:
+        if default is None:
+            raise ValueError("缺少时间参数")
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"时间格式不正确: {value}")
 
-def save_csv_to_temp(csv_data: List[List[str]], code: str, target_date: str) -> str:
-    """保存CSV到临时文件并返回文件路径"""
-    # 创建临时文件
-    stock_name = code.replace('.', '_')
-    date_str = target_date.replace('-', '')
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"{stock_name}_{date_str}_{timestamp}.csv"
-    
-    temp_dir = tempfile.gettempdir()
-    file_path = os.path.join(temp_dir, filename)
-    
+def frame_to_records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """DataFrame转为可JSON序列化的记录列表，NaN/inf转为None"""
+    frame = frame.replace([np.inf, -np.inf], np.nan)
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+# 期权链响应格式
+CHAIN_BASIC_FIELDS = ['code', 'name', 'strike_price', 'option_type', 'strike_time', 'lot_size', 'stock_owner']
+CHAIN_MEDIA_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+CHAIN_ACCEPT_FORMATS = {
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.parquet': 'parquet',
+    'application/x-parquet': 'parquet',
+}
+
+def negotiate_chain_format(fmt: Optional[str], accept: Optional[str]) -> str:
+    """根据format参数或Accept头确定响应格式：json、columnar、arrow、parquet"""
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in ('json', 'columnar', 'arrow', 'parquet'):
+            raise HTTPException(status_code=406, detail=f"不支持的响应格式: {fmt}")
+    else:
+        fmt = 'json'
+        for media in (accept or '').split(','):
+            media = media.split(';')[0].strip().lower()
+            if media in CHAIN_ACCEPT_FORMATS:
+                fmt = CHAIN_ACCEPT_FORMATS[media]
+                break
+    if fmt in CHAIN_MEDIA_TYPES and pa is None:
+        raise HTTPException(status_code=406, detail="服务端未安装pyarrow，无法返回Arrow/Parquet格式")
+    return fmt
+
+def chain_statistics(df: pd.DataFrame) -> Dict[str, Any]:
+    """合约数量和行权价范围"""
+    counts = df['option_type'].value_counts()
+    strikes = df['strike_price']
+    return {
+        "total_options": len(df),
+        "call_options": int(counts.get('CALL', 0)),
+        "put_options": int(counts.get('PUT', 0)),
+        "strike_price_range": {
+            "min": float(strikes.min()) if len(df) else 0,
+            "max": float(strikes.max()) if len(df) else 0
+        },
+    }
+
+def frame_to_columns(frame: pd.DataFrame) -> Dict[str, List[Any]]:
+    """DataFrame转为按列的JSON数组，NaN/inf转为None"""
+    frame = frame.replace([np.inf, -np.inf], np.nan)
+    return frame.astype(object).where(frame.notna(), None).to_dict('list')
+
+def encode_chain_table(df: pd.DataFrame, fmt: str, metadata: Dict[str, Any]) -> bytes:
+    """完整期权链编码为Arrow IPC流或Parquet，统计信息写入schema元数据"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b'option_chain': json.dumps(metadata, ensure_ascii=False, default=str).encode('utf-8'),
+    })
+    sink = pa.BufferOutputStream()
+    if fmt == 'arrow':
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+async def chain_binary_response(df: pd.DataFrame, fmt: str, metadata: Dict[str, Any]) -> Response:
+    """以Arrow/Parquet返回期权链，编码在线程中执行"""
+    content = await asyncio.get_running_loop().run_in_executor(None, encode_chain_table, df, fmt, metadata)
+    return Response(content=content, media_type=CHAIN_MEDIA_TYPES[fmt])
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """请求对应的路由模板（如 /api/expiration-dates/{stock_code}），避免路径参数造成标签膨胀"""
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+def _gauge_lines(name: str, help_text: str, value: Any) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {float(value or 0):g}"]
+
+def render_metrics() -> str:
+    """Prometheus文本格式的全部指标"""
+    lines = []
+    for metric in (REQUEST_SECONDS, STAGE_SECONDS, OPEND_ERRORS, OPEND_WAIT_SECONDS, OPEND_THROTTLED,
+                   OPEND_DEDUPLICATED, SUBSCRIPTION_SKIPPED):
+        lines.extend(metric.render())
+
+    pool = opend_pool.stats()
+    cache = chain_cache.stats()
+    subscriptions = subscription_manager.stats()
+    executor = opend_executor.stats()
+    for name, help_text, value in (
+        ('optionchain_pool_connections', "OpenD连接池已创建的连接数", pool.get('size')),
+        ('optionchain_pool_in_use', "OpenD连接池借出中的连接数", pool.get('in_use')),
+        ('optionchain_pool_waiting', "等待OpenD连接的请求数", pool.get('waiting')),
+        ('optionchain_cache_entries', "期权链快照缓存条目数", cache['entries']),
+        ('optionchain_cache_bytes', "期权链快照缓存占用字节数", cache['bytes']),
+        ('optionchain_cache_hit_ratio', "期权链快照缓存命中率", cache['hit_rate']),
+        ('optionchain_subscriptions', "已订阅合约数", subscriptions['subscribed']),
+        ('optionchain_subscription_quota', "订阅额度", subscriptions['quota']),
+        ('optionchain_executor_queued', "OpenD线程池排队任务数", executor['queued']),
+        ('optionchain_executor_running', "OpenD线程池执行中任务数", executor['running']),
+    ):
+        lines.extend(_gauge_lines(name, help_text, value))
+    return '\n'.join(lines) + '\n'
+
+# 请求追踪
+@app.middleware("http")
+async def trace_requests(request, call_next):
+    """记录每个请求的总耗时和各阶段耗时，慢请求打印阶段明细"""
+    trace = RequestTrace(route_label(request.scope), request.method)
+    token = _request_trace.set(trace)
+    status = 500
     try:
-        with open(file_path, 'w', encoding='utf-8-sig') as f:
-            for row in csv_data:
-                f.write(','.join(f'"{cell}"' for cell in row) + '\n')
-        
-        return file_path
-        
-    except Exception as e:
-        print(f"保存CSV文件时出错: {str(e)}")
-        return ""
+        response = await call_next(request)
+        status = response.status_code
+        response.headers['Server-Timing'] = ', '.join(
+            f"{stage};dur={total * 1000:.1f}" for stage, (_, total) in trace.breakdown().items())
+        return response
+    finally:
+        _request_trace.reset(token)
+        elapsed = trace.elapsed()
+        REQUEST_SECONDS.observe(elapsed, trace.route, trace.method, str(status), trace.market)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            stages = ', '.join(f"{stage}={total * 1000:.0f}ms" + (f"×{count}" if count > 1 else '')
+                               for stage, (count, total) in
+                               sorted(trace.breakdown().items(), key=lambda item: -item[1][1]))
+            print(f"🐢 慢请求 {trace.method} {request.url.path} {status} 耗时 {elapsed * 1000:.0f}ms: {stages or '无阶段记录'}")
 
 # API路由
 @app.get("/")
@@ -332,11 +3643,27 @@ async def root():
             "获取到期日期": "/api/expiration-dates/{stock_code}",
             "生成CSV": "/api/generate-csv",
             "下载CSV文件": "/api/download-csv",
-            "获取股票列表": "/api/stocks"
+            "下载期限结构CSV": "/api/term-structure/download-csv",
+            "期望价值计算": "/api/ev",
+            "组合风险分析": "/api/risk",
+            "期限结构查询": "/api/term-structure",
+            "卖方机会扫描": "/api/scan",
+            "期权链实时推送": "/api/stream/option-chain",
+            "历史期权链查询": "/api/history/option-chain",
+            "合约历史序列": "/api/history/contract",
+            "获取股票列表": "/api/stocks",
+            "连接池状态": "/api/pool-stats",
+            "缓存状态": "/api/cache-stats",
+            "线程池状态": "/api/executor-stats",
+            "推送状态": "/api/stream-stats",
+            "历史快照状态": "/api/history-stats",
+            "Prometheus指标": "/api/metrics",
+            "到期日索引状态": "/api/expiration-index",
+            "broker状态": "/api/broker-stats"
         },
         "csv_features": {
             "generate_csv": "生成CSV数据并返回JSON响应，可选择保存到本地",
-            "download_csv": "直接下载CSV文件，支持浏览器下载",
+            "download_csv": "流式下载CSV文件，支持浏览器下载和gzip压缩",
             "local_save": "支持自定义保存路径，自动创建目录"
         }
     }
@@ -366,15 +3693,11 @@ async def get_expiration_dates(stock_code: str):
         if not validate_stock_code(stock_code):
             raise HTTPException(status_code=400, detail="股票代码格式不正确")
         
-        # 获取期权到期日期
-        quote_ctx = OpenQuoteContext(host='127.0.0.1', port=11111)
-        ret, data = quote_ctx.get_option_expiration_date(code=stock_code)
-        quote_ctx.close()
+        # 获取期权到期日期（优先从索引读取）
+        expiration_dates = await expiration_index.aget(stock_code)
         
-        if ret != RET_OK:
-            raise HTTPException(status_code=500, detail=f"获取期权到期日期失败: {data}")
-        
-        expiration_dates = data['strike_time'].values.tolist()
+        if expiration_dates is None:
+            raise HTTPException(status_code=500, detail="获取期权到期日期失败")
         
         return {
             "success": True,
@@ -383,12 +3706,22 @@ async def get_expiration_dates(stock_code: str):
             "count": len(expiration_dates)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取到期日期时出错: {str(e)}")
 
 @app.post("/api/option-chain", response_model=OptionChainResponse)
-async def query_option_chain(request: OptionChainRequest):
-    """查询期权链数据"""
+async def query_option_chain(
+    request: OptionChainRequest,
+    response: Response,
+    response_format: Optional[str] = Query(None, alias="format", description="json、columnar、arrow 或 parquet"),
+    since: Optional[str] = Query(None, description="上次获取的版本号，只返回之后报价有变化的合约"),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """查询期权链数据，按format参数或Accept头返回JSON、按列JSON、Arrow IPC或Parquet，支持ETag和增量"""
+    fmt = negotiate_chain_format(response_format, accept)
     try:
         # 处理股票代码
         try:
@@ -409,7 +3742,8 @@ async def query_option_chain(request: OptionChainRequest):
             )
         
         # 获取期权链数据
-        df = get_option_chain_data(stock_code, request.target_date)
+        chain_filter = chain_filter_from_request(request)
+        df = await fetch_option_chain_snapshot(stock_code, request.target_date, chain_filter)
         
         if df is None:
             return OptionChainResponse(
@@ -418,43 +3752,43 @@ async def query_option_chain(request: OptionChainRequest):
                 error="请检查股票代码和到期日期是否正确"
             )
         
-        # 处理数据
-        option_data = []
-        for _, row in df.iterrows():
-            option_data.append({
-                "code": row['code'],
-                "name": row['name'],
-                "strike_price": float(row['strike_price']),
-                "option_type": row['option_type'],
-                "strike_time": row['strike_time'],
-                "lot_size": int(row['lot_size']),
-                "stock_owner": row['stock_owner']
-            })
+        # 内容未变化时返回304
+        key = ('chain',) + chain_cache_key(stock_code, request.target_date, chain_filter)
+        version, hashes = chain_versions.register(key, df)
+        etag = f'"{version}-{fmt}"'
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
         
-        # 统计信息
-        call_count = len([opt for opt in option_data if opt['option_type'] == 'CALL'])
-        put_count = len([opt for opt in option_data if opt['option_type'] == 'PUT'])
+        summary = {
+            "stock_code": stock_code,
+            "target_date": request.target_date,
+            **chain_statistics(df),
+            "quote_status": df.attrs.get('quote_status'),
+        }
+        if chain_filter.active:
+            summary["filters"] = chain_filter._asdict()
+        frame, version_info = select_chain_changes(key, df, version, hashes, since)
+        summary.update(version_info)
+        
+        if fmt in CHAIN_MEDIA_TYPES:
+            binary = await chain_binary_response(frame, fmt, summary)
+            binary.headers["ETag"] = etag
+            return binary
         
-        # 行权价范围
-        strike_prices = [opt['strike_price'] for opt in option_data]
-        min_strike = min(strike_prices) if strike_prices else 0
-        max_strike = max(strike_prices) if strike_prices else 0
+        response.headers["ETag"] = etag
+        if fmt == 'columnar':
+            # 完整字段（含报价和希腊值），每个字段一个数组
+            summary["columns"] = list(frame.columns)
+            summary["options"] = frame_to_columns(frame)
+        elif version_info["mode"] == "diff":
+            summary["options"] = frame_to_records(frame)  # 增量只含变化的合约，带完整报价字段
+        else:
+            summary["options"] = frame_to_records(frame[CHAIN_BASIC_FIELDS])
         
         return OptionChainResponse(
             success=True,
             message="期权链数据查询成功",
-            data={
-                "stock_code": stock_code,
-                "target_date": request.target_date,
-                "total_options": len(option_data),
-                "call_options": call_count,
-                "put_options": put_count,
-                "strike_price_range": {
-                    "min": min_strike,
-                    "max": max_strike
-                },
-                "options": option_data
-            }
+            data=summary
         )
         
     except Exception as e:
@@ -468,7 +3802,9 @@ async def query_option_chain(request: OptionChainRequest):
 async def generate_csv(
     request: OptionChainRequest, 
     save_local: bool = Query(False, description="是否保存到本地文件"),
-    save_path: Optional[str] = Query("", description="自定义保存路径，留空则使用默认路径")
+    save_path: Optional[str] = Query("", description="自定义保存路径，留空则使用默认路径"),
+    stream: bool = Query(False, description="直接以流式CSV返回，不包装为JSON"),
+    gzip: bool = Query(False, description="流式返回时是否gzip压缩")
 ):
     """生成期权链CSV数据"""
     try:
@@ -483,30 +3819,33 @@ async def generate_csv(
             raise HTTPException(status_code=400, detail="股票代码格式不正确")
         
         # 获取期权链数据
-        df = get_option_chain_data(stock_code, request.target_date)
+        chain_filter = chain_filter_from_request(request)
+        df = await fetch_option_chain_snapshot(stock_code, request.target_date, chain_filter)
         
         if df is None:
             raise HTTPException(status_code=404, detail="未找到期权链数据")
         
-        # 生成CSV数据
-        csv_data = generate_csv_data(df, request.target_date)
+        # 生成文件名
+        filename = csv_filename(stock_code, request.target_date)
+        
+        if stream:
+            return csv_streaming_response(iter_csv_rows(df, request.target_date), filename, gzip)
+        
+        # 生成CSV数据（CPU密集，放到线程中执行）
+        with span('csv'):
+            csv_data = await asyncio.get_running_loop().run_in_executor(None, generate_csv_data, df, request.target_date)
         
         if not csv_data:
             raise HTTPException(status_code=500, detail="CSV数据生成失败")
         
         # 将CSV数据转换为字符串
-        csv_content = ""
-        for row in csv_data:
-            csv_content += ','.join(f'"{cell}"' for cell in row) + '\n'
-        
-        # 生成文件名
-        stock_name = stock_code.replace('.', '_')
-        date_str = request.target_date.replace('-', '')
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"{stock_name}_{date_str}_{timestamp}.csv"
+        loop = asyncio.get_running_loop()
+        with span('csv'):
+            csv_content = await loop.run_in_executor(None, format_csv_content, csv_data)
         
         # 如果请求本地保存，则保存到文件
         local_file_path = ""
+        file_size = None
         if save_local:
             try:
                 # 确定保存路径
@@ -525,19 +3864,12 @@ async def generate_csv(
                     current_dir = os.getcwd()
                     file_path = os.path.join(current_dir, filename)
                 
-                # 保存文件
-                with open(file_path, 'w', encoding='utf-8-sig') as f:
-                    f.write(csv_content)
+                # 保存文件（阻塞IO，放到线程中执行）
+                file_size = await loop.run_in_executor(None, write_csv_file, csv_data, file_path)
                 
                 local_file_path = file_path
                 print(f"✅ 本地文件保存成功: {file_path}")
-                
-                # 验证文件是否成功创建
-                if os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
-                    print(f"📁 文件大小: {file_size} 字节")
-                else:
-                    print("⚠️ 文件保存后未找到，可能存在权限问题")
+                print(f"📁 文件大小: {file_size} 字节")
                     
             except PermissionError:
                 raise HTTPException(status_code=500, detail="权限不足，无法保存文件到指定路径")
@@ -555,7 +3887,8 @@ async def generate_csv(
                 "stock_code": stock_code,
                 "target_date": request.target_date,
                 "local_file": local_file_path if save_local else None,
-                "file_size": len(csv_content.encode('utf-8-sig')) if save_local else None
+                "file_size": file_size,
+                "quote_status": df.attrs.get('quote_status')
             }
         }
         
@@ -564,10 +3897,340 @@ async def generate_csv(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成CSV时出错: {str(e)}")
 
+@app.post("/api/term-structure")
+async def query_term_structure(
+    request: TermStructureRequest,
+    response: Response,
+    response_format: Optional[str] = Query(None, alias="format", description="json、columnar、arrow 或 parquet"),
+    since: Optional[str] = Query(None, description="上次获取的版本号，只返回之后报价有变化的合约"),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """一次性查询多个到期日的期权链（期限结构），支持ETag和增量"""
+    fmt = negotiate_chain_format(response_format, accept)
+    try:
+        try:
+            stock_code = get_stock_code(request.stock_code)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        if not validate_stock_code(stock_code):
+            raise HTTPException(status_code=400, detail="股票代码格式不正确")
+        
+        df = await fetch_term_structure_snapshot(stock_code, request.start_date, request.end_date,
+                                                 request.max_expiries)
+        
+        if df is None:
+            raise HTTPException(status_code=404, detail="未找到期权链数据")
+        
+        key = ('term', stock_code, request.start_date, request.end_date, request.max_expiries)
+        version, hashes = chain_versions.register(key, df)
+        etag = f'"{version}-{fmt}"'
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        summary = {
+            "stock_code": stock_code,
+            "expirations": summarize_term_structure(df),
+            "total_options": len(df),
+            "quote_status": df.attrs.get('quote_status'),
+        }
+        frame, version_info = select_chain_changes(key, df, version, hashes, since)
+        summary.update(version_info)
+        
+        if fmt in CHAIN_MEDIA_TYPES:
+            binary = await chain_binary_response(frame, fmt, summary)
+            binary.headers["ETag"] = etag
+            return binary
+        
+        response.headers["ETag"] = etag
+        if fmt == 'columnar':
+            summary["columns"] = list(frame.columns)
+            summary["options"] = frame_to_columns(frame)
+        else:
+            summary["options"] = frame_to_records(frame)
+        
+        return {
+            "success": True,
+            "message": "期限结构查询成功",
+            "data": summary
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询期限结构时出错: {str(e)}")
+
+@app.post("/api/ev")
+async def calculate_chain_ev(request: EVRequest):
+    """批量计算期权链中每个合约的卖方期望价值"""
+    try:
+        try:
+            stock_code = get_stock_code(request.stock_code)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        if not validate_stock_code(stock_code):
+            raise HTTPException(status_code=400, detail="股票代码格式不正确")
+        
+        chain_filter = chain_filter_from_request(request)
+        df = await fetch_option_chain_snapshot(stock_code, request.target_date, chain_filter)
+        
+        if df is None:
+            raise HTTPException(status_code=404, detail="未找到期权链数据")
+        
+        underlying_price = request.underlying_price or estimate_underlying_price(df)
+        if not underlying_price:
+            raise HTTPException(status_code=422, detail="无法估算标的价格，请传入underlying_price")
+        
+        ev = compute_option_ev(df, underlying_price, request.days_to_expiry)
+        ev = ev.sort_values('expected_value', ascending=False)
+        
+        return {
+            "success": True,
+            "message": "EV计算成功",
+            "data": {
+                "stock_code": stock_code,
+                "target_date": request.target_date,
+                "underlying_price": underlying_price,
+                "total_options": len(ev),
+                "options": frame_to_records(ev)
+            }
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"计算EV时出错: {str(e)}")
+
+@app.post("/api/risk")
+async def analyze_portfolio_risk(request: RiskRequest):
+    """组合风险分析：在共同的价格×波动率网格上为全部卖出持仓重新定价，返回盈亏分布、VaR/ES和希腊值汇总"""
+    try:
+        if not request.positions:
+            raise HTTPException(status_code=400, detail="持仓不能为空")
+        if len(request.positions) > RISK_MAX_POSITIONS:
+            raise HTTPException(status_code=400, detail=f"持仓数量不能超过{RISK_MAX_POSITIONS}")
+        if not 0.5 <= request.confidence < 1:
+            raise HTTPException(status_code=400, detail="confidence 须在0.5到1之间")
+        if request.horizon_days <= 0:
+            raise HTTPException(status_code=400, detail="horizon_days 必须大于0")
+        price_steps = request.price_steps or RISK_PRICE_STEPS
+        if not 3 <= price_steps <= RISK_PRICE_STEPS_MAX:
+            raise HTTPException(status_code=400, detail=f"price_steps 须在3到{RISK_PRICE_STEPS_MAX}之间")
+        price_range_std = request.price_range_std or RISK_PRICE_RANGE_STD
+        vol_shocks = request.vol_shocks or RISK_VOL_SHOCKS
+        if len(vol_shocks) > RISK_VOL_SHOCKS_MAX:
+            raise HTTPException(status_code=400, detail=f"vol_shocks 不能超过{RISK_VOL_SHOCKS_MAX}个")
+        
+        # 按(标的, 到期日)分组，并发获取期权链快照
+        groups: Dict[Tuple[str, str], List[RiskPosition]] = {}
+        for position in request.positions:
+            try:
+                stock_code = get_stock_code(position.stock_code)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if not is_valid_stock_code(stock_code):
+                raise HTTPException(status_code=400, detail=f"股票代码格式不正确: {position.stock_code}")
+            if position.quantity == 0:
+                raise HTTPException(status_code=400, detail=f"{position.code} 的持仓数量不能为0")
+            groups.setdefault((stock_code, position.target_date), []).append(position)
+        
+        # 手动指定的标的价格：代码校验同持仓，价格须为正数
+        overrides: Dict[str, float] = {}
+        for code, price in (request.underlying_prices or {}).items():
+            try:
+                stock_code = get_stock_code(code)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if not is_valid_stock_code(stock_code):
+                raise HTTPException(status_code=400, detail=f"股票代码格式不正确: {code}")
+            if not price > 0:
+                raise HTTPException(status_code=400, detail=f"{code} 的标的价格必须大于0")
+            overrides[stock_code] = price
+        
+        keys = list(groups)
+        tag_request_market(*(stock_code for stock_code, _ in keys))
+        frames = await asyncio.gather(*(fetch_option_chain_snapshot(code, date) for code, date in keys))
+        
+        legs, versions = [], []
+        spots: Dict[str, float] = {}
+        move_vols: Dict[str, float] = {}
+        for (stock_code, target_date), df in zip(keys, frames):
+            if df is None or df.empty:
+                raise HTTPException(status_code=404, detail=f"未找到 {stock_code} {target_date} 的期权链数据")
+            versions.append(chain_versions.register(('chain', stock_code, target_date), df)[0])
+            
+            if stock_code not in spots:
+                spot = overrides.get(stock_code) or underlying_spot(df)
+                if not spot:
+                    raise HTTPException(status_code=422, detail=f"无法估算 {stock_code} 的标的价格，请传入underlying_prices")
+                spots[stock_code] = spot
+            if stock_code not in move_vols:
+                move_vols[stock_code] = atm_volatility(df, spots[stock_code])
+            
+            chain = df.set_index('code')
+            positions = groups[(stock_code, target_date)]
+            missing = [p.code for p in positions if p.code not in chain.index]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"期权链中没有合约: {', '.join(missing)}")
+            codes = [p.code for p in positions]
+            part = chain.loc[codes].reset_index()
+            market_price = option_prices(part)
+            part['stock_code'] = stock_code
+            part['quantity'] = [p.quantity for p in positions]
+            part['premium'] = [p.premium if p.premium is not None else price
+                               for p, price in zip(positions, market_price)]
+            part['t'] = years_to_expiry(part['strike_time'], stock_code.split('.', 1)[0])
+            legs.append(part[['stock_code', 'code', 'option_type', 'strike_price', 'strike_time', 'lot_size',
+                              'implied_volatility', 'quantity', 'premium', 't']])
+        
+        legs = pd.concat(legs, ignore_index=True)
+        unpriced = legs.loc[~(legs['premium'] >= 0), 'code'].tolist()
+        no_vol = legs.loc[~(legs['implied_volatility'] > 0), 'code'].tolist()
+        if unpriced or no_vol:
+            raise HTTPException(status_code=422, detail=f"合约缺少价格或隐含波动率: {', '.join(dict.fromkeys(unpriced + no_vol))}")
+        for stock_code, vol in move_vols.items():
+            if not vol:
+                owned = legs[legs['stock_code'] == stock_code]
+                move_vols[stock_code] = float(owned['implied_volatility'].median()) / 100
+        
+        # 期权链版本不变时直接复用上次的网格结果；网格重新定价在线程中执行，不阻塞事件循环
+        key = (tuple(versions), request.model_dump_json())
+        result, cached = await asyncio.get_running_loop().run_in_executor(
+            None, risk_cache.get_or_compute, key, lambda: compute_portfolio_risk(
+                legs, spots, move_vols, request.horizon_days, request.confidence,
+                price_steps, price_range_std, vol_shocks))
+        
+        return {
+            "success": True,
+            "message": "组合风险计算成功",
+            "data": {**result, "cached": cached}
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"计算组合风险时出错: {str(e)}")
+
+@app.post("/api/scan")
+async def scan_opportunities(
+    request: ScanRequest,
+    stream_format: str = Query("ndjson", alias="format", description="ndjson 或 sse")
+):
+    """并发扫描多个标的的卖方机会，逐个标的以NDJSON/SSE流式返回排好序的候选"""
+    symbols = scan_symbols(request)
+    if not symbols:
+        raise HTTPException(status_code=400, detail="没有可扫描的标的")
+    tag_request_market(*symbols)
+    concurrency = max(1, min(request.concurrency or SCAN_MAX_CONCURRENCY, SCAN_MAX_CONCURRENCY))
+    
+    def encode(event: Dict[str, Any]) -> str:
+        payload = json.dumps(event, ensure_ascii=False, default=str)
+        return f"data: {payload}\n\n" if stream_format == "sse" else payload + "\n"
+    
+    async def scan_one(semaphore: asyncio.Semaphore, code: str) -> Dict[str, Any]:
+        # 每个标的在各自的任务中执行，阶段耗时按该标的的市场计入
+        _symbol_market.set(stock_code_market(code))
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                # 扫描排在界面请求和后台预热之后，开盘时不挤占交互请求的OpenD限额
+                with opend_priority('scan'):
+                    df = await fetch_term_structure_snapshot(code, max_expiries=request.max_expiries)
+                if df is None:
+                    return {"type": "symbol", "stock_code": code, "success": False, "error": "未找到期权链数据"}
+                candidates = scan_candidates(df, request)
+                return {
+                    "type": "symbol",
+                    "stock_code": code,
+                    "success": True,
+                    "scanned_options": len(df),
+                    "candidate_count": len(candidates),
+                    "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+                    "candidates": frame_to_records(candidates.head(request.top_n)),
+                    "_ranked": candidates.head(request.top_n),
+                }
+            except Exception as e:
+                return {"type": "symbol", "stock_code": code, "success": False, "error": str(e)}
+    
+    async def events():
+        start = time.monotonic()
+        yield encode({"type": "start", "symbols": symbols, "concurrency": concurrency})
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.ensure_future(scan_one(semaphore, code)) for code in symbols]
+        ranked = []
+        try:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                frame = result.pop("_ranked", None)
+                if frame is not None and not frame.empty:
+                    ranked.append(frame)
+                yield encode(result)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        top = pd.concat(ranked).sort_values('ev_yield', ascending=False).head(request.top_n) if ranked else None
+        yield encode({
+            "type": "summary",
+            "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+            "top": frame_to_records(top) if top is not None else []
+        })
+    
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
+
+@app.get("/api/stream/option-chain")
+async def stream_option_chain(
+    stock_code: str = Query(..., description="股票代码或名称"),
+    target_date: str = Query(..., description="到期日期 YYYY-MM-DD"),
+    interval: float = Query(CHAIN_PUSH_INTERVAL, description="最短推送间隔秒数")
+):
+    """以SSE推送期权链：先发送完整快照，之后按合约只推送变化的字段"""
+    try:
+        stock_code = get_stock_code(stock_code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not validate_stock_code(stock_code):
+        raise HTTPException(status_code=400, detail="股票代码格式不正确")
+    
+    if broker_client is not None:
+        # 推送依赖本进程内的OpenD订阅回调，多worker模式下不提供
+        raise HTTPException(status_code=503, detail="多worker模式下不支持实时推送，请使用单进程模式")
+    
+    try:
+        channel, viewer, snapshot = await chain_push_hub.join(stock_code, target_date,
+                                                              max(CHAIN_PUSH_MIN_INTERVAL, interval))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"订阅期权链推送时出错: {str(e)}")
+    
+    def encode(event: str, payload: Dict[str, Any]) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+    
+    async def events():
+        try:
+            yield encode("snapshot", snapshot)
+            while True:
+                batch = await viewer.next_batch(channel)
+                if batch is None:
+                    yield ": keepalive\n\n"  # 心跳，及时发现已断开的客户端
+                elif batch:
+                    yield encode("delta", {"seq": channel.seq, "ts": time.time(), "updates": batch})
+        finally:
+            chain_push_hub.leave(channel, viewer)
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/api/download-csv")
 async def download_csv(
     request: OptionChainRequest,
-    background_tasks: BackgroundTasks
+    gzip: bool = Query(False, description="是否gzip压缩")
 ):
     """下载期权链CSV文件"""
     try:
@@ -582,56 +4245,155 @@ async def download_csv(
             raise HTTPException(status_code=400, detail="股票代码格式不正确")
         
         # 获取期权链数据
-        df = get_option_chain_data(stock_code, request.target_date)
+        chain_filter = chain_filter_from_request(request)
+        df = await fetch_option_chain_snapshot(stock_code, request.target_date, chain_filter)
         
-        if df is None:
+        if df is None or df.empty:
             raise HTTPException(status_code=404, detail="未找到期权链数据")
         
-        # 生成CSV数据
-        csv_data = generate_csv_data(df, request.target_date)
+        # 边生成边发送，不落盘也不拼接整段字符串
+        filename = csv_filename(stock_code, request.target_date)
+        return csv_streaming_response(iter_csv_rows(df, request.target_date), filename, gzip)
         
-        if not csv_data:
-            raise HTTPException(status_code=500, detail="CSV数据生成失败")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"下载CSV时出错: {str(e)}")
+
+@app.post("/api/term-structure/download-csv")
+async def download_term_structure_csv(
+    request: TermStructureRequest,
+    gzip: bool = Query(False, description="是否gzip压缩")
+):
+    """下载多到期日期权链CSV文件，每个到期日一段（含表头和到期日信息行）"""
+    try:
+        try:
+            stock_code = get_stock_code(request.stock_code)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 生成文件名
-        stock_name = stock_code.replace('.', '_')
-        date_str = request.target_date.replace('-', '')
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"{stock_name}_{date_str}_{timestamp}.csv"
-        
-        # 保存到临时文件
-        temp_file_path = save_csv_to_temp(csv_data, stock_code, request.target_date)
-        
-        if not temp_file_path:
-            raise HTTPException(status_code=500, detail="临时文件创建失败")
-        
-        # 设置后台任务，在响应完成后删除临时文件
-        background_tasks.add_task(cleanup_temp_file, temp_file_path)
-        
-        # 返回文件下载响应
-        return FileResponse(
-            path=temp_file_path,
-            filename=filename,
-            media_type='text/csv',
-            headers={
-                'Content-Disposition': f'attachment; filename="{filename}"',
-                'Content-Type': 'text/csv; charset=utf-8-sig'
-            }
-        )
+        if not validate_stock_code(stock_code):
+            raise HTTPException(status_code=400, detail="股票代码格式不正确")
+        
+        df = await fetch_term_structure_snapshot(stock_code, request.start_date, request.end_date,
+                                                 request.max_expiries)
+        
+        if df is None or df.empty:
+            raise HTTPException(status_code=404, detail="未找到期权链数据")
+        
+        def rows():
+            for expiry, part in df.groupby('strike_time', observed=True):
+                yield from iter_csv_rows(part, expiry)
+        
+        return csv_streaming_response(rows(), csv_filename(stock_code, 'term'), gzip)
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"下载CSV时出错: {str(e)}")
 
-def cleanup_temp_file(file_path: str):
-    """清理临时文件"""
+@app.get("/api/history/option-chain")
+async def query_option_chain_history(
+    stock_code: str = Query(..., description="股票代码或名称"),
+    target_date: str = Query(..., description="到期日期 YYYY-MM-DD"),
+    at: Optional[str] = Query(None, description="时间点（Unix秒数或ISO时间），留空为当前"),
+    response_format: Optional[str] = Query(None, alias="format", description="json、columnar、arrow 或 parquet"),
+    accept: Optional[str] = Header(None)
+):
+    """查询指定时间点及之前最近一次保存的期权链快照"""
+    fmt = negotiate_chain_format(response_format, accept)
+    try:
+        try:
+            stock_code = get_stock_code(stock_code)
+            timestamp = parse_history_time(at, time.time())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        if not validate_stock_code(stock_code):
+            raise HTTPException(status_code=400, detail="股票代码格式不正确")
+        
+        if not chain_history.enabled:
+            raise HTTPException(status_code=503, detail="历史快照存储未启用")
+        
+        df = await asyncio.get_running_loop().run_in_executor(
+            None, chain_history.as_of, stock_code, target_date, timestamp)
+        
+        if df is None:
+            raise HTTPException(status_code=404, detail="该时间点之前没有保存的期权链快照")
+        
+        summary = {
+            "stock_code": stock_code,
+            "target_date": target_date,
+            "snapshot_time": datetime.fromtimestamp(df.attrs['snapshot_time']).isoformat(),
+            **chain_statistics(df),
+        }
+        
+        if fmt in CHAIN_MEDIA_TYPES:
+            return await chain_binary_response(df, fmt, summary)
+        
+        if fmt == 'columnar':
+            summary["columns"] = list(df.columns)
+            summary["options"] = frame_to_columns(df)
+        else:
+            summary["options"] = frame_to_records(df)
+        
+        return {
+            "success": True,
+            "message": "历史期权链查询成功",
+            "data": summary
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询历史期权链时出错: {str(e)}")
+
+@app.get("/api/history/contract")
+async def query_contract_history(
+    stock_code: str = Query(..., description="股票代码或名称"),
+    target_date: str = Query(..., description="到期日期 YYYY-MM-DD"),
+    contract: str = Query(..., description="期权合约代码"),
+    start: Optional[str] = Query(None, description="开始时间（Unix秒数或ISO时间），留空为当天0点"),
+    end: Optional[str] = Query(None, description="结束时间，留空为当前"),
+    fields: Optional[str] = Query(None, description="逗号分隔的字段，留空返回全部报价字段")
+):
+    """查询单个合约的报价、IV和希腊值时间序列"""
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"🗑️ 临时文件已清理: {file_path}")
+        try:
+            stock_code = get_stock_code(stock_code)
+            end_time = parse_history_time(end, time.time())
+            start_time = parse_history_time(
+                start, datetime.fromtimestamp(end_time).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        if not validate_stock_code(stock_code):
+            raise HTTPException(status_code=400, detail="股票代码格式不正确")
+        
+        if not chain_history.enabled:
+            raise HTTPException(status_code=503, detail="历史快照存储未启用")
+        
+        field_list = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+        try:
+            series = await asyncio.get_running_loop().run_in_executor(
+                None, chain_history.series, stock_code, target_date, contract, start_time, end_time, field_list)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return {
+            "success": True,
+            "message": "合约历史查询成功",
+            "data": {
+                "contract": contract,
+                "points": len(series),
+                "series": frame_to_columns(series)
+            }
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"⚠️ 清理临时文件失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"查询合约历史时出错: {str(e)}")
 
 @app.get("/api/health")
 async def health_check():
@@ -646,25 +4408,16 @@ async def health_check():
 async def get_subscription_status():
     """获取当前订阅状态"""
     try:
-        quote_ctx = OpenQuoteContext(host='127.0.0.1', port=11111)
-        
-        # 查询订阅状态
-        ret, data = quote_ctx.query_subscription()
-        
-        quote_ctx.close()
-        
-        if ret == RET_OK:
-            return {
-                "success": True,
-                "message": "订阅状态查询成功",
-                "data": data
-            }
+        if broker_client is not None:
+            data = (await opend_executor.run(broker_client.call, 'subscription_status'))['data']
         else:
-            return {
-                "success": False,
-                "message": f"订阅状态查询失败: {data}",
-                "data": None
-            }
+            data = subscription_manager.stats()
+            data["opend"] = await opend_executor.run(subscription_manager.opend_usage)
+        return {
+            "success": True,
+            "message": "订阅状态查询成功",
+            "data": data
+        }
             
     except Exception as e:
         return {
@@ -673,12 +4426,116 @@ async def get_subscription_status():
             "data": None
         }
 
+@app.get("/api/pool-stats")
+async def get_pool_stats():
+    """获取OpenD连接池统计信息"""
+    return {
+        "success": True,
+        "data": opend_pool.stats()
+    }
+
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    """获取期权链快照缓存和版本统计信息"""
+    return {
+        "success": True,
+        "data": {**chain_cache.stats(), "versions": chain_versions.stats(), "risk": risk_cache.stats()}
+    }
+
+@app.get("/api/stream-stats")
+async def get_stream_stats():
+    """获取期权链推送频道和客户端统计信息"""
+    return {
+        "success": True,
+        "data": chain_push_hub.stats()
+    }
+
+@app.get("/api/history-stats")
+async def get_history_stats():
+    """获取历史快照存储统计信息"""
+    return {
+        "success": True,
+        "data": await asyncio.get_running_loop().run_in_executor(None, chain_history.stats)
+    }
+
+@app.get("/api/expiration-index")
+async def get_expiration_index_stats():
+    """获取到期日索引状态"""
+    return {
+        "success": True,
+        "data": expiration_index.stats()
+    }
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheus格式的请求耗时、阶段耗时、OpenD错误和资源指标"""
+    return PlainTextResponse(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/executor-stats")
+async def get_executor_stats():
+    """获取OpenD线程池、各阶段并发及频率限制调度统计"""
+    return {
+        "success": True,
+        "data": {
+            "executor": opend_executor.stats(),
+            "stages": opend_stages.stats(),
+            "scheduler": opend_scheduler.stats(),
+            "quotes": quote_fetcher.stats()
+        }
+    }
+
+@app.get("/api/broker-stats")
+async def get_broker_stats():
+    """获取broker进程的连接池、订阅、缓存和共享快照统计（仅多worker模式）"""
+    if broker_client is None:
+        raise HTTPException(status_code=404, detail="未启用多worker模式")
+    try:
+        data = (await opend_executor.run(broker_client.call, 'stats'))['data']
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"查询broker状态出错: {str(e)}")
+    return {
+        "success": True,
+        "data": {**data, "worker_pid": os.getpid()}
+    }
+
+def start_background_services():
+    """服务启动时开启历史快照写入，并在后台预热到期日索引"""
+    if broker_client is not None:
+        # 历史快照和到期日索引文件由broker维护，worker的索引只在内存中，预热和收盘刷新都从broker取
+        expiration_index.path = ''
+    else:
+        chain_history.start()
+    expiration_index.start()
+
+def shutdown_opend_pool():
+    """服务关闭时写完历史快照并释放订阅和OpenD连接"""
+    if broker_client is not None:
+        broker_client.close()
+    expiration_index.stop()
+    chain_history.stop()
+    subscription_manager.close()
+    opend_pool.close_all()
+    quote_fetcher.shutdown()
+    opend_executor.shutdown()
+
 # 启动服务
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="富途期权链查询API")
+    parser.add_argument('--workers', type=int, default=0, help="大于0时以多worker生产模式启动，共用一个OpenD broker进程")
+    parser.add_argument('--host', default="0.0.0.0")
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    
+    if args.workers > 0:
+        from opend_broker import run_production
+        run_production(args.workers, host=args.host, port=args.port)
+        raise SystemExit(0)
+    
     uvicorn.run(
         "option_chain_api:app",
-        host="0.0.0.0",
-        port=8000,
+        host=args.host,
+        port=args.port,
         reload=True,  # 启用热重载
         log_level="debug",  # 改为debug级别
         reload_dirs=["."],  # 监控当前目录变化
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+期权定价
+整条期权链一次性向量化计算Black-Scholes价格、希腊值和隐含波动率，
+用于补全OpenD未返回（为0）的希腊值，或与OpenD的值交叉核对。
+单位与OpenD一致：隐含波动率为百分数，Vega/Rho为波动率/利率每变化1个百分点的价格变化，Theta为每日价格变化。
+"""
+
+import math
+from typing import Dict, Union
+
+import numpy as np
+
+ArrayLike = Union[float, np.ndarray]
+
+# 隐含波动率求解配置
+IV_MIN = 1e-4  # 求解区间下限（小数）
+IV_MAX = 5.0  # 求解区间上限（小数）
+IV_PRICE_TOLERANCE = 1e-7  # 收敛条件：理论价与市场价之差小于标的价格的该比例
+IV_MAX_ITERATIONS = 60  # 牛顿/二分迭代次数上限
+NORM_CDF_ERROR = 1.5e-7  # norm_cdf的最大绝对误差，理论价的分辨率约为该值乘以(标的价格+折现行权价)
+
+_SQRT_2PI = math.sqrt(2.0 * math.pi)
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """标准正态分布累积分布函数（Abramowitz-Stegun 7.1.26，误差小于1.5e-7）"""
+    z = np.abs(x) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    y = 1.0 - (((((1.061405429 * t - 1.453152027) * t) + 1.421413741) * t - 0.284496736) * t
+               + 0.254829592) * t * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * y)
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+def _d1_d2(spot: np.ndarray, strike: np.ndarray, t: np.ndarray, rate: np.ndarray, sigma: np.ndarray):
+    vol_sqrt_t = sigma * np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma * sigma) * t) / vol_sqrt_t
+    return d1, d1 - vol_sqrt_t
+
+def bs_price(is_call: np.ndarray, spot: ArrayLike, strike: ArrayLike, t: ArrayLike,
+             rate: ArrayLike, sigma: ArrayLike) -> np.ndarray:
+    """欧式期权理论价，t为年化剩余期限，rate和sigma为小数"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(spot, strike, t, rate, sigma)
+        discounted_strike = strike * np.exp(-rate * t)
+        call = spot * norm_cdf(d1) - discounted_strike * norm_cdf(d2)
+    # 看跌期权按平价关系得到
+    return np.where(is_call, call, call - spot + discounted_strike)
+
+def bs_greeks(is_call: np.ndarray, spot: ArrayLike, strike: ArrayLike, t: ArrayLike,
+              rate: ArrayLike, sigma: ArrayLike) -> Dict[str, np.ndarray]:
+    """Delta、Gamma、Vega、Theta、Rho，单位与OpenD一致"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_t = np.sqrt(t)
+        d1, d2 = _d1_d2(spot, strike, t, rate, sigma)
+        pdf = norm_pdf(d1)
+        cdf_d1 = norm_cdf(d1)
+        cdf_d2 = norm_cdf(d2)
+        discounted_strike = strike * np.exp(-rate * t)
+        carry = np.where(is_call, -rate * discounted_strike * cdf_d2, rate * discounted_strike * (1 - cdf_d2))
+        return {
+            'delta': np.where(is_call, cdf_d1, cdf_d1 - 1),
+            'gamma': pdf / (spot * sigma * sqrt_t),
+            'vega': spot * pdf * sqrt_t / 100,
+            'theta': (-spot * pdf * sigma / (2 * sqrt_t) + carry) / 365,
+            'rho': np.where(is_call, discounted_strike * t * cdf_d2, -discounted_strike * t * (1 - cdf_d2)) / 100,
+        }
+
+def implied_volatility(price: ArrayLike, is_call: np.ndarray, spot: ArrayLike, strike: ArrayLike,
+                       t: ArrayLike, rate: ArrayLike = 0.0, max_iterations: int = IV_MAX_ITERATIONS) -> np.ndarray:
+    """整条期权链同时求解隐含波动率（小数）。
+
+    每个合约维护一个包含根的区间，牛顿步落在区间外或Vega过小时改用区间中点。
+    深度价内、低波动率的合约理论价对波动率不敏感，区间收缩到极小时理论价与市场价之差
+    若已在norm_cdf误差可分辨的范围内，同样视为求解成功；价格与内在价值之差在该误差以内
+    （没有可分辨的时间价值）且无法求解的合约返回求解区间下限IV_MIN。
+    价格不在无套利区间内、期限或价格无效以及波动率超出求解区间的合约返回NaN。"""
+    price, is_call, spot, strike, t, rate = (np.array(a, dtype='float64') for a in
+                                             np.broadcast_arrays(price, is_call, spot, strike, t, rate))
+    is_call = is_call.astype(bool)
+    result = np.full(price.shape, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        discounted_strike = strike * np.exp(-rate * t)
+        lower = np.where(is_call, np.maximum(spot - discounted_strike, 0.0), np.maximum(discounted_strike - spot, 0.0))
+        upper = np.where(is_call, spot, discounted_strike)
+        resolution = NORM_CDF_ERROR * (spot + discounted_strike)
+        usable = (np.isfinite(price) & np.isfinite(spot) & np.isfinite(strike) & np.isfinite(t)
+                  & (price < upper) & (t > 0) & (spot > 0) & (strike > 0))
+        # 时间价值低于理论价的分辨率，任何足够低的波动率都能复现该价格
+        at_intrinsic = usable & (np.abs(price - lower) <= resolution)
+        valid = usable & (price > lower)
+    index = np.flatnonzero(valid)
+    if index.size == 0:
+        result[at_intrinsic] = IV_MIN
+        return result
+
+    price, is_call, spot, strike, t, rate = (a[index] for a in (price, is_call, spot, strike, t, rate))
+    low = np.full(index.size, IV_MIN)
+    high = np.full(index.size, IV_MAX)
+    # Brenner-Subrahmanyam近似作为初值，平值附近通常几步即可收敛
+    sigma = np.clip(_SQRT_2PI / np.sqrt(t) * price / spot, 0.05, 2.0)
+    solved = np.zeros(index.size, dtype=bool)
+    work = np.arange(index.size)
+
+    for _ in range(max_iterations):
+        if work.size == 0:
+            break
+        s, k, tt, r, x = spot[work], strike[work], t[work], rate[work], sigma[work]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            d1, d2 = _d1_d2(s, k, tt, r, x)
+            discounted_k = k * np.exp(-r * tt)
+            call = s * norm_cdf(d1) - discounted_k * norm_cdf(d2)
+            model = np.where(is_call[work], call, call - s + discounted_k)
+            diff = model - price[work]
+            vega = s * norm_pdf(d1) * np.sqrt(tt)
+            newton = x - diff / vega
+
+        # 理论价随波动率单调递增，用当前值收紧区间
+        above = diff > 0
+        high[work] = np.where(above, x, high[work])
+        low[work] = np.where(above, low[work], x)
+        collapsed = high[work] - low[work] < 1e-12
+        # 区间已收缩到极小：差值在norm_cdf的误差范围内说明已无法更精确，否则波动率超出求解区间
+        converged = (np.abs(diff) < IV_PRICE_TOLERANCE * s) | (collapsed & (np.abs(diff) <= NORM_CDF_ERROR * (s + discounted_k)))
+        done = converged | collapsed
+
+        inside = np.isfinite(newton) & (newton > low[work]) & (newton < high[work])
+        sigma[work] = np.where(done, x, np.where(inside, newton, 0.5 * (low[work] + high[work])))
+        solved[work[converged]] = True
+        work = work[~done]
+
+    result[index[solved]] = sigma[solved]
+    result[at_intrinsic & np.isnan(result)] = IV_MIN
+    return result
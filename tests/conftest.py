@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""接口测试公共配置：用合成回放数据代替OpenD，不写历史快照和到期日索引文件"""
+
+import os
+import sys
+
+os.environ.setdefault('OPEND_REPLAY', 'synthetic')
+os.environ.setdefault('CHAIN_HISTORY_DIR', '')
+os.environ.setdefault('EXPIRATION_INDEX_FILE', '')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import option_chain_api as api
+
+STOCK_CODE = 'US.AAPL'
+
+@pytest.fixture(scope='session')
+def client():
+    return TestClient(api.app)
+
+@pytest.fixture(scope='session')
+def expiry(client):
+    response = client.get(f"/api/expiration-dates/{STOCK_CODE}")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"], body
+    return body["expiration_dates"][0]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""broker：快照文件发布和复用，worker经socket取回与单进程一致的期权链，broker重启后客户端重连"""
+
+import asyncio
+import os
+import tempfile
+import threading
+
+import pandas as pd
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+import option_chain_api as api
+from conftest import STOCK_CODE
+from opend_broker import BrokerClient, OpenDBroker, SnapshotPublisher
+
+class BrokerThread:
+    """在后台线程的事件循环中运行broker的socket服务（不启动后台服务）"""
+
+    def __init__(self, socket_path: str, publisher: SnapshotPublisher):
+        self.socket_path = socket_path
+        self.broker = OpenDBroker(socket_path)
+        self.broker.publisher.close()
+        self.broker.publisher = publisher
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(
+                asyncio.start_unix_server(self.broker.handle, path=self.socket_path))
+            ready.set()
+            self.loop.run_forever()
+            # 停止时断开所有worker连接，与broker进程退出一致
+            self.server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        assert ready.wait(5)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        os.unlink(self.socket_path)
+
+@pytest.fixture
+def workdir():
+    # Unix socket路径有长度限制，不用pytest的tmp_path
+    with tempfile.TemporaryDirectory(prefix='broker-') as directory:
+        yield directory
+
+@pytest.fixture
+def broker(workdir):
+    server = BrokerThread(os.path.join(workdir, 'broker.sock'), SnapshotPublisher(workdir))
+    server.start()
+    yield server
+    server.stop()
+    server.broker.publisher.close()
+
+def read_snapshot(path):
+    return pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas()
+
+def test_publisher_reuses_unchanged_snapshots_and_collects_old_files(workdir, expiry):
+    df = api.get_option_chain_snapshot(STOCK_CODE, expiry)
+    publisher = SnapshotPublisher(workdir, keep=1, grace=0)
+    key = ('chain', STOCK_CODE, expiry)
+    first = publisher.publish(key, df)
+    assert publisher.publish(key, df.copy()) == first
+    pd.testing.assert_frame_equal(read_snapshot(first), df)
+
+    changed = df.assign(last_price=df['last_price'] + 1)
+    second = publisher.publish(key, changed)
+    assert second != first and not os.path.exists(first)
+    pd.testing.assert_frame_equal(read_snapshot(second), changed)
+    stats = publisher.stats()
+    assert stats['published'] == 2 and stats['reused'] == 1 and stats['removed'] == 1 and stats['files'] == 1
+    publisher.close()
+    assert not os.path.exists(publisher.directory)
+
+def test_worker_reads_same_chain_as_single_process(broker, expiry):
+    client = BrokerClient(broker.socket_path)
+    try:
+        chain_filter = api.ChainFilter(option_type='CALL')
+        df = client.snapshot('chain', code=STOCK_CODE, target_date=expiry, chain_filter=list(chain_filter))
+        expected = api.get_option_chain_snapshot(STOCK_CODE, expiry, chain_filter)
+        pd.testing.assert_frame_equal(df, expected)
+        assert client.call('expirations', code=STOCK_CODE)['expirations'] == api.expiration_index.get(STOCK_CODE)
+        with pytest.raises(RuntimeError):
+            client.call('bogus')
+    finally:
+        client.close()
+
+def test_client_reconnects_once_after_broker_restart(broker, expiry):
+    client = BrokerClient(broker.socket_path, timeout=5)
+    try:
+        assert client.call('expirations', code=STOCK_CODE)['expirations']
+        broker.stop()
+        broker.start()
+        # 原连接已失效，重连一次后成功
+        assert client.call('expirations', code=STOCK_CODE)['expirations']
+        assert broker.broker._requests == 2
+
+        broker.stop()
+        with pytest.raises(OSError):
+            client.call('expirations', code=STOCK_CODE)
+        broker.start()
+    finally:
+        client.close()
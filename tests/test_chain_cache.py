@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""快照缓存：并发的相同未命中只回源一次，TTL过期后重新回源，超出上限按LRU淘汰"""
+
+import asyncio
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import option_chain_api as api
+from conftest import STOCK_CODE
+
+class CountingLoader:
+    def __init__(self, load, delay=0.0):
+        self.load = load
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.load()
+
+def test_concurrent_misses_load_replay_chain_once(expiry):
+    cache = api.ChainSnapshotCache(ttl=60)
+    loader = CountingLoader(lambda: api.get_option_chain_data(STOCK_CODE, expiry), delay=0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load((STOCK_CODE, expiry), loader)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert loader.calls == 1
+    assert len(results) == 8 and all(df is results[0] for df in results)
+    assert not results[0].empty
+    stats = cache.stats()
+    assert stats['misses'] == 1 and stats['coalesced'] == 7 and stats['inflight'] == 0
+
+def test_async_waiters_share_one_load(expiry):
+    cache = api.ChainSnapshotCache(ttl=60)
+    loader = CountingLoader(lambda: api.get_option_chain_data(STOCK_CODE, expiry), delay=0.1)
+
+    async def fetch_all():
+        return await asyncio.gather(*(cache.aget_or_load((STOCK_CODE, expiry), loader) for _ in range(5)))
+
+    frames = asyncio.run(fetch_all())
+    assert loader.calls == 1 and all(df is frames[0] for df in frames)
+
+def test_entries_expire_after_ttl():
+    cache = api.ChainSnapshotCache(ttl=0.05)
+    loader = CountingLoader(lambda: pd.DataFrame({'code': ['US.A']}))
+    cache.get_or_load(('US.A', '2025-01-17'), loader)
+    cache.get_or_load(('US.A', '2025-01-17'), loader)
+    assert loader.calls == 1
+    time.sleep(0.1)
+    cache.get_or_load(('US.A', '2025-01-17'), loader)
+    assert loader.calls == 2
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['expirations'] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = api.ChainSnapshotCache(ttl=60, max_entries=2)
+    for key in ('a', 'b'):
+        cache.put((key,), pd.DataFrame({'code': [key]}))
+    cache.get_or_load(('a',), lambda: None)  # 命中，a变为最近使用
+    cache.put(('c',), pd.DataFrame({'code': ['c']}))
+
+    loader = CountingLoader(lambda: pd.DataFrame({'code': ['b']}))
+    cache.get_or_load(('a',), loader)
+    cache.get_or_load(('b',), loader)
+    assert loader.calls == 1
+    assert cache.stats()['evictions'] == 2  # 先淘汰b，回源b时再淘汰c
+
+def test_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache = api.ChainSnapshotCache(ttl=60)
+
+    def fail():
+        raise ConnectionError("连接OpenD失败")
+
+    errors = []
+
+    def fetch():
+        try:
+            cache.get_or_load(('US.A',), CountingLoader(fail, delay=0.1))
+        except ConnectionError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(errors) == 4
+
+    with pytest.raises(ConnectionError):
+        cache.get_or_load(('US.A',), fail)
+    stats = cache.stats()
+    assert stats['entries'] == 0 and stats['load_failures'] == 2
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""历史快照：写入后按时间点取回完整期权链，按合约读取时间序列，合并小文件后结果不变"""
+
+import time
+
+import pandas as pd
+import pytest
+
+import option_chain_api as api
+from conftest import STOCK_CODE
+
+pytest.importorskip('pyarrow')
+
+@pytest.fixture
+def chain(expiry):
+    return api.get_option_chain_data(STOCK_CODE, expiry)
+
+def as_written(df):
+    """写入时分类列还原为字符串"""
+    categories = [field for field, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    return df.astype({field: object for field in categories}).reset_index(drop=True)
+
+def shifted(df, amount):
+    df = df.copy()
+    df['last_price'] = df['last_price'] + amount
+    return df
+
+def test_as_of_returns_latest_snapshot_at_or_before_time(tmp_path, chain, expiry):
+    store = api.ChainHistoryStore(str(tmp_path))
+    now = time.time()
+    store._write_snapshot(now - 20, chain)
+    store._write_snapshot(now - 10, shifted(chain, 1.0))
+
+    assert store.as_of(STOCK_CODE, expiry, now - 30) is None
+    first = store.as_of(STOCK_CODE, expiry, now - 15)
+    latest = store.as_of(STOCK_CODE, expiry, now)
+    assert first.attrs['snapshot_time'] == pytest.approx(now - 20, abs=0.001)
+    pd.testing.assert_frame_equal(first.drop(columns='snapshot_ts'), as_written(chain), check_dtype=False)
+    pd.testing.assert_frame_equal(latest.drop(columns='snapshot_ts'), as_written(shifted(chain, 1.0)),
+                                  check_dtype=False)
+
+def test_series_reads_one_contract_across_snapshots_and_compaction(tmp_path, chain, expiry):
+    store = api.ChainHistoryStore(str(tmp_path))
+    contract = chain['code'].iloc[0]
+    now = time.time()
+    count = api.CHAIN_HISTORY_COMPACT_MIN_FILES
+    for i in range(count):
+        store._write_snapshot(now - count + i, shifted(chain, i))
+
+    expected = [chain['last_price'].iloc[0] + i for i in range(count)]
+    series = store.series(STOCK_CODE, expiry, contract, now - count - 1, now, fields=['last_price'])
+    assert list(series.columns) == ['snapshot_ts', 'last_price']
+    assert series['last_price'].tolist() == pytest.approx(expected)
+
+    store.compact()
+    stats = store.stats()
+    assert stats['compactions'] == 1 and stats['compacted_files'] == count and stats['files'] == 1
+    compacted = store.series(STOCK_CODE, expiry, contract, now - count - 1, now, fields=['last_price'])
+    pd.testing.assert_frame_equal(compacted, series)
+    assert store.as_of(STOCK_CODE, expiry, now)['last_price'].tolist() == pytest.approx(
+        shifted(chain, count - 1)['last_price'].tolist())
+
+def test_series_rejects_unknown_fields(tmp_path, chain, expiry):
+    store = api.ChainHistoryStore(str(tmp_path))
+    now = time.time()
+    store._write_snapshot(now, chain)
+    with pytest.raises(ValueError):
+        store.series(STOCK_CODE, expiry, chain['code'].iloc[0], now - 1, now + 1, fields=['bogus'])
+
+def test_background_writer_flushes_queue_on_stop(tmp_path, chain, expiry):
+    store = api.ChainHistoryStore(str(tmp_path))
+    store.start()
+    store.record(chain)
+    store.stop()
+    stats = store.stats()
+    assert stats['recorded'] == stats['written'] == 1 and stats['write_failures'] == 0
+    assert len(store.as_of(STOCK_CODE, expiry, time.time())) == len(chain)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""期权链推送：同一期权链的客户端共用订阅，只分发变化的字段，节流期间的增量按合约合并"""
+
+import asyncio
+import time
+
+import pandas as pd
+
+import option_chain_api as api
+from conftest import STOCK_CODE
+
+def make_hub():
+    return api.ChainPushHub(api.SubscriptionManager(api.opend_pool, quota=1000))
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def test_viewers_share_one_subscription_and_receive_only_changed_fields(expiry):
+    hub = make_hub()
+
+    async def scenario():
+        first = await hub.join(STOCK_CODE, expiry, interval=api.CHAIN_PUSH_MIN_INTERVAL)
+        second = await hub.join(STOCK_CODE, expiry, interval=api.CHAIN_PUSH_MIN_INTERVAL)
+        channel, viewer, snapshot = first
+        assert second[0] is channel
+        assert snapshot['options'] and snapshot['quote_status']['ready'] == len(snapshot['options'])
+
+        option = snapshot['options'][0]
+        code, last_price = option['code'], option['last_price']
+        hub.on_push(pd.DataFrame({'code': [code], 'last_price': [last_price], 'volume': [option['volume']]}))
+        hub.on_push(pd.DataFrame({'code': [code], 'last_price': [last_price + 1], 'volume': [option['volume']]}))
+        batches = [await viewer.next_batch(channel), await second[1].next_batch(channel)]
+
+        hub.leave(channel, viewer)
+        hub.leave(channel, second[1])
+        return code, last_price, batches
+
+    code, last_price, batches = asyncio.run(scenario())
+    for batch in batches:
+        assert batch == {code: {'last_price': last_price + 1}}
+
+    stats = hub.stats()
+    assert stats['channels'] == 0 and stats['contracts'] == 0 and stats['joins'] == 2
+    assert wait_until(lambda: hub.manager.stats()['referenced'] == 0)
+    assert hub.manager.stats()['leases'] == 1
+
+def test_deltas_are_merged_per_contract_while_throttled(expiry):
+    hub = make_hub()
+
+    async def scenario():
+        channel, viewer, snapshot = await hub.join(STOCK_CODE, expiry, interval=0.2)
+        option = snapshot['options'][0]
+        code = option['code']
+        hub.on_push(pd.DataFrame({'code': [code], 'last_price': [option['last_price'] + 1]}))
+        first = await viewer.next_batch(channel)
+        # 节流期间先后到达的两次推送合并为一条增量，后到的值覆盖先到的值
+        hub.on_push(pd.DataFrame({'code': [code], 'last_price': [option['last_price'] + 2], 'volume': [1]}))
+        hub.on_push(pd.DataFrame({'code': [code], 'last_price': [option['last_price'] + 3]}))
+        start = asyncio.get_running_loop().time()
+        second = await viewer.next_batch(channel)
+        waited = asyncio.get_running_loop().time() - start
+        coalesced = viewer.coalesced
+        hub.leave(channel, viewer)
+        return code, option, first, second, waited, coalesced
+
+    code, option, first, second, waited, coalesced = asyncio.run(scenario())
+    assert first == {code: {'last_price': option['last_price'] + 1}}
+    assert second == {code: {'last_price': option['last_price'] + 3, 'volume': 1}}
+    assert waited >= 0.1 and coalesced == 1
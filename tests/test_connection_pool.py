@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""连接池：连接复用、失效后重连、池满等待超时、建连失败退避"""
+
+import pytest
+
+import option_chain_api as api
+from opend_replay import ReplayQuoteContext, replay_context_factory, synthetic_data
+
+def make_pool(**kwargs):
+    factory = replay_context_factory(synthetic_data({'US.AAPL': 190.0}, n_expiries=1, strikes_per_expiry=4))
+    return api.OpenDConnectionPool('127.0.0.1', 0, context_factory=factory, **kwargs)
+
+def test_connection_is_reused_across_requests():
+    pool = make_pool()
+    seen = []
+    for _ in range(5):
+        with pool.connection() as ctx:
+            assert ctx.get_global_state()[0] == api.RET_OK
+            seen.append(ctx)
+    assert all(ctx is seen[0] for ctx in seen)
+    stats = pool.stats()
+    assert stats['connects'] == 1 and stats['acquires'] == 5
+    assert stats['size'] == 1 and stats['idle'] == 1 and stats['in_use'] == 0
+
+def test_broken_connection_is_replaced_after_failed_request():
+    pool = make_pool()
+    with pytest.raises(RuntimeError):
+        with pool.connection() as ctx:
+            ctx.close()  # 模拟请求中途断线
+            raise RuntimeError("请求失败")
+
+    # 失败后归还的连接借出前先做健康检查，失效则重连
+    with pool.connection() as fresh:
+        assert fresh is not ctx
+        assert fresh.get_global_state()[0] == api.RET_OK
+    stats = pool.stats()
+    assert stats['connects'] == 2 and stats['reconnects'] == 1
+    assert stats['health_check_failures'] == 1 and stats['size'] == 1
+
+def test_acquire_times_out_when_pool_is_exhausted():
+    pool = make_pool(max_size=1)
+    entry = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+    pool.release(entry)
+    assert pool.acquire(timeout=0.05) is entry
+    stats = pool.stats()
+    assert stats['timeouts'] == 1 and stats['size'] == 1
+
+def test_connect_failure_backs_off_and_frees_the_slot():
+    data = synthetic_data({'US.AAPL': 190.0}, n_expiries=1, strikes_per_expiry=4)
+
+    def closed_context():
+        ctx = ReplayQuoteContext(data)
+        ctx.close()
+        return ctx
+
+    pool = api.OpenDConnectionPool('127.0.0.1', 0, max_size=1, context_factory=closed_context)
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats['connect_failures'] == 1 and stats['backoff_remaining_s'] > 0
+    assert stats['size'] == 0 and stats['in_use'] == 0
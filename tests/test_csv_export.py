@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""CSV导出：缓存中的紧凑期权链生成的CSV须与原实现逐字节一致"""
+
+import asyncio
+import gzip
+
+import numpy as np
+import pytest
+
+import option_chain_api as api
+from benchmark import legacy_generate_csv_content, make_chain
+
+TARGET_DATE = '2025-01-17'
+
+def compact_chain(n_contracts, **kwargs):
+    chain, quotes = make_chain(n_contracts, **kwargs)
+    df = api.merge_quote_data(chain, quotes)
+    return df, api.OptionChainFrame.from_pandas(df).to_pandas()
+
+def irregular_chain():
+    """含NaN报价、只有单边合约的行权价和零昨收的期权链"""
+    chain, quotes = make_chain(120, quote_ratio=0.8)
+    chain = chain.drop(index=[1, 10, 51]).reset_index(drop=True)  # 部分行权价缺看跌或看涨
+    quotes.loc[::7, ['implied_volatility', 'delta', 'theta']] = np.nan
+    quotes.loc[::11, 'last_price'] = np.nan
+    quotes.loc[::13, 'volume'] = np.nan
+    quotes.loc[::5, 'prev_close_price'] = 0.0
+    df = api.merge_quote_data(chain, quotes)
+    return df, api.OptionChainFrame.from_pandas(df).to_pandas()
+
+def streamed(rows, compress=False):
+    response = api.csv_streaming_response(rows, 'chain.csv', compress)
+
+    async def collect():
+        return b''.join([chunk async for chunk in response.body_iterator])
+    body = asyncio.run(collect())
+    return gzip.decompress(body) if compress else body
+
+def test_compact_chain_csv_matches_legacy():
+    df, compact = compact_chain(400)
+    assert len(compact) == 400
+    assert api.format_csv_content(api.generate_csv_data(compact, TARGET_DATE)) == \
+        legacy_generate_csv_content(df, TARGET_DATE)
+
+@pytest.mark.parametrize('build', [lambda: compact_chain(400, n_expiries=1), irregular_chain])
+def test_csv_paths_are_byte_identical_to_legacy(build):
+    df, compact = build()
+    legacy = legacy_generate_csv_content(df, TARGET_DATE)
+    for frame in (df, compact):
+        assert api.format_csv_content(api.generate_csv_data(frame, TARGET_DATE)) == legacy
+        # 原下载接口以utf-8-sig写临时文件
+        expected = legacy.encode('utf-8-sig')
+        assert streamed(api.iter_csv_rows(frame, TARGET_DATE)) == expected
+        assert streamed(api.iter_csv_rows(frame, TARGET_DATE, chunk_rows=7), compress=True) == expected
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""到期日索引：未命中时查询并持久化，重启后从文件加载，按市场收盘时间判断过期并刷新"""
+
+import json
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import option_chain_api as api
+from conftest import STOCK_CODE
+
+def fail_queries(monkeypatch):
+    calls = []
+
+    def query(code):
+        calls.append(code)
+        return api.RET_ERROR, "网络连接断开"
+
+    monkeypatch.setattr(api, 'query_expiration_dates', query)
+    return calls
+
+def test_miss_is_queried_persisted_and_reloaded(tmp_path, monkeypatch):
+    path = str(tmp_path / 'expiration_index.json')
+    index = api.ExpirationIndex(path)
+    expiries = index.get(STOCK_CODE)
+    assert expiries and expiries == sorted(expiries)
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)[STOCK_CODE]['expirations'] == expiries
+
+    # 重启后直接从文件命中，不再查询OpenD
+    calls = fail_queries(monkeypatch)
+    restarted = api.ExpirationIndex(path)
+    restarted.load()
+    assert restarted.get(STOCK_CODE) == expiries
+    assert calls == []
+    stats = restarted.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 0
+
+def test_entries_older_than_market_rollover_are_refreshed(tmp_path, monkeypatch):
+    index = api.ExpirationIndex(str(tmp_path / 'expiration_index.json'))
+    monkeypatch.setattr(index, 'symbols', lambda: [STOCK_CODE])
+    rollover = api.last_rollover('US')
+    index._entries[STOCK_CODE] = (['2000-01-21'], rollover - 60)
+    assert index.stale() == [STOCK_CODE]
+
+    assert index.refresh_stale() == 1
+    assert index.stale() == []
+    assert index.lookup(STOCK_CODE) != ['2000-01-21']
+    assert index._entries[STOCK_CODE][1] >= rollover
+
+def test_failed_refresh_keeps_previous_expirations(tmp_path, monkeypatch):
+    index = api.ExpirationIndex(str(tmp_path / 'expiration_index.json'))
+    monkeypatch.setattr(index, 'symbols', lambda: [STOCK_CODE])
+    index._entries[STOCK_CODE] = (['2000-01-21'], 0.0)
+    fail_queries(monkeypatch)
+    assert index.refresh_stale() == 0
+    assert index.lookup(STOCK_CODE) == ['2000-01-21']
+    assert index.stats()['refresh_failures'] == 1
+
+def test_corrupt_index_file_is_ignored(tmp_path):
+    path = tmp_path / 'expiration_index.json'
+    path.write_text('{"US.AAPL": ', encoding='utf-8')
+    index = api.ExpirationIndex(str(path))
+    index.load()
+    assert index.lookup(STOCK_CODE) is None
+
+def test_rollover_follows_exchange_close():
+    zone = ZoneInfo('America/New_York')
+    before = datetime(2025, 3, 12, 16, 0, tzinfo=zone).timestamp()
+    after = datetime(2025, 3, 12, 17, 0, tzinfo=zone).timestamp()
+    assert api.last_rollover('US', before) == datetime(2025, 3, 11, 16, 30, tzinfo=zone).timestamp()
+    assert api.last_rollover('US', after) == datetime(2025, 3, 12, 16, 30, tzinfo=zone).timestamp()
+    # 同一时刻港股当天的收盘刷新已经过去，美股的还没到
+    hk_rollover = datetime(2025, 3, 12, 16, 30, tzinfo=ZoneInfo('Asia/Hong_Kong')).timestamp()
+    assert api.last_rollover('HK', before) == hk_rollover > api.last_rollover('US', before)
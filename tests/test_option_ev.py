@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""期望价值计算：与前端calculateExpectedValue的数值积分一致，缓存中的紧凑期权链（到期日为分类列）也要能直接计算"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import option_chain_api as api
+from benchmark import js_expected_value
+from opend_replay import synthetic_data
+
+def compact_chain():
+    data = synthetic_data({'US.AAPL': 190.0}, n_expiries=2, strikes_per_expiry=40)
+    quotes = data.quotes.reset_index(drop=True)
+    merged = api.merge_quote_data(data.chains, quotes)
+    return api.OptionChainFrame.from_pandas(merged).to_pandas()
+
+def test_compute_option_ev_on_compact_chain():
+    chain = compact_chain()
+    assert len(chain) >= 50
+    assert chain['strike_time'].dtype == 'category'
+
+    ev = api.compute_option_ev(chain, 190.0)
+    assert len(ev) == len(chain)
+    assert np.isfinite(ev['expected_value']).all()
+    assert (ev['days_to_expiry'] >= 0).all() and (ev['days_to_expiry'] > 0).any()
+
+def test_ev_route(client, expiry):
+    from conftest import STOCK_CODE
+    response = client.post("/api/ev", json={"stock_code": STOCK_CODE, "target_date": expiry})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"], body
+
+def ev_cases(underlying_price=100.0):
+    """看涨/看跌、价内/价外、不同波动率和涨跌幅的合约"""
+    rows = []
+    for option_type, sign in (('CALL', 1), ('PUT', -1)):
+        for strike in (70.0, 85.0, 95.0, 100.0, 105.0, 115.0, 130.0):
+            moneyness = sign * (underlying_price - strike) / underlying_price
+            delta = sign * min(0.98, max(0.02, 0.5 + moneyness * 2.5))
+            mid = max(0.05, sign * (underlying_price - strike) if moneyness > 0 else 0.0) + 2.0
+            rows.append({
+                'code': f"US.TEST{option_type[0]}{int(strike)}", 'option_type': option_type,
+                'strike_price': strike, 'strike_time': '2025-01-17',
+                'high_price': mid * 1.05, 'low_price': mid * 0.95,
+                'last_price': mid, 'prev_close_price': mid * (0.9 if strike % 10 else 1.2),
+                'delta': delta, 'implied_volatility': 25.0 + abs(moneyness) * 60,
+            })
+    return pd.DataFrame(rows)
+
+@pytest.mark.parametrize('days', [0.5, 1, 7, 30, 90])
+def test_ev_matches_frontend_integral(days):
+    df = ev_cases()
+    expected = js_expected_value(df, 100.0, days)
+    actual = api.compute_option_ev(df, 100.0, days)['expected_value'].to_numpy()
+    # 前端左矩形积分本身有约0.1%的离散误差
+    np.testing.assert_allclose(actual, expected, rtol=1e-3, atol=1e-2)
+
+def test_ev_treats_implied_volatility_as_percent():
+    df = ev_cases().assign(implied_volatility=0.8)
+    ev = api.compute_option_ev(df, 100.0, 30)
+    np.testing.assert_allclose(ev['implied_volatility'], 0.008)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""隐含波动率求解：深度价内、低波动率的合约也要给出能复现价格的结果"""
+
+import numpy as np
+
+from option_pricing import IV_MIN, bs_price, implied_volatility
+
+def test_implied_volatility_solves_every_priced_contract():
+    spot, rate, size = 100.0, 0.04, 1000
+    rng = np.random.default_rng(size)
+    is_call = rng.random(size) < 0.5
+    strike = spot * rng.uniform(0.6, 1.4, size)
+    t = rng.uniform(1 / 365, 1.0, size)
+    sigma = rng.uniform(0.08, 1.2, size)
+    price = bs_price(is_call, spot, strike, t, rate, sigma)
+    keep = price > 0.01
+    is_call, strike, t, price = is_call[keep], strike[keep], t[keep], price[keep]
+
+    solved = implied_volatility(price, is_call, spot, strike, t, rate)
+    assert not np.isnan(solved).any()
+    assert np.max(np.abs(bs_price(is_call, spot, strike, t, rate, solved) - price)) <= 1e-6 * spot
+
+def test_implied_volatility_at_intrinsic_and_invalid_prices():
+    is_call = np.array([False, True, True])
+    strike = np.array([140.0, 100.0, 100.0])
+    t = np.array([0.05, 0.5, 0.5])
+    intrinsic = strike[0] * np.exp(-0.04 * t[0]) - 100.0
+    price = np.array([intrinsic, 150.0, -1.0])  # 无时间价值、高于标的价格、负价格
+    solved = implied_volatility(price, is_call, 100.0, strike, t, 0.04)
+    assert solved[0] == IV_MIN
+    assert np.isnan(solved[1:]).all()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""批量报价：只有个别合约出错时才二分定位，断线和超频直接抛出"""
+
+import pandas as pd
+import pytest
+
+import option_chain_api as api
+
+class FakeQuoteContext:
+    def __init__(self, bad_codes=(), error=None):
+        self.bad_codes = set(bad_codes)
+        self.error = error
+        self.calls = 0
+
+    def get_stock_quote(self, codes):
+        self.calls += 1
+        if self.error:
+            return api.RET_ERROR, self.error
+        if self.bad_codes & set(codes):
+            return api.RET_ERROR, '未知股票'
+        return api.RET_OK, pd.DataFrame({'code': codes})
+
+CODES = [f'US.AAPL{i:03d}' for i in range(16)]
+
+def test_unknown_code_is_isolated_by_bisection():
+    ctx = FakeQuoteContext(bad_codes=[CODES[5]])
+    data, failed = api.BulkQuoteFetcher()._request(ctx, CODES)
+    assert failed == [CODES[5]]
+    assert sorted(data['code']) == sorted(set(CODES) - {CODES[5]})
+
+@pytest.mark.parametrize('error', ['网络连接断开', '请求频率太高'])
+def test_connection_and_frequency_errors_are_raised_without_bisection(error):
+    ctx = FakeQuoteContext(error=error)
+    with pytest.raises(ConnectionError):
+        api.BulkQuoteFetcher()._request(ctx, CODES, retries=1)
+    assert ctx.calls == 1
+
+def test_other_errors_leave_chunk_unquoted_without_bisection():
+    ctx = FakeQuoteContext(error='内部错误')
+    data, failed = api.BulkQuoteFetcher()._request(ctx, CODES)
+    assert data is None and failed == CODES
+    assert ctx.calls == 1
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""等待推送就绪：推送到达即返回，达到比例提前返回，超时时报告缺失合约"""
+
+import time
+
+import pandas as pd
+
+import option_chain_api as api
+from opend_replay import ReplayFaults, replay_context_factory, synthetic_data
+
+DATA = synthetic_data({'US.AAPL': 190.0}, n_expiries=1, strikes_per_expiry=4)
+CODES = DATA.chains['code'].tolist()
+
+def make_manager(push_delay=0.0):
+    factory = replay_context_factory(DATA, ReplayFaults(push_delay=push_delay), quota=100)
+    return api.SubscriptionManager(api.OpenDConnectionPool('127.0.0.1', 0, context_factory=factory), quota=100)
+
+def test_returns_as_soon_as_first_pushes_arrive():
+    with make_manager(push_delay=0.05).acquire(CODES) as lease:
+        status = lease.wait_ready(timeout=5)
+    assert status['ready'] == status['total'] == len(CODES)
+    assert not status['timed_out'] and status['missing'] == []
+    assert status['waited_ms'] < 2000
+
+def test_times_out_and_reports_missing_contracts():
+    with make_manager(push_delay=1.0).acquire(CODES) as lease:
+        start = time.monotonic()
+        status = lease.wait_ready(timeout=0.1)
+        assert time.monotonic() - start < 0.9
+    assert status['timed_out'] and status['ready'] == 0
+    assert sorted(status['missing']) == sorted(CODES)
+
+def test_fraction_returns_before_every_contract_has_pushed():
+    tracker = api.QuotePushTracker()
+    tracker.dispatch(pd.DataFrame({'code': CODES[:len(CODES) // 2]}))
+    start = time.monotonic()
+    status = tracker.wait_ready(CODES, fraction=0.5, timeout=2)
+    assert time.monotonic() - start < 1
+    assert not status['timed_out'] and status['ready'] == len(CODES) // 2
+    assert sorted(status['missing']) == sorted(CODES[len(CODES) // 2:])
+
+def test_unsubscribable_contracts_count_as_missing():
+    with make_manager().acquire(CODES[:1] + ['US.UNKNOWN']) as lease:
+        status = lease.wait_ready(timeout=1)
+    assert status['total'] == 2 and status['ready'] == 1
+    assert status['missing'] == ['US.UNKNOWN'] and status['unsubscribed'] == ['US.UNKNOWN']
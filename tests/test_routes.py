@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""接口端到端测试：不只检查状态码，也检查响应体确实带回了期权链数据"""
+
+import option_chain_api as api
+from conftest import STOCK_CODE
+
+def test_option_chain_returns_contracts(client, expiry):
+    response = client.post("/api/option-chain", json={"stock_code": STOCK_CODE, "target_date": expiry})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"], body
+    assert body["data"]["options"], body["message"]
+
+def test_option_chain_etag_not_modified(client, expiry):
+    chain = {"stock_code": STOCK_CODE, "target_date": expiry}
+    first = client.post("/api/option-chain", json=chain)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    second = client.post("/api/option-chain", json=chain, headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+
+def test_option_chain_applies_filters_to_single_expiry(client, expiry):
+    chain = {"stock_code": STOCK_CODE, "target_date": expiry}
+    full = client.post("/api/option-chain", json=chain).json()["data"]["options"]
+    response = client.post("/api/option-chain", json={**chain, "option_type": "CALL", "atm_strikes": 3})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"], body
+    options = body["data"]["options"]
+    assert options and len(options) < len(full)
+    assert {option["option_type"] for option in options} == {"CALL"}
+
+def test_term_structure_returns_expiries(client):
+    response = client.post("/api/term-structure", json={"stock_code": STOCK_CODE, "max_expiries": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"], body
+    assert body["data"]["options"]
+    assert response.headers["etag"]
+
+def test_metrics_renders_prometheus_text(client, expiry):
+    client.post("/api/option-chain", json={"stock_code": STOCK_CODE, "target_date": expiry})
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "optionchain_request_duration_seconds_bucket" in response.text
+
+def test_risk_route_prices_positions(client, expiry):
+    chain = client.post("/api/option-chain", json={"stock_code": STOCK_CODE, "target_date": expiry}).json()
+    code = chain["data"]["options"][0]["code"]
+    position = {"stock_code": STOCK_CODE, "target_date": expiry, "code": code, "quantity": -1}
+    response = client.post("/api/risk", json={"positions": [position]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["success"], body
+    assert "var" in body["data"]
+
+def test_risk_route_rejects_too_many_vol_shocks(client, expiry):
+    position = {"stock_code": STOCK_CODE, "target_date": expiry, "code": "US.AAPL", "quantity": -1}
+    response = client.post("/api/risk", json={"positions": [position], "vol_shocks": [0.0] * 100})
+    assert response.status_code == 400
+
+def test_risk_route_rejects_bad_underlying_prices(client, expiry):
+    position = {"stock_code": STOCK_CODE, "target_date": expiry, "code": "US.AAPL", "quantity": -1}
+    for prices in ({"NOT_A_STOCK": 190.0}, {"US.aapl": 190.0}, {STOCK_CODE: 0}, {STOCK_CODE: -5.0}):
+        response = client.post("/api/risk", json={"positions": [position], "underlying_prices": prices})
+        assert response.status_code == 400, prices
+
+def test_generate_csv_saves_local_file(client, expiry, tmp_path):
+    response = client.post("/api/generate-csv", params={"save_local": True, "save_path": str(tmp_path)},
+                           json={"stock_code": STOCK_CODE, "target_date": expiry})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["csv_content"].count("\n") >= data["rows"] > 0
+    with open(data["local_file"], 'rb') as f:
+        assert len(f.read()) == data["file_size"]
+
+def test_scan_metrics_resolve_market_per_symbol(client):
+    assert api.scan_symbols(api.ScanRequest(symbols=["HK.00700", STOCK_CODE, "bad code"])) == ["HK.00700", STOCK_CODE]
+    response = client.post("/api/scan", json={"symbols": ["HK.00700", STOCK_CODE], "max_expiries": 1})
+    assert response.status_code == 200
+    metrics = client.get("/api/metrics").text
+    assert 'route="/api/scan",method="POST",status="200",market="MIXED"' in metrics
+    assert 'stage="chain",route="/api/scan",market="US"' in metrics
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""OpenD调度：限额内直接放行，限额用尽时按优先级排队，相同的进行中调用只执行一次"""
+
+import threading
+import time
+
+import option_chain_api as api
+
+def make_scheduler(calls, seconds):
+    return api.OpenDScheduler({'get_option_chain': (calls, seconds)}, api.StageLimiter(api.OPEND_STAGE_LIMITS))
+
+def test_full_quota_is_available_without_waiting():
+    scheduler = make_scheduler(10, 30)
+    start = time.monotonic()
+    for i in range(10):
+        assert scheduler.call('get_option_chain', lambda: (api.RET_OK, i)) == (api.RET_OK, i)
+    assert time.monotonic() - start < 0.5
+    assert scheduler.stats()['interfaces']['get_option_chain']['used'] == 10
+
+def test_interactive_calls_go_first_when_quota_is_exhausted():
+    scheduler = make_scheduler(2, 0.3)
+    order = []
+
+    def run(tag, priority):
+        with api.opend_priority(priority):
+            scheduler.call('get_option_chain', lambda: (api.RET_OK, order.append(tag)))
+
+    for i in range(2):
+        run(f'warm{i}', 'interactive')
+    threads = [threading.Thread(target=run, args=(f'scan{i}', 'scan')) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    threads += [threading.Thread(target=run, args=('ui', 'interactive'))]
+    threads[-1].start()
+    for thread in threads:
+        thread.join(5)
+    assert order[:3] == ['warm0', 'warm1', 'ui']
+
+def test_identical_calls_in_flight_are_merged():
+    scheduler = make_scheduler(10, 30)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return api.RET_OK, 'chain'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        scheduler.call('get_option_chain', slow, key=('US.AAPL',)))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results == [(api.RET_OK, 'chain')] * 4
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""订阅管理：订阅往返不持有锁，并发请求不重复订阅同一合约"""
+
+import threading
+
+import option_chain_api as api
+
+class SlowSubscribeContext:
+    def __init__(self):
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+        self.subscribed = []
+        self.unsubscribe_error = None
+
+    def set_handler(self, handler):
+        pass
+
+    def get_global_state(self):
+        return api.RET_OK, {}
+
+    def subscribe(self, codes, subtypes, **kwargs):
+        self.started.set()
+        self.proceed.wait(5)
+        self.subscribed.extend(codes)
+        return api.RET_OK, None
+
+    def unsubscribe(self, codes, subtypes):
+        if self.unsubscribe_error:
+            return api.RET_ERROR, self.unsubscribe_error
+        return api.RET_OK, None
+
+    def close(self):
+        pass
+
+def make_manager(ctx, quota=100):
+    pool = api.OpenDConnectionPool('127.0.0.1', 0, context_factory=lambda: ctx)
+    return api.SubscriptionManager(pool, quota=quota)
+
+def test_subscribe_round_trip_does_not_hold_the_lock():
+    ctx = SlowSubscribeContext()
+    manager = make_manager(ctx)
+    leases = []
+    first = threading.Thread(target=lambda: leases.append(manager.acquire(['US.A', 'US.B'])))
+    first.start()
+    assert ctx.started.wait(5)
+
+    # 订阅进行中仍可读取状态，占位已计入额度
+    stats = manager.stats()
+    assert stats['subscribed'] == 2 and stats['in_flight'] == 2
+
+    # 请求同一合约的并发请求等待结果后复用，而不是重复订阅
+    second = threading.Thread(target=lambda: leases.append(manager.acquire(['US.B'])))
+    second.start()
+    ctx.proceed.set()
+    first.join(5)
+    second.join(5)
+
+    assert sorted(ctx.subscribed) == ['US.A', 'US.B']
+    assert sorted(len(lease.codes) for lease in leases) == [1, 2]
+    stats = manager.stats()
+    assert stats['in_flight'] == 0 and stats['referenced'] == 2
+    for lease in leases:
+        lease.release()
+    assert manager.stats()['referenced'] == 0
+
+def test_failed_eviction_does_not_subscribe_past_quota(monkeypatch):
+    monkeypatch.setattr(api, 'SUBSCRIPTION_MIN_SECONDS', 0)
+    ctx = SlowSubscribeContext()
+    ctx.proceed.set()
+    manager = make_manager(ctx, quota=2)
+    manager.acquire(['US.A', 'US.B']).release()
+
+    ctx.unsubscribe_error = '网络繁忙'
+    lease = manager.acquire(['US.C'])
+    assert 'US.C' not in ctx.subscribed
+    assert lease.codes == [] and lease.failed == ['US.C']
+    stats = manager.stats()
+    assert stats['subscribed'] == 2 and stats['in_flight'] == 0
+    assert stats['over_quota'] == 1 and stats['evictions'] == 0